@@ -10,8 +10,15 @@ Author: Erel Segal-Halevi
 Since: 2023-07
 """
 
+import concurrent.futures, contextlib, functools, itertools, os, tempfile
 import numpy as np
 from fairpyx import Instance, AgentBundleValueMatrix, validate_allocation, allocation_is_fractional, AllocationBuilder, ExplanationLogger
+from fairpyx.utils.profiling import Profile, profiling
+from fairpyx.utils.result_cache import ResultCache
+from fairpyx.utils.cancellation import CancellationToken
+
+import logging
+logger = logging.getLogger(__name__)
 
 def divide(
     algorithm: callable,
@@ -21,6 +28,12 @@ def divide(
     item_capacities:  any = None,  # default is 1 per course
     agent_conflicts:  any = None,
     item_conflicts:   any = None,
+    output: str = "dict",
+    profile: bool = False,
+    cache: any = None,
+    deadline: float = None,
+    max_iterations: int = None,
+    cancellation: CancellationToken = None,
     **kwargs
 ):
     """
@@ -32,6 +45,22 @@ def divide(
     :param valuations: any structure that maps an agent and an item to a value.
     :param agent_capacities: any structure that maps an agent to an integer capacity.
     :param item_capacities: any structure that maps an item to an integer capacity.
+    :param output: "dict" (default) for a dict mapping each agent to a sorted list of items;
+                   "matrix" for an AllocationMatrix: a scipy.sparse matrix (agents x items) with maps from agent and item names to rows and columns.
+    :param profile: if True, return a pair (allocation, Profile), where the Profile (see fairpyx.utils.profiling) contains
+                    the wall time of each stage of the run, and the number of give and effective_value calls, LP/MIP solves and matching/flow computations,
+                    with the wall time of each solve and each matching.
+    :param cache: a ResultCache (see fairpyx.utils.result_cache), or a path to its directory.
+                  If given, the result is looked up by the fingerprint of the instance, the algorithm and the kwargs (including the output format and the seed, if any),
+                  and the algorithm runs only on a miss. Runs with an explanation_logger, or with kwargs that have no canonical form, are not cached.
+                  Use only with deterministic algorithms, or with an explicit seed.
+                  Results of runs that stopped before converging are not stored.
+    :param deadline: a time limit in seconds for iterative algorithms (e.g. tabu_search, find_ACEEI_with_EFTB).
+    :param max_iterations: an iteration limit for iterative algorithms.
+    :param cancellation: a CancellationToken (see fairpyx.utils.cancellation), instead of deadline and max_iterations.
+                  It can be cancelled from another thread; after the run, its `converged` attribute tells whether the algorithm converged,
+                  or stopped early and gave its best-so-far allocation.
+                  The budget is passed to the algorithm as `alloc.cancellation`; algorithms that are not iterative ignore it.
     :param kwargs: any other arguments expected by `algorithm`.
 
     :return: an allocation.
@@ -42,21 +71,156 @@ def divide(
     >>> item_capacities  = {"c1": 2, "c2": 1, "c3": 1}
     >>> divide(algorithm=round_robin, agent_capacities=agent_capacities, item_capacities=item_capacities, valuations=valuations)
     {'Alice': ['c1', 'c3'], 'Bob': ['c2']}
+    >>> allocation = divide(algorithm=round_robin, agent_capacities=agent_capacities, item_capacities=item_capacities, valuations=valuations, output="matrix")
+    >>> allocation.matrix.toarray(), allocation.agent_index, allocation.item_index
+    (array([[1, 0, 1],
+           [0, 1, 0]]), {'Alice': 0, 'Bob': 1}, {'c1': 0, 'c2': 1, 'c3': 2})
+    >>> allocation.to_dict()
+    {'Alice': ['c1', 'c3'], 'Bob': ['c2']}
+
+    >>> allocation, stats = divide(algorithm=round_robin, agent_capacities=agent_capacities, item_capacities=item_capacities, valuations=valuations, profile=True)
+    >>> allocation
+    {'Alice': ['c1', 'c3'], 'Bob': ['c2']}
+    >>> list(stats.stage_times), stats.counters["give"]
+    (['instance', 'builder', 'algorithm', 'output'], 3)
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     divide(algorithm=round_robin, valuations=valuations, cache=directory)
+    ...     allocation, stats = divide(algorithm=round_robin, valuations=valuations, cache=directory, profile=True)
+    ...     allocation, list(stats.stage_times)
+    {'Alice': ['c1', 'c3'], 'Bob': ['c2']}
+    ({'Alice': ['c1', 'c3'], 'Bob': ['c2']}, ['instance', 'cache'])
     """
-    if instance is None:
-        instance = Instance(valuations=valuations, agent_capacities=agent_capacities, item_capacities=item_capacities, agent_conflicts=agent_conflicts, item_conflicts=item_conflicts)
-    alloc = AllocationBuilder(instance)
+    if output not in ("dict", "matrix"):
+        raise ValueError(f"Unknown output format {output}: expected 'dict' or 'matrix'")
+    stats = Profile() if profile else None
+    stage = stats.stage if profile else _no_stage
+    if isinstance(cache, (str, os.PathLike)):
+        cache = ResultCache(cache)
+    if cancellation is None:
+        cancellation = CancellationToken(deadline, max_iterations)
+    elif deadline is not None or max_iterations is not None:
+        raise ValueError("Give either a cancellation token, or deadline/max_iterations, but not both")
     explanation_logger:ExplanationLogger = kwargs.get("explanation_logger", None)
-    if explanation_logger:
-        # instance.explain_valuations(explanation_logger)
-        explanation_logger.explain_valuations(instance)
-    algorithm(alloc, **kwargs)
-    allocation = alloc.sorted()
-    if explanation_logger:
-        explanation_logger.info("")
-        explanation_logger.explain_allocation(allocation, instance)
-        # AgentBundleValueMatrix(instance, allocation, normalized=True).explain(explanation_logger)
-    return allocation
+    with profiling(stats) if profile else contextlib.nullcontext():   # when not profiling, an enclosing profile (if any) keeps counting.
+        with stage("instance"):
+            if instance is None:
+                instance = Instance(valuations=valuations, agent_capacities=agent_capacities, item_capacities=item_capacities, agent_conflicts=agent_conflicts, item_conflicts=item_conflicts)
+        cache_key = None
+        if cache is not None and not explanation_logger:
+            with stage("cache"):
+                try:
+                    cache_key = cache.key(instance, algorithm, dict(kwargs, output=output))
+                except TypeError as error:
+                    logger.warning("The result of %s is not cached: %s", algorithm.__name__, error)
+                else:
+                    result = cache.get(cache_key)
+            if cache_key is not None and result is not None:
+                return (result, stats) if profile else result
+        with stage("builder"):
+            alloc = AllocationBuilder(instance)
+            alloc.cancellation = cancellation
+        if explanation_logger:
+            with stage("explain_valuations"):
+                # instance.explain_valuations(explanation_logger)
+                explanation_logger.explain_valuations(instance)
+        with stage("algorithm"):
+            algorithm(alloc, **kwargs)
+        if cancellation.converged is False:
+            logger.warning("%s stopped after %d iterations without converging; returning its best allocation so far", algorithm.__name__, cancellation.iterations)
+        with stage("output"):
+            allocation = alloc.sorted() if output=="dict" or explanation_logger else None
+            result = allocation if output=="dict" else alloc.allocation_matrix()
+        if explanation_logger:
+            with stage("explain_allocation"):
+                explanation_logger.info("")
+                explanation_logger.explain_allocation(allocation, instance)
+                # AgentBundleValueMatrix(instance, allocation, normalized=True).explain(explanation_logger)
+        if cache_key is not None and cancellation.converged is not False:
+            with stage("cache"):
+                cache.put(cache_key, result)
+    return (result, stats) if profile else result
+
+
+def _no_stage(name:str):
+    return contextlib.nullcontext()
+
+
+def divide_many(
+    algorithms: list,
+    instances: list,
+    max_workers: int = None,
+    ordered: bool = False,
+    output: str = "dict",
+    **kwargs
+):
+    """
+    Apply each of the given algorithms to each of the given instances, in a pool of processes.
+    Generates triples (algorithm, instance_index, allocation) as soon as each run finishes.
+
+    Each instance is saved once (with `Instance.save`) to a temporary directory, and the workers load it memory-mapped,
+    so the instance arrays are shared through the page cache rather than pickled per task.
+    Agent and item names must be JSON-serializable.
+    At most 2*max_workers runs are submitted at any time, so the memory used for pending results is bounded.
+
+    :param algorithms: a list of algorithms (as in `divide`); they must be picklable, e.g., module-level functions.
+    :param instances: a list of instances.
+    :param max_workers: the number of worker processes (default: the number of CPUs). If 0, the runs are done serially in the current process.
+    :param ordered: if True, the results are generated in a deterministic order: for each instance, for each algorithm.
+    :param output: "dict" or "matrix", as in `divide`.
+    :param kwargs: any other arguments passed to `divide` for every run.
+
+    >>> from fairpyx.algorithms.picking_sequence import round_robin, serial_dictatorship
+    >>> instances = [Instance(valuations={"Alice": {"c1":2, "c2": 3}, "Bob": {"c1": 4, "c2": 5}}), Instance(valuations=[[1,2],[3,4]], agent_capacities=2, item_capacities=2)]
+    >>> for algorithm, instance_index, allocation in divide_many([round_robin, serial_dictatorship], instances, max_workers=2, ordered=True):
+    ...     print(algorithm.__name__, instance_index, allocation)
+    round_robin 0 {'Alice': ['c2'], 'Bob': ['c1']}
+    serial_dictatorship 0 {'Alice': ['c1', 'c2'], 'Bob': []}
+    round_robin 1 {0: [0, 1], 1: [0, 1]}
+    serial_dictatorship 1 {0: [0, 1], 1: [0, 1]}
+    >>> sorted((algorithm.__name__, index) for algorithm, index, _ in divide_many([round_robin], instances, max_workers=0))
+    [('round_robin', 0), ('round_robin', 1)]
+    """
+    tasks = [(algorithm, instance_index) for instance_index in range(len(instances)) for algorithm in algorithms]
+    if max_workers == 0:
+        for algorithm, instance_index in tasks:
+            yield algorithm, instance_index, divide(algorithm, instance=instances[instance_index], output=output, **kwargs)
+        return
+    max_workers = max_workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory, concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        paths = []
+        for instance_index, instance in enumerate(instances):
+            paths.append(os.path.join(directory, str(instance_index)))
+            instance.save(paths[-1])
+        pending = {}     # maps each submitted future to its task; in submission order.
+        next_tasks = iter(tasks)
+        def submit_tasks():
+            for algorithm, instance_index in itertools.islice(next_tasks, 2*max_workers - len(pending)):
+                future = executor.submit(_divide_saved_instance, algorithm, paths[instance_index], output, kwargs)
+                pending[future] = (algorithm, instance_index)
+        submit_tasks()
+        while pending:
+            if ordered:
+                finished = [next(iter(pending))]
+                finished[0].result()
+            else:
+                finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                algorithm, instance_index = pending.pop(future)
+                yield algorithm, instance_index, future.result()
+            submit_tasks()
+
+
+def _divide_saved_instance(algorithm: callable, path: str, output: str, kwargs: dict):
+    # Runs in a worker process of divide_many.
+    return divide(algorithm, instance=_load_shared_instance(path), output=output, **kwargs)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_shared_instance(path: str) -> Instance:
+    # Each worker process loads each instance once, memory-mapped, and reuses it in later tasks.
+    return Instance.load(path, mmap=True)
 
 
 def divide_with_priorities(
@@ -41,6 +41,10 @@ def find_ACEEI_with_EFTB(alloc: AllocationBuilder, **kwargs):
               2 for contested EF-TB
     :return final courses prices, final budgets, final distribution
 
+    The price updates stop early when `alloc.cancellation` (see `divide(..., deadline=..., max_iterations=...)`) expires;
+    then the bundles with the lowest clearing error found so far are given, as far as the item capacities allow,
+    and `alloc.cancellation.converged` is False.
+
     >>> from fairpyx.adaptors import divide
 
     >>> from fairpyx.utils.test_utils import stringify
@@ -119,6 +123,20 @@ def find_ACEEI_with_EFTB(alloc: AllocationBuilder, **kwargs):
     >>> stringify(divide(find_ACEEI_with_EFTB, instance=instance, initial_budgets=initial_budgets,
     ... delta=delta, epsilon=epsilon, t=t))
     "{avi:['x', 'z'], beni:['y', 'z']}"
+
+    Anytime result: after two price updates, the prices have not cleared yet, so the bundles with the lowest clearing error
+    are given as far as the capacities allow
+    >>> from fairpyx.utils.cancellation import CancellationToken
+    >>> instance = Instance(
+    ...     valuations={"avi":{"x":1, "y":2, "z":4}, "beni":{"x":2, "y":3, "z":1}},
+    ...     agent_capacities=2,
+    ...     item_capacities={"x":1, "y":1, "z":2})
+    >>> token = CancellationToken(max_iterations=2)
+    >>> stringify(divide(find_ACEEI_with_EFTB, instance=instance, initial_budgets={"avi":2, "beni":3},
+    ... delta=0.5, epsilon=0.5, t=EFTBStatus.NO_EF_TB, cancellation=token))
+    "{avi:['y', 'z'], beni:['x']}"
+    >>> token
+    CancellationToken(iterations=2, converged=False)
     """
     # allocation = [[0 for _ in range(instance.num_of_agents)] for _ in range(instance.num_of_items)]
     # 1) init prices vector to be 0
@@ -133,23 +151,38 @@ def find_ACEEI_with_EFTB(alloc: AllocationBuilder, **kwargs):
     prices = {key: 0 for key in alloc.remaining_items()}
     clearing_error = 1
     new_budgets = {}
+    best_clearing_error, best_budgets, best_prices = float("inf"), {}, prices
     while clearing_error:
         # 2) 𝜖-budget perturbation
         new_budgets, clearing_error, allocation, excess_demand_per_course = find_budget_perturbation(initial_budgets,
                                                                                                      epsilon, prices,
                                                                                                      alloc.instance, t)
+        is_cleared = np.allclose(clearing_error, 0)
+        if clearing_error < best_clearing_error:
+            best_clearing_error, best_budgets, best_prices = clearing_error, new_budgets, dict(prices)
         # 3) If ∥𝒛˜(𝒖,𝒄, 𝒑, 𝒃) ∥2 = 0, terminate with 𝒑* = 𝒑, 𝒃* = 𝒃
-        if np.allclose(clearing_error, 0):
+        if is_cleared:
+            break
+        if alloc.cancellation.step():
+            logger.info("BUDGET EXHAUSTED: giving the bundles with the lowest clearing error so far, %s", best_clearing_error)
             break
         # 4) update 𝒑 ← 𝒑 + 𝛿𝒛˜(𝒖,𝒄, 𝒑, 𝒃), then go back to step 2.
         for key in prices:
             prices[key] += delta * excess_demand_per_course[key]
         logger.info("UPDATE PRICES: %s", prices)
 
-    logger.info("Clearing error 0!")
-    for student, (price, bundle) in new_budgets.items():
-        logger.info(f"Giving {bundle} to {student}")
-        alloc.give_bundle(student, bundle)
+    alloc.cancellation.converged = bool(np.allclose(best_clearing_error, 0))
+    new_budgets, prices = best_budgets, best_prices
+    if alloc.cancellation.converged:
+        logger.info("Clearing error 0!")
+        for student, (price, bundle) in new_budgets.items():
+            logger.info(f"Giving {bundle} to {student}")
+            alloc.give_bundle(student, bundle)
+    else:   # the bundles may over-demand some items: each student gets the items that still have remaining capacity.
+        for student, (price, bundle) in new_budgets.items():
+            bundle = [item for item in bundle if item in alloc.remaining_item_capacities and (student, item) not in alloc.remaining_conflicts]
+            logger.info(f"Giving {bundle} to {student}")
+            alloc.give_bundle(student, bundle)
 
     # print the final budget (b* = new_budgets) for each student
     final_budget = ""
@@ -230,12 +263,13 @@ def student_best_bundle_per_budget(prices: dict, instance: Instance, epsilon: an
         #  the current combination meets the requirement we will give it more weight
         large_num = instance.agent_maximum_value(student)
 
-        # Define a lambda function that calculates the valuation of a combination
-        valuation_function = lambda combination: instance.agent_bundle_value(student, combination) + (
-            large_num if len(combination) == instance.agent_capacity(student) else 0)
+        # Calculate the valuations of all combinations at once
+        combinations_values = instance.agent_bundle_values(student, combinations_courses_list) + np.array(
+            [large_num if len(combination) == capacity else 0 for combination in combinations_courses_list])
 
         # Sort the combinations_set based on their valuations in descending order
-        combinations_courses_sorted = sorted(combinations_courses_list, key=valuation_function, reverse=True)
+        combinations_courses_sorted = [combination for combination, _ in
+                                       sorted(zip(combinations_courses_list, combinations_values), key=lambda pair: pair[1], reverse=True)]
 
         # Setting the min and max budget according to the definition
         min_budget = initial_budgets[student] - epsilon
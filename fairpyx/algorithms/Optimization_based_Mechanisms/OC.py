@@ -9,6 +9,7 @@ import cvxpy
 
 from fairpyx import Instance, AllocationBuilder, ExplanationLogger
 import logging
+from fairpyx.utils.profiling import timed
 import cvxpy as cp
 import fairpyx.algorithms.Optimization_based_Mechanisms.optimal_functions as optimal
 logger = logging.getLogger(__name__)
@@ -48,7 +49,8 @@ def OC_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogger
     constraints_Z1 = optimal.notExceedtheCapacity(x,alloc) + optimal.numberOfCourses(x, alloc, alloc.remaining_agent_capacities)
 
     problem = cp.Problem(objective_Z1, constraints=constraints_Z1)
-    result_Z1 = problem.solve()
+    with timed("lp_solve"):
+        result_Z1 = problem.solve()
     logger.info("result_Z1 - the optimum ranking: %d", result_Z1)
 
     x = cvxpy.Variable((len(alloc.remaining_items()), len(alloc.remaining_agents())), boolean=True)  # Is there a func which zero all the matrix?
@@ -65,7 +67,8 @@ def OC_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogger
 
     try:
         problem = cp.Problem(objective_Z2, constraints=constraints_Z2)
-        result_Z2 = problem.solve()
+        with timed("lp_solve"):
+            result_Z2 = problem.solve()
         logger.info("result_Z2 - the optimum bids: %d", result_Z2)
 
         # Check if the optimization problem was successfully solved
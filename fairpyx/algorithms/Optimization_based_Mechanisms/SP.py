@@ -53,12 +53,11 @@ def SP_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogger
             for current_agent in agents_who_need_an_item_in_current_iteration:  # check the course with the max bids for each agent in the set (who didnt get a course in this round)
 
 
-                potential_items_for_agent = alloc.remaining_items_for_agent(current_agent)       # set of all the courses that have places sub the courses the agent got
-                if len(potential_items_for_agent) == 0:
+                best_item_for_agent = alloc.best_item_for_agent(current_agent)
+                if best_item_for_agent is None:
                     agents_with_no_potential_items.add(current_agent)
                 else:
-                    map_agent_to_best_item[current_agent] = max(potential_items_for_agent,
-                                                                key=lambda item: alloc.effective_value(current_agent, item))  # for each agent save the course with the max bids from the potential courses only
+                    map_agent_to_best_item[current_agent] = best_item_for_agent  # for each agent save the course with the max bids from the potential courses only
                     current_course = map_agent_to_best_item[current_agent]
                     pop_course_that_moved_bids = []
                     if current_agent in map_student_to_course_with_no_seats_and_the_bids:
@@ -8,6 +8,7 @@ import cvxpy
 from fairpyx import Instance, AllocationBuilder, ExplanationLogger
 import cvxpy as cp
 import logging
+from fairpyx.utils.profiling import timed
 import fairpyx.algorithms.Optimization_based_Mechanisms.optimal_functions as optimal
 import fairpyx.algorithms.Optimization_based_Mechanisms.TTC_O as TTC_O
 logger = logging.getLogger(__name__)
@@ -112,7 +113,8 @@ def SP_O_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogge
         constraints_Wt1 += condition_14
 
         problem = cp.Problem(objective_Wt1, constraints=constraints_Wt1)
-        result_Wt1 = problem.solve()  # This is the optimal value of program (12)(13)(14).
+        with timed("lp_solve"):
+            result_Wt1 = problem.solve()  # This is the optimal value of program (12)(13)(14).
 
         logger.info("result_Wt1 - the optimum Wt1: %s", result_Wt1)
 
@@ -126,7 +128,8 @@ def SP_O_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogge
         constraints_Wt2 += condition_14
 
         problem = cp.Problem(objective_Wt2, constraints=constraints_Wt2)
-        result_Wt2 = problem.solve()  # This is the optimal price
+        with timed("lp_solve"):
+            result_Wt2 = problem.solve()  # This is the optimal price
 
         logger.info("result_Wt2 - the optimum Wt2: %s", result_Wt2)
 
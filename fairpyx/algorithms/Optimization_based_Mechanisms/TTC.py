@@ -44,12 +44,11 @@ def TTC_function(alloc: AllocationBuilder, explanation_logger: ExplanationLogger
             # 1. Create the dict map_agent_to_best_item
             agents_with_no_potential_items = set()  # agents that don't need courses to be removed later
             for current_agent in agents_who_need_an_item_in_current_iteration:    # check the course with the max bids for each agent in the set (who didnt get a course in this round)
-                potential_items_for_agent = alloc.remaining_items_for_agent(current_agent)       # set of all the courses that have places sub the courses the agent got
-                if len(potential_items_for_agent) == 0:
+                best_item_for_agent = alloc.best_item_for_agent(current_agent)
+                if best_item_for_agent is None:
                     agents_with_no_potential_items.add(current_agent)
                 else:
-                    map_agent_to_best_item[current_agent] = max(potential_items_for_agent,
-                                                          key=lambda item: alloc.effective_value(current_agent, item))  # for each agent save the course with the max bids from the potential courses only
+                    map_agent_to_best_item[current_agent] = best_item_for_agent  # for each agent save the course with the max bids from the potential courses only
 
             logger.debug("map_agent_to_best_item = %s", map_agent_to_best_item)
             for current_agent in agents_with_no_potential_items:  # remove agents that don't need courses
@@ -11,6 +11,7 @@ import fairpyx.algorithms.Optimization_based_Mechanisms.optimal_functions as opt
 
 from fairpyx import Instance, AllocationBuilder, ExplanationLogger
 import logging
+from fairpyx.utils.profiling import timed
 import cvxpy as cp
 logger = logging.getLogger(__name__)
 
@@ -28,7 +29,8 @@ def roundTTC_O(alloc, logger, agent_item_value_func, flag_if_use_alloc_in_func):
     constraints_Zt1 = optimal.notExceedtheCapacity(x, alloc) + optimal.numberOfCourses(x, alloc, 1)
 
     problem = cp.Problem(objective_Zt1, constraints=constraints_Zt1)
-    result_Zt1 = problem.solve()  # This is the optimal value of program (6)(7)(8)(9).
+    with timed("lp_solve"):
+        result_Zt1 = problem.solve()  # This is the optimal value of program (6)(7)(8)(9).
     logger.info("result_Zt1 - the optimum ranking: %d", result_Zt1)
 
     # Write and solve new program for Zt2 (10)(11)(7)(8)
@@ -47,7 +49,8 @@ def roundTTC_O(alloc, logger, agent_item_value_func, flag_if_use_alloc_in_func):
 
     try:
         problem = cp.Problem(objective_Zt2, constraints=constraints_Zt2)
-        result_Zt2 = problem.solve()
+        with timed("lp_solve"):
+            result_Zt2 = problem.solve()
         logger.info("result_Zt2 - the optimum bids: %d", result_Zt2)
 
     except Exception as e:
@@ -1,5 +1,7 @@
 import cvxpy
 import cvxpy as cp
+import numpy as np
+import scipy.sparse
 
 # check that the number of students who took course j does not exceed the capacity of the course
 def notExceedtheCapacity(var, alloc):
@@ -30,37 +32,34 @@ def give_items_according_to_allocation_matrix(alloc, allocation_matrix, logger):
     x_values = allocation_matrix.value
     logger.info("x_values - the optimum allocation:\n%s", x_values)
 
-    # Initialize a dictionary where each student will have an empty list
-    assign_map_courses_to_student = {student: [] for student in alloc.remaining_agents()}
-
-    # Iterate over students and courses to populate the lists
-    for i, student in enumerate(alloc.remaining_agents()):
-        for j, course in enumerate(alloc.remaining_items()):
-            if x_values[j, i] == 1:
-                assign_map_courses_to_student[student].append(course)
-
-    # Assign the courses to students based on the dictionary
-    for student, courses in assign_map_courses_to_student.items():
-        for course in courses:
-            alloc.give(student, course, logger)
+    # Map the rows (remaining courses) and columns (remaining students) of x to the columns and rows of the instance, and give all seats at once
+    instance = alloc.instance
+    remaining_item_columns = np.array([instance.item_index[course] for course in alloc.remaining_items()], dtype=int)
+    remaining_agent_rows = np.array([instance.agent_index[student] for student in alloc.remaining_agents()], dtype=int)
+    course_positions, student_positions = np.nonzero(x_values == 1)
+    allocation = scipy.sparse.csr_matrix(
+        (np.ones(len(course_positions), dtype=int), (remaining_agent_rows[student_positions], remaining_item_columns[course_positions])),
+        shape=(instance.num_of_agents, instance.num_of_items))
+    alloc.give_matrix(allocation, logger)
 
 
 # creating the rank matrix for the linear programing ((6) (17) in the article) using for TTC-O, SP-O and OC
 def createRankMat(alloc, logger):
-    rank_mat = [[0 for _ in range(len(alloc.remaining_agents()))] for _ in range(len(alloc.remaining_items()))]
+    rank_mat = np.zeros((len(alloc.remaining_items()), len(alloc.remaining_agents())), dtype=int)
 
     # sort the course to each student by the bids (best bids = higher rank)
+    instance = alloc.instance
+    remaining_items = list(alloc.remaining_items())
+    remaining_item_columns = [instance.item_index[course] for course in remaining_items]
     for i, student in enumerate(alloc.remaining_agents()):
-        map_courses_to_student = alloc.remaining_items_for_agent(student)
-        sorted_courses = sorted(map_courses_to_student, key=lambda course: alloc.effective_value(student, course))
+        potential_rows = [j for j, course in enumerate(remaining_items) if (student, course) not in alloc.remaining_conflicts]
+        bids = instance.valuation_matrix[instance.agent_index[student], remaining_item_columns][potential_rows]
 
-        #fill the mat
-        for j, course in enumerate(alloc.remaining_items()):
-            if course in sorted_courses:
-                rank_mat[j][i] = sorted_courses.index(course) + 1
+        #fill the mat: the rank of each course is its position in the ascending (stable) order of the bids
+        rank_mat[potential_rows, i] = np.argsort(np.argsort(bids, kind="stable"), kind="stable") + 1
 
     logger.debug("Rank matrix:\n%s", rank_mat)
-    return rank_mat
+    return rank_mat.tolist()
 
 # sum the optimal rank to be sure the optimal bids agree with the optimal rank (6) (10) (17) (19)
 def sumOnRankMat(alloc, rank_mat, var):
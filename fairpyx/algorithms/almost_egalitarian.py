@@ -239,7 +239,7 @@ def almost_egalitarian_allocation(alloc: AllocationBuilder, surplus_donation:boo
                     fractional_allocation[agent_min_weight][item_min_weight] = 0
                     fractional_allocation_graph.remove_edge(agent_min_weight,item_min_weight)
                     if not agent_min_weight in alloc.remaining_agent_capacities:
-                        explanation_logger.info("You have received %s and you have no remaining capacity.", alloc.bundles[agent_min_weight], agents=agent_min_weight)
+                        explanation_logger.info("You have received %s and you have no remaining capacity.", sorted(alloc.bundles[agent_min_weight]), agents=agent_min_weight)
                         remove_agent_from_graph(agent_min_weight)
                     explanation_logger.debug("\nfractional_allocation_graph: %s", fractional_allocation_graph)
                     found_item_leaf = True
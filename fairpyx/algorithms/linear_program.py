@@ -5,6 +5,7 @@ from contextlib import redirect_stdout
 import os
 
 from fairpyx import Instance
+from fairpyx.utils.profiling import timed
 from fairpyx.algorithms import ACEEI
 
 # from fairpyx.algorithms.ACEEI import EFTBStatus
@@ -77,34 +78,40 @@ def check_envy(instance: Instance, student: str, other_student: str, a: dict, t:
     """
     result = []
     # check if student envies in other_student
-    for bundle_i in a[student].values():
-        for bundle_j in a[other_student].values():
-            original_bundle_j = bundle_j
-            if t == ACEEI.EFTBStatus.CONTESTED_EF_TB:
-                bundle_j = list(bundle_j)  # Convert bundle_j to a list
-
-                # Iterate through keys in prices
-                for key, value in prices.items():
-                    # Check if value is 0 and key is not already in bundle_j
-                    if value == 0 and key not in bundle_j:
-                        # Add key to bundle_j
-                        bundle_j.append(key)
-
-                # logger.info(f"----------{t}---------")
-                # logger.info(f"bundle_j of {other_student} = {bundle_j}")
-
-                sorted_bundle_j = sorted(bundle_j, key=lambda course: instance.agent_item_value(student, course),
-                                         reverse=True)
-                # logger.info(f"sorted_bundle_j by {student} valuation = {sorted_bundle_j}")
-
-                sorted_bundle_j = sorted_bundle_j[:instance.agent_capacity(student)]
-                # logger.info(f"instance.agent_capacity = {instance.agent_capacity(student)}")
-                # logger.info(f"sorted_bundle_j of {student} = {sorted_bundle_j}")
-
-                bundle_j = tuple(sorted_bundle_j)
-                # logger.info(f"finish update bundle_j of {student} = {bundle_j}")
-
-            if instance.agent_bundle_value(student, bundle_j) > instance.agent_bundle_value(student, bundle_i):
+    bundles_i = list(a[student].values())
+    bundles_j = []
+    for bundle_j in a[other_student].values():
+        if t == ACEEI.EFTBStatus.CONTESTED_EF_TB:
+            bundle_j = list(bundle_j)  # Convert bundle_j to a list
+
+            # Iterate through keys in prices
+            for key, value in prices.items():
+                # Check if value is 0 and key is not already in bundle_j
+                if value == 0 and key not in bundle_j:
+                    # Add key to bundle_j
+                    bundle_j.append(key)
+
+            # logger.info(f"----------{t}---------")
+            # logger.info(f"bundle_j of {other_student} = {bundle_j}")
+
+            sorted_bundle_j = sorted(bundle_j, key=lambda course: instance.agent_item_value(student, course),
+                                     reverse=True)
+            # logger.info(f"sorted_bundle_j by {student} valuation = {sorted_bundle_j}")
+
+            sorted_bundle_j = sorted_bundle_j[:instance.agent_capacity(student)]
+            # logger.info(f"instance.agent_capacity = {instance.agent_capacity(student)}")
+            # logger.info(f"sorted_bundle_j of {student} = {sorted_bundle_j}")
+
+            bundle_j = tuple(sorted_bundle_j)
+            # logger.info(f"finish update bundle_j of {student} = {bundle_j}")
+        bundles_j.append(bundle_j)
+
+    # evaluate all bundles of both students by the valuation of student, at once
+    values_i = instance.agent_bundle_values(student, bundles_i)
+    values_j = instance.agent_bundle_values(student, bundles_j)
+    for bundle_i, value_i in zip(bundles_i, values_i):
+        for original_bundle_j, value_j in zip(a[other_student].values(), values_j):
+            if value_j > value_i:
                 result.append((bundle_i, original_bundle_j))
 
     return result
@@ -263,7 +270,7 @@ def optimize_model(a: dict, instance: Instance, prices: dict, t: Enum, initial_b
 
     # Optimize the model
     with open(os.devnull, 'w') as devnull:
-        with redirect_stdout(devnull):
+        with redirect_stdout(devnull), timed("lp_solve"):
             model.optimize()
 
     if model.num_solutions:
@@ -14,7 +14,9 @@ import networkz as nx
 from prtpy import partition, objectives as obj, outputtypes as out
 from prtpy.partitioning import integer_programming
 
-from fairpyx import Instance, AllocationBuilder, divide, ExplanationLogger, AgentBundleValueMatrix
+from fairpyx import Instance, AllocationBuilder, divide, ExplanationLogger
+from fairpyx.satisfaction import envy_statistics
+from fairpyx.utils.profiling import timed
 
 logger = logging.getLogger(__name__)
 
@@ -372,8 +374,9 @@ def approx_leximin_partition(valuation: dict, n: int = 3, result: out.OutputType
     >>> approx_leximin_partition({0:2,1:2,2:2,3:2},result=out.PartitionAndSumsTuple)
     (array([2., 2., 4.]), [[2], [1], [0, 3]])
     """
-    prt = partition(algorithm=integer_programming.optimal, numbins=n, items=valuation, outputtype=result,
-                    objective=obj.MaximizeSmallestSum)
+    with timed("lp_solve"):
+        prt = partition(algorithm=integer_programming.optimal, numbins=n, items=valuation, outputtype=result,
+                        objective=obj.MaximizeSmallestSum)
     return prt
 
 
@@ -455,21 +458,12 @@ def create_envy_graph(instance: Instance, allocation: dict,
     def _(code: str):
         return TEXTS[code][explanation_logger.language]
 
-    abvm = AgentBundleValueMatrix(instance, allocation, normalized=False)
-    # abvm valuation example:
-    # valuations = {"Alice": {"c1": 11, "c2": 22}, "Bob": {"c1": 33, "c2": 44}}
-    # allocation = {"Alice": ["c1"], "Bob": ["c2"]}
-    # {'Alice': {'Alice': 11, 'Bob': 22}, 'Bob': {'Alice': 33, 'Bob': 44}}
-    abvm.make_envy_matrix()
-    mat: dict[str, dict[str, int]] = abvm.envy_matrix
-    # mat example: {'Alice': {'Alice': 0, 'Bob': 11}, 'Bob': {'Alice': -11, 'Bob': 0}}
-    # Alice envies Bob
-    envy_edges = [
-        (agent, other)
-        for agent, agent_status in mat.items()
-        for other, envy in agent_status.items()
-        if envy > 0
-    ]
+    # The envy matrix is computed in row blocks; only its positive entries (the envy edges) are kept.
+    # e.g., for valuations = {"Alice": {"c1": 11, "c2": 22}, "Bob": {"c1": 33, "c2": 44}} and allocation = {"Alice": ["c1"], "Bob": ["c2"]},
+    # the envy of Alice in Bob is 22-11=11, so there is an edge Alice->Bob.
+    envy_edges_matrix = envy_statistics(instance, allocation).envy_edges
+    agents = list(instance.agents)
+    envy_edges = [(agents[row], agents[column]) for row,column in zip(*envy_edges_matrix.nonzero())]
     explanation_logger.debug("\t" + _("envy_edges"), envy_edges)
     graph = nx.DiGraph()
     graph.add_nodes_from(instance.agents)
@@ -586,7 +580,8 @@ def maximum_matching(instance: Instance, agents: list, items: list):
     mat = [[instance.agent_item_value(agent, item) for item in items] for agent in agents]
 
     from scipy.optimize import linear_sum_assignment
-    row_ind, col_ind = linear_sum_assignment(mat, maximize=True)
+    with timed("matching"):
+        row_ind, col_ind = linear_sum_assignment(mat, maximize=True)
     agent_ind = [agents[i] for i in row_ind]
     items_ind = [items[i] for i in col_ind]
     matching = list(zip(agent_ind, items_ind))
@@ -36,12 +36,11 @@ def picking_sequence(alloc: AllocationBuilder, agent_order:list):
         if not agent in alloc.remaining_agent_capacities:
             logger.info("No more agents with capacities")
             continue
-        potential_items_for_agent = set(alloc.remaining_items_for_agent(agent))
-        if len(potential_items_for_agent)==0:
+        best_item_for_agent = alloc.best_item_for_agent(agent)
+        if best_item_for_agent is None:
             logger.info("Agent %s cannot pick any more items: remaining=%s, bundle=%s", agent, alloc.remaining_item_capacities, alloc.bundles[agent])
             alloc.remove_agent_from_loop(agent)
             continue
-        best_item_for_agent = max(potential_items_for_agent, key=lambda item: alloc.effective_value(agent,item))
         # logger.info("\nAgent %s picks item %s", agent, best_item_for_agent)
         alloc.give(agent, best_item_for_agent, logger)
 
@@ -94,6 +93,13 @@ def round_robin(alloc: AllocationBuilder, agent_order:list=None):
     >>> instance  = Instance(agent_capacities=agent_capacities, item_capacities=course_capacities, valuations=valuations, item_conflicts={"c1": ['c2'], "c2": ['c1']})
     >>> divide(round_robin, instance=instance)
     {'Alice': ['c1', 'c3'], 'Bob': ['c1', 'c3'], 'Chana': ['c2', 'c3'], 'Dana': ['c2', 'c3']}
+
+    # Sparse valuations (each agent sorts only its nonzero values):
+    >>> instance = Instance(agent_capacities=agent_capacities, item_capacities=course_capacities, valuations={"Alice": {"c1": 10}, "Bob": {"c3": 5}, "Chana": {}, "Dana": {"c2": 1}})
+    >>> divide(round_robin, instance=instance.to_sparse())
+    {'Alice': ['c1', 'c2'], 'Bob': ['c2', 'c3'], 'Chana': ['c1', 'c3'], 'Dana': ['c2', 'c3']}
+    >>> divide(round_robin, instance=instance) == divide(round_robin, instance=instance.to_sparse())
+    True
     """
     if agent_order is None: agent_order = list(alloc.remaining_agents())
     picking_sequence(alloc, agent_order)
@@ -32,6 +32,9 @@ def tabu_search(alloc: AllocationBuilder, **kwargs):
    :param initial_budgets: Students' initial budgets, b_0∈[1,1+β]^n
    :param beta: creates the range of initial_budgets
 
+   The search stops early when `alloc.cancellation` (see `divide(..., deadline=..., max_iterations=...)`) expires;
+   then the allocation with the lowest clearing error found so far is given, and `alloc.cancellation.converged` is False.
+
    :return final courses prices, final distribution
 
     >>> from fairpyx.adaptors import divide
@@ -89,6 +92,15 @@ def tabu_search(alloc: AllocationBuilder, **kwargs):
     >>> beta = 5
     >>> stringify(divide(tabu_search, instance=instance, initial_budgets=initial_budgets,beta=beta, delta={0.34}))
     "{ami:['x', 'y'], tami:['y', 'z'], tzumi:['z']}"
+
+    Anytime result: the search stops after one iteration, with the best allocation found so far
+    >>> from fairpyx.utils.cancellation import CancellationToken
+    >>> random.seed(4341)
+    >>> token = CancellationToken(max_iterations=1)
+    >>> stringify(divide(tabu_search, instance=instance, initial_budgets=initial_budgets,beta=beta, delta={0.34}, cancellation=token))
+    "{ami:['x', 'y'], tami:['y', 'z'], tzumi:[]}"
+    >>> token
+    CancellationToken(iterations=1, converged=False)
     """
     logger.info("START ALGORITHM")
     logger.info("1) Let 𝒑 ← uniform(1, 1 + 𝛽)^𝑚, H ← ∅")
@@ -137,6 +149,11 @@ def tabu_search(alloc: AllocationBuilder, **kwargs):
             best_prices = prices
             best_norma = norma
 
+        if alloc.cancellation.step():
+            logger.info("\n-- BUDGET EXHAUSTED: returning the best allocation so far --")
+            break
+
+    alloc.cancellation.converged = bool(np.allclose(best_norma, 0))
     logger.info(f"\nfinal prices p* = {best_prices}")
     logger.info(f"allocation is: {best_allocation}")
     for student, bundle in best_allocation.items():
@@ -304,14 +321,14 @@ def student_best_bundles(prices: dict, instance: Instance, initial_budgets: dict
         for r in range(1, capacity + 1):
             combinations_courses_list.extend(combinations(instance.items, r))
 
-        valuation_function = lambda combination: instance.agent_bundle_value(student, combination)
-        combinations_courses_sorted = sorted(combinations_courses_list, key=valuation_function, reverse=True)
+        # Evaluate all combinations at once, and sort them by their valuations in descending order
+        combinations_values = instance.agent_bundle_values(student, combinations_courses_list)
+        combinations_courses_sorted = sorted(zip(combinations_courses_list, combinations_values), key=lambda pair: pair[1], reverse=True)
 
         max_valuation = -1
-        for combination in combinations_courses_sorted:
+        for combination, current_valuation in combinations_courses_sorted:
             price_combination = sum(prices[course] for course in combination)
             if price_combination <= initial_budgets[student]:
-                current_valuation = valuation_function(combination)
                 if current_valuation >= max_valuation:
                     if current_valuation > max_valuation:
                         all_combinations[student] = []
@@ -436,8 +453,8 @@ def find_all_equivalent_prices(instance: Instance, initial_budgets: dict, alloca
         original_utility = instance.agent_bundle_value(student, allocation[student])
         current_alloc = False
 
-        for combination in combinations_courses_list:
-            current_utility = instance.agent_bundle_value(student, combination)
+        combinations_utilities = instance.agent_bundle_values(student, combinations_courses_list)
+        for combination, current_utility in zip(combinations_courses_list, combinations_utilities):
             sorted_combination = sorted(combination)  # Sort the combination
             sorted_alloc_student = sorted(allocation[student])
 
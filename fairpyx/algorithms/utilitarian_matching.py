@@ -40,6 +40,13 @@ def utilitarian_matching(alloc: AllocationBuilder):
     >>> map_agent_name_to_bundle = divide(utilitarian_matching, instance=instance)
     >>> stringify(map_agent_name_to_bundle)
     "{avi:['w', 'x', 'y', 'z'], beni:['w', 'x', 'y', 'z']}"
+
+    # Zero-value pairs are matched too, so dense and sparse valuations give the same allocation.
+    >>> instance = Instance(valuations={"avi": {"x":5, "y":0}, "beni": {"x":0, "y":3}}, agent_capacities=2, item_capacities=2)
+    >>> stringify(divide(utilitarian_matching, instance=instance))
+    "{avi:['x', 'y'], beni:['x', 'y']}"
+    >>> stringify(divide(utilitarian_matching, instance=instance.to_sparse()))
+    "{avi:['x', 'y'], beni:['x', 'y']}"
     """
     instance = alloc.remaining_instance()
     alloc.give_bundles(many_to_many_matching_using_network_flow(
@@ -3,18 +3,31 @@ Utils for post-processing allocations.
 """
 
 import numpy as np
-from collections import defaultdict
+import scipy.sparse
+from collections.abc import MutableSet, MutableMapping, Mapping, KeysView
+from contextlib import contextmanager
+from typing import NamedTuple
 from fairpyx import Instance 
+from fairpyx.instances import SubInstance
+from fairpyx.utils.profiling import current_profile
+from fairpyx.utils.cancellation import CancellationToken
 
 # The following constant is used as an item value, to indicate that this item must not be allocated to the agent.
 FORBIDDEN_ALLOCATION = -np.inf
 
 
-def validate_allocation(instance:Instance, allocation:dict, title:str=""):
+def validate_allocation(instance:Instance, allocation:dict, title:str="", report_all:bool=False, chunksize:int=None):
     """
     Validate that the given allocation is feasible for the given input-instance.
     Checks agent capacities, item capacities, and uniqueness of items.
 
+    The allocation is converted once into a sparse matrix of item counts (agents x items),
+    and all checks are done with array reductions on this matrix.
+
+    :param allocation: a dict mapping each agent to its bundle, or an AllocationMatrix.
+    :param report_all: if True, check everything, and raise a single ValueError that lists all violations. Otherwise, raise at the first violation.
+    :param chunksize: if given, the "no waste" check handles this many agents at a time, so that the memory is O(chunksize * num_of_items).
+
     >>> instance = Instance(
     ...   agent_capacities = {"Alice": 2, "Bob": 3}, 
     ...   item_capacities  = {"c1": 1, "c2": 2, "c3": 3}, 
@@ -39,40 +52,191 @@ def validate_allocation(instance:Instance, allocation:dict, title:str=""):
     ValueError: : Wasteful allocation:
     Item c2 has remaining capacity: 2>['Bob'].
     Agent Alice has remaining capacity: 2>['c1'].
+
+    >>> validate_allocation(instance, allocation = {"Alice": ["c1", "c1", "c3"], "Bob": ["c1"]}, title="All", report_all=True, chunksize=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: All: Agent Alice has capacity 2, but received more items: ['c1', 'c1', 'c3'].
+    Agent Alice received two or more copies of the same item. Bundle: ['c1', 'c1', 'c3'].
+    Item c1 has capacity 1, but is given to more agents: ['Alice', 'Alice', 'Bob'].
+    Wasteful allocation:
+    Item c3 has remaining capacity: 3>['Alice'].
+    Agent Bob has remaining capacity: 3>['c1'].
+
+    >>> validate_allocation(instance, AllocationMatrix.from_dict({"Alice": ["c1"], "Bob": ["c2","c3"]}, items=["c1", "c2", "c3"]))
+    Traceback (most recent call last):
+    ...
+    ValueError: : Wasteful allocation:
+    Item c2 has remaining capacity: 2>['Bob'].
+    Agent Alice has remaining capacity: 2>['c1'].
     """
+    violations = []
+    def violation(message:str):
+        if not report_all:
+            raise ValueError(f"{title}: {message}")
+        violations.append(message)
+
+    num_of_items = instance.num_of_items
+    if isinstance(allocation, AllocationMatrix):
+        agents = allocation.agents
+        counts = allocation.aligned_matrix(items=instance.items)
+        counts.sum_duplicates()
+        counts.eliminate_zeros()
+        bundle_sizes = np.asarray(counts.sum(axis=1)).ravel().astype(int)
+        rows = np.repeat(np.arange(len(agents)), np.diff(counts.indptr))   # rows and columns are positions in `agents` and in `instance.items`
+        rows, columns = np.repeat(rows, counts.data), np.repeat(counts.indices, counts.data)
+        bundles = _LazyBundles(counts, instance.item_list)
+    else:
+        agents = list(allocation.keys())
+        bundles = [allocation[agent] for agent in agents]
+        item_index = instance.item_index
+        bundle_sizes = np.fromiter((len(bundle) for bundle in bundles), dtype=int, count=len(agents))
+        rows = np.repeat(np.arange(len(agents)), bundle_sizes)           # rows and columns are positions in `agents` and in `instance.items`
+        columns = np.fromiter((item_index[item] for bundle in bundles for item in bundle), dtype=int, count=bundle_sizes.sum())
+        counts = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=int), (rows, columns)), shape=(len(agents), num_of_items))  # duplicates are summed
+    num_of_agents = len(agents)
+    agent_capacities = instance.agent_capacity_vector[np.fromiter((instance.agent_index[agent] for agent in agents), dtype=int, count=num_of_agents)]
+    item_capacities = instance.item_capacity_vector
+
+    def owners(column:int)->list:
+        return [agents[row] for row in rows[columns==column].tolist()]
 
     ### validate agent capacity and uniqueness:
-    agents_below_their_capacity = []
-    for agent,bundle in allocation.items():
-        agent_capacity = instance.agent_capacity(agent)
-        if len(bundle) > agent_capacity:
-            raise ValueError(f"{title}: Agent {agent} has capacity {agent_capacity}, but received more items: {bundle}.")
-        if len(set(bundle))!=len(bundle):
-            raise ValueError(f"{title}: Agent {agent} received two or more copies of the same item. Bundle: {bundle}.")
-        if len(bundle) < agent_capacity:
-            agents_below_their_capacity.append(agent)
-
-    ### validate item capacity:
-    map_item_to_list_of_owners = defaultdict(list)
-    items_below_their_capacity = []
-    for agent,bundle in allocation.items():
-        for item in bundle:
-            map_item_to_list_of_owners[item].append(agent)
-    for item,list_of_owners in map_item_to_list_of_owners.items():
-        item_capacity = instance.item_capacity(item)
-        if len(list_of_owners) > item_capacity:
-            raise ValueError(f"{title}: Item {item} has capacity {item_capacity}, but is given to more agents: {list_of_owners}.")
-        if len(list_of_owners) < item_capacity:
-            items_below_their_capacity.append(item)
-
-    ### validate no waste:
-    for agent in agents_below_their_capacity:
-        for item in items_below_their_capacity:
-            bundle = allocation[agent]
-            if item not in bundle and instance.agent_item_value(agent,item)>0:
-                item_message = f"Item {item} has remaining capacity: {instance.item_capacity(item)}>{map_item_to_list_of_owners[item]}."
-                agent_message = f"Agent {agent} has remaining capacity: {instance.agent_capacity(agent)}>{bundle}."
-                raise ValueError(f"{title}: Wasteful allocation:\n{item_message}\n{agent_message}")
+    num_of_distinct_items = np.diff(counts.indptr)
+    for row in np.flatnonzero((bundle_sizes > agent_capacities) | (num_of_distinct_items < bundle_sizes)).tolist():
+        if bundle_sizes[row] > agent_capacities[row]:
+            violation(f"Agent {agents[row]} has capacity {agent_capacities[row]}, but received more items: {bundles[row]}.")
+        if num_of_distinct_items[row] < bundle_sizes[row]:
+            violation(f"Agent {agents[row]} received two or more copies of the same item. Bundle: {bundles[row]}.")
+
+    ### validate item capacity (items are checked in the order in which they first appear in the allocation):
+    num_of_owners = np.asarray(counts.sum(axis=0)).ravel()
+    given_items, first_appearance = np.unique(columns, return_index=True)
+    given_items = given_items[np.argsort(first_appearance)]
+    appearance_rank = np.zeros(num_of_items, dtype=int)
+    appearance_rank[given_items] = np.arange(len(given_items))
+    for column in given_items.tolist():
+        if num_of_owners[column] > item_capacities[column]:
+            violation(f"Item {instance.item_list[column]} has capacity {item_capacities[column]}, but is given to more agents: {owners(column)}.")
+
+    ### validate no waste: an agent below its capacity should not have a positive value for an item given to some agents, but below its capacity
+    ### (agents are checked in the order of the allocation, and the items of each agent in the order in which they first appear in the allocation):
+    agents_below_their_capacity = np.flatnonzero(bundle_sizes < agent_capacities)
+    items_below_their_capacity = (num_of_owners > 0) & (num_of_owners < item_capacities)
+    chunksize = chunksize or max(len(agents_below_their_capacity), 1)
+    for start in range(0, len(agents_below_their_capacity), chunksize):
+        chunk_rows = agents_below_their_capacity[start:start+chunksize]
+        instance_rows = [instance.agent_index[agents[row]] for row in chunk_rows.tolist()]
+        allocated = counts[chunk_rows] > 0
+        if instance.is_sparse:
+            wasted = instance.sparse_valuation_matrix[instance_rows]
+            wasted.data = (wasted.data > 0) & items_below_their_capacity[wasted.indices]
+            wasted = (wasted - wasted.multiply(allocated)).tocsr()
+            wasted.eliminate_zeros()
+            wasted_positions, wasted_columns = wasted.nonzero()
+        else:
+            wasted = (instance.valuation_matrix[instance_rows] > 0) & items_below_their_capacity[None,:] & ~allocated.toarray()
+            wasted_positions, wasted_columns = np.nonzero(wasted)
+        order = np.lexsort((appearance_rank[wasted_columns], wasted_positions))
+        wasted_positions, wasted_columns = wasted_positions[order], wasted_columns[order]
+        for position,column in zip(wasted_positions.tolist(), wasted_columns.tolist()):
+            row = chunk_rows[position]
+            item_message = f"Item {instance.item_list[column]} has remaining capacity: {item_capacities[column]}>{owners(column)}."
+            agent_message = f"Agent {agents[row]} has remaining capacity: {agent_capacities[row]}>{bundles[row]}."
+            violation(f"Wasteful allocation:\n{item_message}\n{agent_message}")
+
+    if violations:
+        raise ValueError(f"{title}: " + "\n".join(violations))
+
+
+class AllocationMatrix(NamedTuple):
+    """
+    An allocation as a sparse matrix (agents x items), in which matrix[i,j] is the number of copies of item j given to agent i,
+    together with maps from the agent names to the rows and from the item names to the columns.
+
+    >>> allocation = AllocationMatrix.from_dict({"Alice": ["c2"], "Bob": ["c2", "c1"]})
+    >>> allocation.matrix.toarray()
+    array([[1, 0],
+           [1, 1]])
+    >>> allocation.agent_index, allocation.item_index
+    ({'Alice': 0, 'Bob': 1}, {'c2': 0, 'c1': 1})
+    >>> allocation.to_dict()
+    {'Alice': ['c2'], 'Bob': ['c1', 'c2']}
+    >>> matrix, agent_index, item_index = allocation
+    >>> allocation.aligned_matrix(agents=["Bob", "Alice"], items=["c1", "c2"]).toarray()
+    array([[1, 1],
+           [0, 1]])
+    """
+    matrix: scipy.sparse.csr_matrix
+    agent_index: dict
+    item_index: dict
+
+    @staticmethod
+    def from_dict(allocation:dict, agents:list=None, items:list=None)->"AllocationMatrix":
+        """
+        Convert an allocation (a dict mapping each agent to its bundle) into an AllocationMatrix.
+
+        :param agents, items (optional): the order of the rows and columns. Default: agents in the order of the allocation, items in order of appearance.
+        """
+        agent_index = {agent:index for index,agent in enumerate(allocation.keys() if agents is None else agents)}
+        item_index = {} if items is None else {item:index for index,item in enumerate(items)}
+        rows, columns = [], []
+        for agent,bundle in allocation.items():
+            row = agent_index[agent]
+            for item in bundle:
+                if items is None:
+                    item_index.setdefault(item, len(item_index))
+                rows.append(row); columns.append(item_index[item])
+        matrix = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=int), (rows, columns)), shape=(len(agent_index), len(item_index)))
+        return AllocationMatrix(matrix, agent_index, item_index)
+
+    @property
+    def agents(self)->list:
+        return sorted(self.agent_index, key=self.agent_index.__getitem__)
+
+    @property
+    def items(self)->list:
+        return sorted(self.item_index, key=self.item_index.__getitem__)
+
+    def to_dict(self)->dict:
+        """
+        Convert into a dict mapping each agent to the sorted list of its items, like the output of `divide`.
+        """
+        return dict(zip(self.agents, _LazyBundles(self.matrix.tocsr(), self.items, sort=True)))
+
+    def aligned_matrix(self, agents:list=None, items:list=None)->scipy.sparse.csr_matrix:
+        """
+        Return the matrix with rows ordered like the given agents and columns ordered like the given items (default: the current order).
+        Agents and items that are missing from the allocation get an empty row or column.
+        """
+        matrix = self.matrix.tocsr()
+        if agents is not None and list(agents) != self.agents:
+            rows = np.array([self.agent_index.get(agent, -1) for agent in agents], dtype=int)
+            selector = scipy.sparse.csr_matrix((np.ones(np.count_nonzero(rows>=0), dtype=int), (np.flatnonzero(rows>=0), rows[rows>=0])), shape=(len(rows), matrix.shape[0]))
+            matrix = (selector @ matrix).tocsr()
+        if items is not None and list(items) != self.items:
+            columns = np.array([self.item_index.get(item, -1) for item in items], dtype=int)
+            selector = scipy.sparse.csr_matrix((np.ones(np.count_nonzero(columns>=0), dtype=int), (columns[columns>=0], np.flatnonzero(columns>=0))), shape=(matrix.shape[1], len(columns)))
+            matrix = (matrix @ selector).tocsr()
+        return matrix.copy() if matrix is self.matrix else matrix
+
+
+class _LazyBundles:
+    # A sequence of bundles (lists of item names), built from the rows of a CSR matrix only when accessed.
+    def __init__(self, matrix:scipy.sparse.csr_matrix, item_list:list, sort:bool=False):
+        self.matrix, self.item_list, self.sort = matrix, item_list, sort
+
+    def __getitem__(self, row:int)->list:
+        matrix, item_list = self.matrix, self.item_list
+        start, end = matrix.indptr[row], matrix.indptr[row+1]
+        bundle = [item_list[column] for column,count in zip(matrix.indices[start:end].tolist(), matrix.data[start:end].tolist()) for _ in range(count)]
+        return sorted(bundle) if self.sort else bundle
+
+    def __len__(self)->int:
+        return self.matrix.shape[0]
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
 
 
 def rounded_allocation(allocation_matrix:dict, digits:int):
@@ -99,6 +263,238 @@ def allocation_is_fractional(allocation:dict)->bool:
     raise ValueError(f"Bundle format is unknown: {arbitrary_bundle}")
 
 
+class RemainingConflicts(MutableSet):
+    """
+    A set of (agent,item) pairs, stored as a boolean matrix with a row per agent and a column per item
+    (ordered like the agents and items of the instance). Pairs with an unknown agent or item are never contained.
+
+    >>> instance = Instance(valuations={"Alice": {"c1": 1, "c2": 2}, "Bob": {"c1": 3, "c2": 4}})
+    >>> conflicts = RemainingConflicts(instance, np.zeros((2,2), dtype=bool))
+    >>> conflicts
+    set()
+    >>> conflicts.add(("Bob", "c1"))
+    >>> conflicts, ("Bob", "c1") in conflicts, ("Bob", "c3") in conflicts, len(conflicts)
+    ({('Bob', 'c1')}, True, False, 1)
+    """
+    def __init__(self, instance:Instance, matrix:np.ndarray):
+        self.instance = instance
+        self.matrix = matrix
+        self.num_of_releases = 0    # number of pairs removed from the set; used to detect when an agent can get an item again.
+        self.journal = None         # if not None, a list to which undo-entries are appended (see AllocationBuilder.checkpoint).
+
+    def __contains__(self, pair)->bool:
+        agent,item = pair
+        agent_index, item_index = self.instance.agent_index, self.instance.item_index
+        if agent not in agent_index or item not in item_index:
+            return False
+        return bool(self.matrix[agent_index[agent], item_index[item]])
+
+    def __iter__(self):
+        agents, items = list(self.instance.agents), self.instance.item_list
+        for row,column in zip(*np.nonzero(self.matrix)):
+            yield (agents[row], items[column])
+
+    def __len__(self)->int:
+        return int(np.count_nonzero(self.matrix))
+
+    def add(self, pair):
+        agent,item = pair
+        self.set_cell(self.instance.agent_index[agent], self.instance.item_index[item], True)
+
+    def discard(self, pair):
+        if pair in self:
+            agent,item = pair
+            self.set_cell(self.instance.agent_index[agent], self.instance.item_index[item], False)
+
+    def set_cell(self, row:int, columns:any, value:bool):
+        """
+        Set the given cells in the given row to the given value, recording the old values in the journal (if any).
+        """
+        self.set_cells(row, columns, value)
+
+    def set_cells(self, rows:any, columns:any, value:bool):
+        """
+        Set the cells at the given rows and columns (as in numpy indexing) to the given value, recording the old values in the journal (if any).
+        """
+        if self.journal is not None:
+            self.journal.append((self.set_cells, rows, columns, self.matrix[rows, columns].copy()))
+        if np.any(self.matrix[rows, columns] & ~np.asarray(value)):
+            self.num_of_releases += 1
+        self.matrix[rows, columns] = value
+
+    def __repr__(self)->str:
+        return repr(set(self)) if len(self)>0 else "set()"
+
+
+class RemainingCapacities(MutableMapping):
+    """
+    A dict-like view of remaining capacities: maps each active name (agent or item) to its remaining capacity.
+    The capacities and the active flags are kept in numpy arrays, aligned with the given list of names.
+    Names are iterated in the order of the list, or in the order in which they were assigned (see `assign`).
+
+    >>> capacities = RemainingCapacities(["a", "b", "c"], {"a":0, "b":1, "c":2}, np.array([2, 0, 1]))
+    >>> capacities, len(capacities), "b" in capacities
+    ({'a': 2, 'c': 1}, 2, False)
+    >>> del capacities["a"]
+    >>> capacities["b"] = 5
+    >>> capacities
+    {'b': 5, 'c': 1}
+    >>> capacities.assign({"c": 3, "a": 1})
+    >>> capacities
+    {'c': 3, 'a': 1}
+    """
+    def __init__(self, names:list, index:dict, capacities:np.ndarray):
+        self.names, self.index = names, index
+        self.capacities = np.array(capacities, dtype=int)
+        self.active = self.capacities > 0
+        self.num_of_active = int(np.count_nonzero(self.active))
+        self.order = None     # None means the order of `names`; otherwise, a dict whose keys are the indices in iteration order.
+        self.num_of_releases = 0    # number of times an inactive name became active again.
+        self.journal = None         # if not None, a list to which undo-entries are appended (see AllocationBuilder.checkpoint).
+
+    def assign(self, mapping:dict):
+        """
+        Replace the entire contents by the given mapping, keeping its order.
+        """
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            journal.append((self._restore_all, self.capacities.copy(), self.active.copy(), self.num_of_active, self.order))
+        self.active[:] = False
+        self.num_of_active = 0
+        self.order = {}
+        for name,capacity in mapping.items():
+            self[name] = capacity
+        self.journal = journal
+
+    def _restore_all(self, capacities:np.ndarray, active:np.ndarray, num_of_active:int, order:dict):
+        self.capacities[:] = capacities
+        self.active[:] = active
+        self.num_of_active, self.order = num_of_active, order
+        self.num_of_releases += 1
+
+    def _restore(self, index:int, capacity:int, active:bool):
+        self.capacities[index] = capacity
+        if active and not self.active[index]:
+            self.active[index] = True
+            self.num_of_active += 1
+            self.num_of_releases += 1
+        elif not active and self.active[index]:
+            self.active[index] = False
+            self.num_of_active -= 1
+
+    def _record(self, index:int):
+        if self.journal is not None:
+            self.journal.append((self._restore, index, int(self.capacities[index]), bool(self.active[index])))
+
+    def deactivate(self, index:int):
+        if self.active[index]:
+            self._record(index)
+            self.active[index] = False
+            self.num_of_active -= 1
+
+    def subtract(self, indices:np.ndarray, amounts:np.ndarray):
+        """
+        Decrease the capacities at the given indices by the given amounts, and deactivate those that become non-positive.
+        """
+        if self.journal is not None:
+            self.journal.append((self._restore_many, indices, self.capacities[indices].copy(), self.active[indices].copy()))
+        self.capacities[indices] -= amounts
+        exhausted = indices[(self.capacities[indices] <= 0) & self.active[indices]]
+        self.active[exhausted] = False
+        self.num_of_active -= len(exhausted)
+
+    def _restore_many(self, indices:np.ndarray, capacities:np.ndarray, active:np.ndarray):
+        for index,capacity,is_active in zip(indices.tolist(), capacities.tolist(), active.tolist()):
+            self._restore(index, capacity, is_active)
+
+    def decrement(self, index:int):
+        """
+        Decrease the capacity at the given index by 1, and deactivate it if it becomes non-positive.
+        """
+        self._record(index)
+        self.capacities[index] -= 1
+        if self.capacities[index] <= 0 and self.active[index]:
+            self.active[index] = False
+            self.num_of_active -= 1
+
+    def __getitem__(self, name):
+        index = self.index.get(name)
+        if index is None or not self.active[index]:
+            raise KeyError(name)
+        return int(self.capacities[index])
+
+    def __setitem__(self, name, capacity:int):
+        index = self.index[name]
+        self._record(index)
+        self.capacities[index] = capacity
+        if not self.active[index]:
+            self.active[index] = True
+            self.num_of_active += 1
+            self.num_of_releases += 1
+        if self.order is not None and index not in self.order:
+            self.order[index] = None
+
+    def __delitem__(self, name):
+        index = self.index.get(name)
+        if index is None or not self.active[index]:
+            raise KeyError(name)
+        self.deactivate(index)
+
+    def __contains__(self, name)->bool:
+        index = self.index.get(name)
+        return index is not None and bool(self.active[index])
+
+    def __iter__(self):
+        names, active = self.names, self.active
+        if self.order is None:
+            for index in np.flatnonzero(active).tolist():
+                yield names[index]
+        else:
+            for index in list(self.order):
+                if active[index]:
+                    yield names[index]
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def keys(self)->KeysView:
+        return _ReversibleKeysView(self)
+
+    def __len__(self)->int:
+        return self.num_of_active
+
+    def __repr__(self)->str:
+        return repr(dict(self))
+
+
+class _ReversibleKeysView(KeysView):
+    # Like the keys of a dict, the keys of RemainingCapacities can be reversed.
+    def __reversed__(self):
+        return reversed(self._mapping)
+
+
+class Bundles(Mapping):
+    """
+    A read-only dict-like view of the bundles in a boolean matrix `allocated` (agents x items): maps each agent to the frozenset of its items.
+    The bundles are snapshots, so they are immutable - to change a bundle, use the methods of AllocationBuilder (e.g. `give`).
+    """
+    def __init__(self, instance:Instance, allocated:np.ndarray):
+        self.instance, self.allocated = instance, allocated
+
+    def __getitem__(self, agent)->frozenset:
+        item_list = self.instance.item_list
+        return frozenset(item_list[column] for column in np.flatnonzero(self.allocated[self.instance.agent_index[agent]]).tolist())
+
+    def __iter__(self):
+        return iter(self.instance.agents)
+
+    def __len__(self)->int:
+        return self.instance.num_of_agents
+
+    def __repr__(self)->str:
+        return repr(dict(self))
+
+
 class AllocationBuilder:
     """
     A class for incrementally constructing an allocation.
@@ -107,6 +503,11 @@ class AllocationBuilder:
     the class automatically updates the 'remaining_item_capacities' and the 'remaining_agent_capacities'.
     It also updates the 'remaining_conflicts' by adding a conflict between the agent and the item, so that it is not assigned to it anymore.
 
+    The state is kept in numpy arrays, aligned with the agents and items of the instance:
+    integer capacity arrays, a boolean matrix 'allocated' (agents x items) and a boolean matrix 'blocked' of conflicts.
+    'remaining_agent_capacities', 'remaining_item_capacities', 'remaining_conflicts' and 'bundles' are dict/set-like views of these arrays.
+    Algorithms that work with indices can use the fast paths 'give_by_index', 'available_items_mask', 'remaining_agent_indices' and 'remaining_item_indices'.
+
     Once you finish adding items, use "sorted" to get the final allocation (where each bundle is sorted alphabetically).
 
     >>> instance = Instance(
@@ -134,13 +535,46 @@ class AllocationBuilder:
     >>> alloc.give('Alice', 'c1')    
     >>> sorted(alloc.remaining_conflicts)
     [('Alice', 'c1'), ('Alice', 'c2'), ('Bob', 'c2')]
+
+    ### index-based fast paths:
+    >>> alloc.available_items_mask(1), alloc.remaining_item_indices()
+    (array([ True, False]), array([0, 1]))
+    >>> alloc.give_by_index(1, 0)
+    >>> alloc.bundles["Bob"], alloc.effective_value("Bob", "c1")
+    (frozenset({'c1'}), -inf)
+    >>> alloc.sorted()
+    {'Alice': ['c1'], 'Bob': ['c1']}
     """
     def __init__(self, instance:Instance):
         self.instance = instance
-        self.remaining_agent_capacities = {agent: instance.agent_capacity(agent) for agent in instance.agents if instance.agent_capacity(agent) > 0}
-        self.remaining_item_capacities = {item: instance.item_capacity(item) for item in instance.items if instance.item_capacity(item) > 0}
-        self.remaining_conflicts = {(agent,item) for agent in self.remaining_agents() for item in self.instance.agent_conflicts(agent)}
-        self.bundles = {agent: set() for agent in instance.agents}    # Each bundle is a set, since each agent can get at most one seat in each course
+        self._remaining_agent_capacities = RemainingCapacities(instance.agent_list, instance.agent_index, instance.agent_capacity_vector)
+        self._remaining_item_capacities = RemainingCapacities(instance.item_list, instance.item_index, instance.item_capacity_vector)
+        self.blocked = instance.agent_conflict_matrix.toarray()    # blocked[i,j] is True iff agent i cannot get item j
+        self.blocked[instance.agent_capacity_vector <= 0] = False
+        self.remaining_conflicts = RemainingConflicts(instance, self.blocked)
+        self.allocated = np.zeros((instance.num_of_agents, instance.num_of_items), dtype=bool)   # allocated[i,j] is True iff agent i holds item j (each agent can get at most one seat in each course)
+        self.bundles = Bundles(instance, self.allocated)
+        self._cursors = {}             # maps an agent index to a pair [iterator over the agent's preferred item indices, current candidate]; see best_item_index_for_agent.
+        self._num_of_releases = 0      # the number of releases of items and conflicts when the cursors were created.
+        self._journal = None           # a list of undo-entries (function, *arguments), created by the first checkpoint.
+        self.profile = current_profile()   # the active Profile (see fairpyx.utils.profiling), or None; counts the hot-path calls.
+        self.cancellation = CancellationToken()   # the time/iteration budget of iterative algorithms; replaced by `divide` when a budget is given.
+
+    @property
+    def remaining_agent_capacities(self)->RemainingCapacities:
+        return self._remaining_agent_capacities
+
+    @remaining_agent_capacities.setter
+    def remaining_agent_capacities(self, capacities:dict):
+        self._remaining_agent_capacities.assign(capacities)
+
+    @property
+    def remaining_item_capacities(self)->RemainingCapacities:
+        return self._remaining_item_capacities
+
+    @remaining_item_capacities.setter
+    def remaining_item_capacities(self, capacities:dict):
+        self._remaining_item_capacities.assign(capacities)
 
     def isdone(self)->bool:
         """
@@ -159,7 +593,8 @@ class AllocationBuilder:
         Return the items with positive remaining capacity, that are available for the agent
         (== the agent does not already have them, and there are no item-conflicts or agent-conflicts)
         """
-        return [item for item in self.remaining_items() if (agent,item) not in self.remaining_conflicts]
+        item_list = self.instance.item_list
+        return [item_list[column] for column in np.flatnonzero(self.available_items_mask(self.instance.agent_index[agent])).tolist()]
 
     def remaining_agents(self)->list: 
         """
@@ -167,19 +602,145 @@ class AllocationBuilder:
         """
         return self.remaining_agent_capacities.keys()
 
+    def remaining_agent_indices(self)->np.ndarray:
+        """
+        Return the indices of the agents with positive remaining capacity.
+        """
+        return np.flatnonzero(self.remaining_agent_capacities.active)
+
+    def remaining_item_indices(self)->np.ndarray:
+        """
+        Return the indices of the items with positive remaining capacity.
+        """
+        return np.flatnonzero(self.remaining_item_capacities.active)
+
+    def available_items_mask(self, agent_index:int)->np.ndarray:
+        """
+        Return a boolean vector over all items, which is True for the items that are remaining and available for the agent with the given index.
+        """
+        return self.remaining_item_capacities.active & ~self.blocked[agent_index]
+
+    def checkpoint(self)->int:
+        """
+        Start recording changes, and return a token that can be passed to `rollback` to undo all changes made after this call.
+        Recording costs O(1) per change, so trying a move and rolling it back costs O(changes) rather than O(instance).
+
+        >>> instance = Instance(valuations={"Alice": {"c1": 1, "c2": 3}, "Bob": {"c1": 2, "c2": 4}}, agent_capacities=1, item_capacities=1, item_conflicts={"c1": ["c2"]})
+        >>> alloc = AllocationBuilder(instance)
+        >>> alloc.give("Alice", "c1")
+        >>> token = alloc.checkpoint()
+        >>> alloc.give("Bob", "c2")
+        >>> alloc.sorted(), alloc.remaining_agent_capacities, alloc.remaining_item_capacities
+        ({'Alice': ['c1'], 'Bob': ['c2']}, {}, {})
+        >>> alloc.rollback(token)
+        >>> alloc.sorted(), alloc.remaining_agent_capacities, alloc.remaining_item_capacities, sorted(alloc.remaining_conflicts)
+        ({'Alice': ['c1'], 'Bob': []}, {'Bob': 1}, {'c2': 1}, [('Alice', 'c1'), ('Alice', 'c2')])
+        >>> alloc.best_item_for_agent("Bob")
+        'c2'
+        """
+        if self._journal is None:
+            self._set_journal([])
+        return len(self._journal)
+
+    def _set_journal(self, journal:list):
+        self._journal = self._remaining_agent_capacities.journal = self._remaining_item_capacities.journal = self.remaining_conflicts.journal = journal
+
+    def rollback(self, token:int):
+        """
+        Undo all changes made after the `checkpoint` that returned the given token.
+        """
+        journal = self._journal
+        if journal is None or not 0 <= token <= len(journal):
+            raise ValueError(f"Invalid checkpoint token {token}")
+        self._set_journal(None)      # undoing a change should not be recorded
+        while len(journal) > token:
+            function, *arguments = journal.pop()
+            function(*arguments)
+        self._set_journal(journal)
+
+    @contextmanager
+    def transaction(self):
+        """
+        A context in which all changes are rolled back if an exception is raised.
+
+        >>> instance = Instance(valuations={"Alice": {"c1": 1, "c2": 3}}, agent_capacities=2, item_capacities=1)
+        >>> alloc = AllocationBuilder(instance)
+        >>> with alloc.transaction():
+        ...     alloc.give("Alice", "c1")
+        >>> try:
+        ...     with alloc.transaction():
+        ...         alloc.give("Alice", "c2")
+        ...         alloc.give("Alice", "c2")
+        ... except ValueError as error:
+        ...     print(error)
+        Agent Alice has no remaining capacity for item c2
+        >>> alloc.sorted(), alloc.remaining_agent_capacities
+        ({'Alice': ['c1']}, {'Alice': 1})
+        """
+        outermost = self._journal is None
+        token = self.checkpoint()
+        try:
+            yield token
+        except BaseException:
+            self.rollback(token)
+            raise
+        finally:
+            if outermost:    # nobody else can roll back these changes, so stop recording.
+                self._set_journal(None)
+
+    def best_item_for_agent(self, agent:any)->any:
+        """
+        Return the agent's best remaining item that is available to it (no conflict), with the tie-breaking of `Instance.agent_preferred_items`,
+        or None if there is no such item.
+
+        >>> instance = Instance(valuations={"Alice": {"c1": 1, "c2": 3, "c3": 2}}, agent_capacities=3, item_conflicts={"c2": ["c3"]})
+        >>> alloc = AllocationBuilder(instance)
+        >>> alloc.best_item_for_agent("Alice")
+        'c2'
+        >>> alloc.give("Alice", "c2")
+        >>> alloc.best_item_for_agent("Alice")
+        'c1'
+        >>> alloc.give("Alice", "c1")
+        >>> print(alloc.best_item_for_agent("Alice"))
+        None
+        """
+        item_index = self.best_item_index_for_agent(self.instance.agent_index[agent])
+        return None if item_index is None else self.instance.item_list[item_index]
+
+    def best_item_index_for_agent(self, agent_index:int)->int:
+        """
+        Return the index of the best available item for the agent with the given index, or None if there is no such item.
+
+        Each agent has a cursor into its preference order. Items that are exhausted or in conflict with the agent never become available again,
+        so the cursor only moves forward, and the total cost of all calls for an agent is O(m) (amortized O(1) per call).
+        If an item or a conflict is released (e.g. a capacity is set again), all cursors are restarted.
+        """
+        num_of_releases = self._remaining_item_capacities.num_of_releases + self.remaining_conflicts.num_of_releases
+        if num_of_releases != self._num_of_releases:
+            self._cursors.clear()
+            self._num_of_releases = num_of_releases
+        cursor = self._cursors.get(agent_index)
+        if cursor is None:
+            iterator = self.instance.agent_preferred_item_indices(agent_index)
+            cursor = self._cursors[agent_index] = [iterator, next(iterator, None)]
+        iterator, item_index = cursor
+        item_active, blocked_items = self._remaining_item_capacities.active, self.blocked[agent_index]
+        while item_index is not None and (not item_active[item_index] or blocked_items[item_index]):
+            item_index = next(iterator, None)
+        cursor[1] = item_index
+        return item_index
+
     def remaining_instance(self)->Instance:
         """
-        Construct a fresh input instance, based on the remaining agents and items.
-        """
-        return Instance(
-            valuations=self.instance.agent_item_value,                 # base valuations are the same as in the original instance
-            agent_capacities=self.remaining_agent_capacities,          # agent capacities may be smaller than in the original instance 
-            agent_entitlements=self.instance.agent_entitlement,        # agent entitlement is the same as in the original instance  
-            agent_conflicts=self.instance.agent_conflicts,             # agent conflicts are the same as in the original instance   
-            agents=self.remaining_agents(),                            # agent list may be smaller than in the original instance
-            item_capacities=self.remaining_item_capacities,            # item capacities may be smaller than in the original instance 
-            item_conflicts=self.instance.item_conflicts,               # item conflicts are the same as in the original instance   
-            items=self.remaining_items())                              # item list may be smaller than in the original instance 
+        Construct a view of the input instance, restricted to the remaining agents and items, with the remaining capacities.
+        Values, entitlements and conflicts are the same as in the original instance, and its arrays are slices of the original arrays.
+        """
+        return SubInstance(
+            self.instance,
+            agents=list(self.remaining_agents()),                                              # agent list may be smaller than in the original instance
+            items=list(self.remaining_items()),                                                # item list may be smaller than in the original instance
+            agent_capacities=np.fromiter(self.remaining_agent_capacities.values(), dtype=int, count=len(self.remaining_agent_capacities)),  # may be smaller than in the original instance
+            item_capacities=np.fromiter(self.remaining_item_capacities.values(), dtype=int, count=len(self.remaining_item_capacities)))    # may be smaller than in the original instance
     
     def agent_bundle_value(self, agent:any, bundle:list)->float:
         return self.instance.agent_bundle_value(agent,bundle)
@@ -189,7 +750,9 @@ class AllocationBuilder:
         Return the agent's value for the item, if there is no conflict;
         otherwise, returns -infinity.
         """
-        if (agent,item) in self.remaining_conflicts:
+        if self.profile is not None:
+            self.profile.counters["effective_value"] += 1
+        if self.blocked[self.instance.agent_index[agent], self.instance.item_index[item]]:
             return FORBIDDEN_ALLOCATION
         else:
             return self.instance.agent_item_value(agent,item)
@@ -213,18 +776,26 @@ class AllocationBuilder:
             raise ValueError(f"Item {item} has no remaining capacity for agent {agent}")
         if (agent,item) in self.remaining_conflicts:
             raise ValueError(f"Agent {agent} is not allowed to take item {item} due to a conflict")
-        self.bundles[agent].add(item)
+        self.give_by_index(self.instance.agent_index[agent], self.instance.item_index[item], logger)
+
+    def give_by_index(self, agent_index:int, item_index:int, logger=None):
+        """
+        Give the item with the given index to the agent with the given index.
+        NOTE: Unlike `give`, no validity check is done - the caller should make sure that both are remaining and that there is no conflict.
+        """
+        if self.profile is not None:
+            self.profile.counters["give"] += 1
         if logger is not None:
+            agent, item = self.instance.agent_list[agent_index], self.instance.item_list[item_index]
             logger.info("Agent %s takes item %s with value %s", agent, item, self.instance.agent_item_value(agent, item))
+        if self._journal is not None:
+            self._journal.append((self.allocated.__setitem__, (agent_index, item_index), self.allocated[agent_index, item_index]))
+        self.allocated[agent_index, item_index] = True
 
         # Update capacities:
-        self.remaining_agent_capacities[agent] -= 1
-        if self.remaining_agent_capacities[agent] <= 0:
-            self.remove_agent_from_loop(agent)
-        self.remaining_item_capacities[item] -= 1
-        if self.remaining_item_capacities[item] <= 0:
-            self.remove_item_from_loop(item)
-        self._update_conflicts(agent,item)
+        self._remaining_agent_capacities.decrement(agent_index)
+        self._remaining_item_capacities.decrement(item_index)
+        self._block(agent_index, item_index)
 
 
     def give_bundle(self, agent:any, new_bundle:list, logger=None):
@@ -237,33 +808,87 @@ class AllocationBuilder:
     def give_bundles(self, new_bundles:dict, logger=None):
         """
         Add an entire set of bundles to this allocation.
-        NOTE: No validity check is done - use at your own risk!
-        """
-        map_agent_to_num_of_items = {agent: len(bundle) for agent,bundle in new_bundles.items()}
-        map_item_to_num_of_owners = {item: 0 for item in self.instance.items}
-        for agent,bundle in new_bundles.items():
-            for item in bundle:
-                map_item_to_num_of_owners[item] += 1
+        NOTE: Only capacities are checked, not conflicts - use at your own risk!
 
-        for agent,num_of_items in map_agent_to_num_of_items.items():
-            if num_of_items==0: continue
-            if agent not in self.remaining_agent_capacities or self.remaining_agent_capacities[agent]<num_of_items:
-                raise ValueError(f"Agent {agent} has no remaining capacity for {num_of_items} new items")
-            self.remaining_agent_capacities[agent] -= num_of_items
-            if self.remaining_agent_capacities[agent] <= 0:
-                self.remove_agent_from_loop(agent)
+        >>> instance = Instance(valuations={"Alice": [1,2,3], "Bob": [3,2,1]}, agent_capacities=2, item_capacities=2, item_conflicts={"c0": ["c2"], "c1": ["c2"]}, items=["c0","c1","c2"])
+        >>> alloc = AllocationBuilder(instance)
+        >>> alloc.give_bundles({"Alice": ["c0", "c1"], "Bob": ["c1"]})
+        >>> alloc.sorted(), sorted(alloc.remaining_conflicts)
+        ({'Alice': ['c0', 'c1'], 'Bob': ['c1']}, [('Alice', 'c0'), ('Alice', 'c1'), ('Alice', 'c2'), ('Bob', 'c1'), ('Bob', 'c2')])
+        """
+        item_index = self.instance.item_index
+        rows = [self.instance.agent_index[agent] for agent,bundle in new_bundles.items() for item in bundle]
+        columns = [item_index[item] for bundle in new_bundles.values() for item in bundle]
+        matrix = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=int), (rows, columns)), shape=self.allocated.shape)
+        self.give_matrix(matrix, logger=logger, check_conflicts=False)
 
-        for item,num_of_owners in map_item_to_num_of_owners.items():
-            if num_of_owners==0: continue
-            if item not in self.remaining_item_capacities or self.remaining_item_capacities[item]<num_of_owners:
-                raise ValueError(f"Item {item} has no remaining capacity for {num_of_owners} new agents")
-            self.remaining_item_capacities[item] -= num_of_owners
-            if self.remaining_item_capacities[item] <= 0:
-                self.remove_item_from_loop(item)
+    def give_matrix(self, matrix:any, logger=None, check_conflicts:bool=True):
+        """
+        Give many items at once: matrix[i,j]=1 means that agent i (in the order of instance.agents) gets item j (in the order of instance.items).
+        Capacities are checked with a single row/column sum, and all capacities and conflicts are updated in one pass.
+
+        :param matrix: a 0/1 matrix (agents x items), dense or scipy.sparse.
+        :param check_conflicts: if True (the default), raise a ValueError if an agent gets an item in conflict with it, or two items in conflict with each other.
+
+        >>> instance = Instance(valuations={"Alice": [1,2,3], "Bob": [3,2,1]}, item_capacities={"c0": 1, "c1": 2, "c2": 1}, agent_capacities=2, item_conflicts={"c0": ["c2"], "c2": ["c0"]})
+        >>> alloc = AllocationBuilder(instance)
+        >>> alloc.give_matrix([[0,1,1],[1,1,0]])
+        >>> alloc.sorted(), alloc.remaining_item_capacities
+        ({'Alice': ['c1', 'c2'], 'Bob': ['c0', 'c1']}, {})
+        >>> sorted(alloc.remaining_conflicts)
+        [('Alice', 'c0'), ('Alice', 'c1'), ('Alice', 'c2'), ('Bob', 'c0'), ('Bob', 'c1'), ('Bob', 'c2')]
+
+        >>> alloc = AllocationBuilder(instance)
+        >>> alloc.give_matrix(scipy.sparse.csr_matrix([[1,0,1],[0,0,0]]))
+        Traceback (most recent call last):
+        ...
+        ValueError: Agent Alice is not allowed to take item c0 due to a conflict
+        >>> alloc.give_matrix(np.array([[1,0,0],[1,0,0]]))
+        Traceback (most recent call last):
+        ...
+        ValueError: Item c0 has no remaining capacity for 2 new agents
+        """
+        matrix = scipy.sparse.csr_matrix(matrix, dtype=int)
+        matrix.eliminate_zeros()
+        if matrix.shape != self.allocated.shape:
+            raise ValueError(f"Expected a matrix of shape {self.allocated.shape}, got {matrix.shape}")
+        if np.any(matrix.data != 1):
+            raise ValueError("Expected a 0/1 matrix")
+        instance = self.instance
+        agent_list, item_list = instance.agent_list, instance.item_list
+        agent_capacities, item_capacities = self._remaining_agent_capacities, self._remaining_item_capacities
+
+        # Check capacities:
+        agent_sums, item_sums = np.asarray(matrix.sum(axis=1)).ravel(), np.asarray(matrix.sum(axis=0)).ravel()
+        for row in np.flatnonzero((agent_sums > 0) & (~agent_capacities.active | (agent_capacities.capacities < agent_sums))):
+            raise ValueError(f"Agent {agent_list[row]} has no remaining capacity for {agent_sums[row]} new items")
+        for column in np.flatnonzero((item_sums > 0) & (~item_capacities.active | (item_capacities.capacities < item_sums))):
+            raise ValueError(f"Item {item_list[column]} has no remaining capacity for {item_sums[column]} new agents")
+
+        # Check conflicts: an agent cannot get an item it is blocked from, or two items that conflict with each other:
+        rows, columns = matrix.nonzero()
+        conflicting_items = matrix @ instance.item_conflict_matrix    # conflicting_items[i,j] > 0 iff agent i gets an item that conflicts with j
+        if check_conflicts:
+            bad_cells = self.blocked[rows, columns] | (np.asarray(conflicting_items[rows, columns]).ravel() > 0)
+            if np.any(bad_cells):
+                bad_cell = np.flatnonzero(bad_cells)[0]
+                raise ValueError(f"Agent {agent_list[rows[bad_cell]]} is not allowed to take item {item_list[columns[bad_cell]]} due to a conflict")
 
-        for agent,bundle in new_bundles.items():
-            self.bundles[agent].update(bundle)
-            self._update_conflicts(agent,item)
+        if logger is not None:
+            for row in np.flatnonzero(agent_sums).tolist():
+                bundle = [item_list[column] for column in matrix.indices[matrix.indptr[row]:matrix.indptr[row+1]].tolist()]
+                logger.info("Agent %s takes bundle %s with value %s", agent_list[row], bundle, self.agent_bundle_value(agent_list[row], bundle))
+
+        # Update the state:
+        if self.profile is not None:
+            self.profile.counters["give"] += len(rows)
+        if self._journal is not None:
+            self._journal.append((self.allocated.__setitem__, (rows, columns), self.allocated[rows, columns]))
+        self.allocated[rows, columns] = True
+        agent_capacities.subtract(np.flatnonzero(agent_sums), agent_sums[agent_sums > 0])
+        item_capacities.subtract(np.flatnonzero(item_sums), item_sums[item_sums > 0])
+        blocked_rows, blocked_columns = (matrix + conflicting_items).nonzero()
+        self.remaining_conflicts.set_cells(blocked_rows, blocked_columns, True)
 
 
     def _update_conflicts(self, receiving_agent:any, received_item:any):
@@ -271,14 +896,30 @@ class AllocationBuilder:
         Update the list of agent-item conflicts after giving `received_item` to `receiving_agent`:
         * `receiving_agent` has a new conflict with `received_item`, as cannot get the same item twice.
         * `receiving_agent` has a new conflict with any item in conflict with `received_item`, as cannot get both of them at the same time.
+        The second update ORs the row of `received_item` in the item-conflict adjacency into the agent's row of `blocked`.
         """
-        self.remaining_conflicts.add( (receiving_agent,received_item) )
-        for conflicting_item in self.instance.item_conflicts(received_item):
-            self.remaining_conflicts.add( (receiving_agent,conflicting_item) )
+        self._block(self.instance.agent_index[receiving_agent], self.instance.item_index[received_item])
+
+    def _block(self, row:int, column:int):
+        item_conflict_matrix = self.instance.item_conflict_matrix
+        conflicting_columns = item_conflict_matrix.indices[item_conflict_matrix.indptr[column]:item_conflict_matrix.indptr[column+1]]
+        if self._journal is not None:
+            self.remaining_conflicts.set_cell(row, np.append(conflicting_columns, column), True)
+            return
+        blocked_items = self.blocked[row]
+        blocked_items[column] = True
+        blocked_items[conflicting_columns] = True
 
 
+    def allocation_matrix(self)->AllocationMatrix:
+        """
+        Return the current allocation as an AllocationMatrix, with rows and columns ordered like the agents and items of the instance.
+        """
+        return AllocationMatrix(scipy.sparse.csr_matrix(self.allocated, dtype=int), self.instance.agent_index, self.instance.item_index)
+
     def sorted(self):
-        return {agent: sorted(bundle) for agent,bundle in self.bundles.items()}
+        item_list = self.instance.item_list
+        return {agent: sorted(item_list[column] for column in np.flatnonzero(row).tolist()) for agent,row in zip(self.instance.agents, self.allocated)}
 
 
 if __name__ == "__main__":
@@ -7,7 +7,10 @@ Since: 2023-07
 
 from numbers import Number
 import numpy as np
-from functools import cache
+import scipy.sparse
+import hashlib, json, os, csv
+from itertools import islice
+from functools import cached_property
 
 import logging
 logger = logging.getLogger(__name__)
@@ -54,6 +57,10 @@ class Instance:
     {'c2': 1, 'c1': 2}
     >>> instance.agent_ranking("Alice", ["c2"])
     {'c2': 1, 'c1': 2}
+    >>> instance.agent_item_rank("Bob", "c1")
+    2
+    >>> list(instance.agent_preferred_items("Bob"))
+    ['c2', 'c1']
 
     ### dict of lists:
     >>> instance = Instance(
@@ -95,6 +102,13 @@ class Instance:
     {'x': 1, 'y': 2}
     >>> instance.agent_ranking("avi", ["y"])
     {'y': 1, 'x': 2}
+    >>> instance.agent_ranking("avi")
+    {'x': 1, 'y': 2}
+    >>> instance.preference_order
+    array([[0, 1],
+           [0, 1]])
+    >>> list(instance.agent_preferred_items("avi", available=lambda item: item!="x"))
+    ['y']
 
     ### conflicts:
     >>> instance = Instance(
@@ -105,12 +119,77 @@ class Instance:
     {2, 3, 4}
     >>> instance.item_conflicts(2)
     {'Alice'}
+
+    ### arrays:
+    The same information is also available as numpy arrays, whose rows/columns are ordered like `agents` and `items`.
+    The arrays are computed once (on first use), and can be used by algorithms as an index-based fast path.
+    >>> instance = Instance(
+    ...   agent_capacities = {"Alice": 2, "Bob": 3}, 
+    ...   item_capacities  = {"c1": 4, "c2": 5}, 
+    ...   valuations       = {"Alice": {"c1": 11, "c2": 22}, "Bob": {"c1": 33, "c2": 44}})
+    >>> instance.agent_index["Bob"], instance.item_index["c2"]
+    (1, 1)
+    >>> instance.valuation_matrix
+    array([[11, 22],
+           [33, 44]])
+    >>> instance.agent_capacity_vector, instance.item_capacity_vector, instance.agent_entitlement_vector
+    (array([2, 3]), array([4, 5]), array([1, 1]))
+
+    ### array mode: numpy arrays with agent and item names:
+    >>> instance = Instance(
+    ...   agents = ["Alice", "Bob"], items = ["c1", "c2", "c3"],
+    ...   agent_capacities = np.array([2, 3]),
+    ...   item_capacities  = np.array([4, 5, 6]),
+    ...   valuations       = np.array([[11, 22, 33], [44, 55, 66]]))
+    >>> instance.agent_item_value("Bob", "c2")
+    55
+    >>> instance.agent_capacity("Bob"), instance.item_capacity("c3")
+    (3, 6)
+    >>> instance.to_dense().agent_item_value("Alice", "c3")
+    33
+
+    ### many bundles at once:
+    >>> instance.agent_bundle_values("Bob", [["c1"], ["c1","c2"], []])
+    array([44, 99,  0])
+    >>> instance.agent_bundle_values(["Alice", "Bob"], [["c3"], {"c1": 0.5}])
+    array([33., 22.])
+    >>> allocation = {"Alice": ["c1", "c2"], "Bob": ["c3"]}
+    >>> instance.allocation_matrix(allocation)
+    array([[1, 1, 0],
+           [0, 0, 1]])
+    >>> instance.bundle_values(allocation)
+    array([33, 66])
+    >>> instance.bundle_value_matrix(allocation)
+    array([[33, 33],
+           [99, 66]])
+
+    ### sparse valuations: only the nonzero values are stored (in CSR format):
+    >>> instance = Instance(
+    ...   agents = ["Alice", "Bob"], items = ["c1", "c2", "c3", "c4"],
+    ...   valuations = scipy.sparse.csr_matrix(([50, 30, 80], ([0, 0, 1], [3, 1, 2])), shape=(2, 4)))
+    >>> instance.is_sparse
+    True
+    >>> instance.agent_item_value("Alice", "c4"), instance.agent_item_value("Alice", "c3")
+    (50, 0)
+    >>> instance.agent_nonzero_values("Alice")
+    {'c2': 30, 'c4': 50}
+    >>> list(instance.agent_preferred_items("Alice"))
+    ['c4', 'c2', 'c1', 'c3']
+    >>> instance.bundle_values({"Alice": ["c2", "c3"], "Bob": ["c3"]})
+    array([30, 80])
+    >>> instance.valuation_matrix
+    array([[ 0, 30,  0, 50],
+           [ 0,  0, 80,  0]])
+    >>> instance.to_dense().is_sparse
+    False
     """
 
     def __init__(self, valuations:any, agent_capacities:any=None, agent_entitlements:any=None, item_capacities:any=None, agent_conflicts:any=None, item_conflicts:any=None, agents:list=None, items:list=None):
         """
         Initialize an instance from the given 
         """
+        if scipy.sparse.issparse(valuations):
+            valuations = canonical_sparse_matrix(valuations)
         agent_value_keys, item_value_keys, agent_item_value_func = get_keys_and_mapping_2d(valuations)
 
         agent_capacity_keys, agent_capacity_func = get_keys_and_mapping(agent_capacities)
@@ -129,8 +208,40 @@ class Instance:
         self.item_capacity  = item_capacity_func  or constant_function(1)
         self.agent_item_value = agent_item_value_func
 
-        self.agent_conflicts = get_conflicts(agent_conflicts) or constant_function(set())
-        self.item_conflicts = get_conflicts(item_conflicts) or constant_function(set())
+        # Conflicts may also be given as sparse boolean matrices (agents x items and items x items), aligned with the agents/items lists.
+        if scipy.sparse.issparse(agent_conflicts):
+            self.agent_conflict_matrix = scipy.sparse.csr_matrix(agent_conflicts, dtype=bool)
+            self.agent_conflicts = positional_row_sets(self.agent_conflict_matrix, self.agents, lambda: self.agent_index, lambda: self.item_list)
+        else:
+            self.agent_conflicts = get_conflicts(agent_conflicts) or constant_function(set())
+        if scipy.sparse.issparse(item_conflicts):
+            self.item_conflict_matrix = scipy.sparse.csr_matrix(item_conflicts, dtype=bool)
+            self.item_conflicts = positional_row_sets(self.item_conflict_matrix, self.items, lambda: self.item_index, lambda: self.item_list)
+        else:
+            self.item_conflicts = get_conflicts(item_conflicts) or constant_function(set())
+
+        # Array mode: numpy arrays are aligned with the agents/items lists, which may contain arbitrary names.
+        self.is_sparse = scipy.sparse.issparse(valuations)
+        if isinstance(valuations, np.ndarray):
+            self.valuation_matrix = valuations
+            if not (isinstance(self.agents, range) and isinstance(self.items, range)):
+                agent_index, item_index = self.agent_index, self.item_index
+                self.agent_item_value = lambda agent,item: valuations[agent_index[agent], item_index[item]]
+        elif self.is_sparse or isinstance(valuations, IndexedRowsMatrix):
+            if self.is_sparse:
+                self.sparse_valuation_matrix = valuations
+            if not (isinstance(self.agents, range) and isinstance(self.items, range)):
+                agent_index, item_index = self.agent_index, self.item_index
+                self.agent_item_value = lambda agent,item: agent_item_value_func(agent_index[agent], item_index[item])
+        if isinstance(agent_capacities, np.ndarray):
+            self.agent_capacity_vector = agent_capacities
+            self.agent_capacity = positional_mapping(agent_capacities, self.agents, lambda: self.agent_index)
+        if isinstance(agent_entitlements, np.ndarray):
+            self.agent_entitlement_vector = agent_entitlements
+            self.agent_entitlement = positional_mapping(agent_entitlements, self.agents, lambda: self.agent_index)
+        if isinstance(item_capacities, np.ndarray):
+            self.item_capacity_vector = item_capacities
+            self.item_capacity = positional_mapping(item_capacities, self.items, lambda: self.item_index)
 
         # Keep the input parameters, for debug
         self._agent_capacities = agent_capacities
@@ -138,6 +249,291 @@ class Instance:
         self._valuations       = valuations
 
 
+    @cached_property
+    def agent_index(self)->dict:
+        """
+        Maps each agent name to its row in the arrays of this instance.
+        """
+        return {agent: index for index,agent in enumerate(self.agents)}
+
+    @cached_property
+    def item_index(self)->dict:
+        """
+        Maps each item name to its column in the arrays of this instance.
+        """
+        return {item: index for index,item in enumerate(self.items)}
+
+    @cached_property
+    def valuation_matrix(self)->np.ndarray:
+        """
+        A matrix V in which V[i,j] is the value of agent i to item j (by their positions in `agents` and `items`).
+        """
+        if self.is_sparse:
+            return self.sparse_valuation_matrix.toarray()
+        if isinstance(self._valuations, IndexedRowsMatrix):
+            return self._valuations.toarray()
+        return np.array([[self.agent_item_value(agent,item) for item in self.items] for agent in self.agents]).reshape(self.num_of_agents, self.num_of_items)
+
+    @cached_property
+    def sparse_valuation_matrix(self)->scipy.sparse.csr_matrix:
+        """
+        The valuation matrix in CSR format, storing only the nonzero values.
+        When the valuations are a dict of dicts, it is built directly from the dicts, without a dense intermediate.
+        """
+        valuations = self._valuations
+        if isinstance(valuations, dict) and all(isinstance(agent_values, dict) for agent_values in valuations.values()):
+            rows, columns, values = [], [], []
+            item_index = self.item_index
+            for agent,row in self.agent_index.items():
+                for item,value in valuations[agent].items():
+                    if value!=0 and item in item_index:
+                        rows.append(row); columns.append(item_index[item]); values.append(value)
+            matrix = scipy.sparse.csr_matrix((values, (rows, columns)), shape=(self.num_of_agents, self.num_of_items))
+        elif isinstance(valuations, IndexedRowsMatrix):
+            matrix = scipy.sparse.csr_matrix(valuations.rows)[valuations.row_index]
+        else:
+            matrix = scipy.sparse.csr_matrix(self.valuation_matrix)
+        return canonical_sparse_matrix(matrix)
+
+    def agent_nonzero_values(self, agent:any)->dict:
+        """
+        Return a dict mapping each item with a nonzero value for the agent to this value, in the order of `items`.
+        Only the stored entries of the agent's row are visited.
+        """
+        matrix = self.sparse_valuation_matrix
+        row = self.agent_index[agent]
+        start, end = matrix.indptr[row], matrix.indptr[row+1]
+        item_list = self.item_list
+        return {item_list[column]: value for column,value in zip(matrix.indices[start:end].tolist(), matrix.data[start:end].tolist())}
+
+    @cached_property
+    def agent_capacity_vector(self)->np.ndarray:
+        return np.array([self.agent_capacity(agent) for agent in self.agents], dtype=int)
+
+    @cached_property
+    def agent_entitlement_vector(self)->np.ndarray:
+        return np.array([self.agent_entitlement(agent) for agent in self.agents])
+
+    @cached_property
+    def item_capacity_vector(self)->np.ndarray:
+        return np.array([self.item_capacity(item) for item in self.items], dtype=int)
+
+    @cached_property
+    def agent_conflict_matrix(self)->scipy.sparse.csr_matrix:
+        """
+        A sparse boolean matrix C, in which C[i,j] is True iff item j conflicts with agent i.
+        """
+        return self._conflict_matrix(self.agents, self.agent_conflicts)
+
+    @cached_property
+    def item_conflict_matrix(self)->scipy.sparse.csr_matrix:
+        """
+        A sparse boolean matrix C, in which C[j,k] is True iff item k conflicts with item j.
+        """
+        return self._conflict_matrix(self.items, self.item_conflicts)
+
+    def _conflict_matrix(self, keys:list, conflicts:callable)->scipy.sparse.csr_matrix:
+        item_index = self.item_index
+        rows, columns = [], []
+        for row,key in enumerate(keys):
+            for item in conflicts(key):
+                if item in item_index:
+                    rows.append(row); columns.append(item_index[item])
+        return scipy.sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)), shape=(len(keys), self.num_of_items))
+
+    def to_dense(self)->"Instance":
+        """
+        Construct an equivalent instance in array mode: all values and capacities are stored in numpy arrays,
+        and the name-based functions (e.g. agent_item_value) are answered by array lookups.
+        """
+        return self._array_mode_instance(self.valuation_matrix)
+
+    def to_sparse(self)->"Instance":
+        """
+        Construct an equivalent instance in array mode, in which the valuations are stored in a sparse (CSR) matrix.
+        """
+        return self._array_mode_instance(self.sparse_valuation_matrix)
+
+    def _array_mode_instance(self, valuations:any)->"Instance":
+        return Instance(
+            valuations=valuations,
+            agent_capacities=self.agent_capacity_vector,
+            agent_entitlements=self.agent_entitlement_vector,
+            item_capacities=self.item_capacity_vector,
+            agent_conflicts=self.agent_conflicts,
+            item_conflicts=self.item_conflicts,
+            agents=list(self.agents),
+            items=list(self.items))
+
+    def save(self, path:str):
+        """
+        Save the instance in a compact binary layout: a directory with one .npy file per array
+        (values, capacities, entitlements and conflict adjacency), and a JSON table with the agent and item names.
+        Sparse valuations are saved in CSR format. The directory is created if it does not exist.
+
+        >>> import tempfile
+        >>> instance = Instance(
+        ...   valuations       = {"Alice": {"c1": 11, "c2": 22, "c3": 0}, "Bob": {"c1": 33, "c2": 0, "c3": 55}},
+        ...   agent_capacities = {"Alice": 2, "Bob": 1},
+        ...   item_capacities  = {"c1": 1, "c2": 2, "c3": 3},
+        ...   agent_conflicts  = {"Bob": {"c1"}},
+        ...   item_conflicts   = {"c2": {"c3"}, "c3": {"c2"}})
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     instance.save(path)
+        ...     loaded = Instance.load(path)
+        ...     loaded.agent_item_value("Bob", "c3"), loaded.agent_capacity("Alice"), loaded.item_capacity("c3")
+        ...     loaded.agent_conflicts("Bob"), loaded.item_conflicts("c3"), loaded.item_conflicts("c1")
+        (55, 2, 3)
+        ({'c1'}, {'c2'}, set())
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     instance.to_sparse().save(path)
+        ...     loaded = Instance.load(path)
+        ...     loaded.is_sparse, loaded.agent_nonzero_values("Bob")
+        (True, {'c1': 33, 'c3': 55})
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "agent_capacities": self.agent_capacity_vector,
+            "agent_entitlements": self.agent_entitlement_vector,
+            "item_capacities": self.item_capacity_vector,
+        }
+        if self.is_sparse:
+            arrays.update(csr_arrays("valuations", self.sparse_valuation_matrix))
+        else:
+            arrays["valuations"] = self.valuation_matrix
+        arrays.update(csr_arrays("agent_conflicts", self.agent_conflict_matrix))
+        arrays.update(csr_arrays("item_conflicts", self.item_conflict_matrix))
+        for name,array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(array), allow_pickle=False)
+        with open(os.path.join(path, "names.json"), "w") as names_file:
+            json.dump({"agents": list(self.agents), "items": list(self.items), "sparse": self.is_sparse}, names_file)
+
+    @staticmethod
+    def load(path:str, mmap:bool=True)->"Instance":
+        """
+        Load an instance that was saved by `Instance.save`. The result is an instance in array mode.
+
+        :param mmap: if True, the arrays are memory-mapped read-only rather than read into memory.
+              This makes loading almost immediate, and lets several processes share the same pages of the same files.
+        """
+        with open(os.path.join(path, "names.json")) as names_file:
+            names = json.load(names_file)
+        agents, items = names["agents"], names["items"]
+        mmap_mode = "r" if mmap else None
+        def load_array(name:str)->np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        def load_csr(name:str, num_of_rows:int)->scipy.sparse.csr_matrix:
+            return scipy.sparse.csr_matrix((load_array(f"{name}.data"), load_array(f"{name}.indices"), load_array(f"{name}.indptr")), shape=(num_of_rows, len(items)))
+        return Instance(
+            valuations=load_csr("valuations", len(agents)) if names["sparse"] else load_array("valuations"),
+            agent_capacities=load_array("agent_capacities"),
+            agent_entitlements=load_array("agent_entitlements"),
+            item_capacities=load_array("item_capacities"),
+            agent_conflicts=load_csr("agent_conflicts", len(agents)),
+            item_conflicts=load_csr("item_conflicts", len(items)),
+            agents=agents, items=items)
+
+    @staticmethod
+    def from_records(valuations:iter, agent_capacities:iter=None, item_capacities:iter=None,
+                     agent_conflicts:iter=None, item_conflicts:iter=None,
+                     agents:list=None, items:list=None, chunksize:int=100_000, sparse:bool=True)->"Instance":
+        """
+        Build an instance in array mode from streams of records, without building nested dicts.
+        Each stream is consumed in chunks of `chunksize` records; each chunk is converted to index arrays at once.
+
+        :param valuations: records (agent, item, value). Pairs without a record have value 0; repeated pairs are summed.
+        :param agent_capacities, item_capacities (optional): records (agent, capacity) and (item, capacity).
+               Agents/items without a record get the default capacity of `Instance` (the number of items / 1).
+        :param agent_conflicts, item_conflicts (optional): records (agent, item) and (item, item).
+        :param agents, items (optional): the lists of agents and items. By default, they are collected from the records, in order of first appearance.
+        :param sparse: if True, the valuations are kept in a sparse (CSR) matrix; otherwise, in a dense array.
+
+        A JSONL file with one [agent, item, value] list per line can be streamed by `map(json.loads, file)`.
+
+        >>> instance = Instance.from_records(
+        ...     valuations=[("Alice", "c1", 11), ("Alice", "c3", 33), ("Bob", "c2", 44)],
+        ...     agent_capacities=[("Alice", 2), ("Bob", 1)],
+        ...     item_conflicts=[("c1", "c3"), ("c3", "c1")],
+        ...     chunksize=2)
+        >>> list(instance.agents), list(instance.items), instance.is_sparse
+        (['Alice', 'Bob'], ['c1', 'c3', 'c2'], True)
+        >>> instance.agent_item_value("Alice", "c3"), instance.agent_item_value("Bob", "c1")
+        (33, 0)
+        >>> instance.agent_capacity("Bob"), instance.item_capacity("c2"), instance.item_conflicts("c1")
+        (1, 1, {'c3'})
+        >>> instance = Instance.from_records([("Alice", "c1", 1.5)], items=["c1", "c2"], sparse=False)
+        >>> instance.valuation_matrix, instance.agent_capacity("Alice")
+        (array([[1.5, 0. ]]), 2)
+        >>> Instance.from_records([("Alice", "c3", 1)], items=["c1", "c2"])
+        Traceback (most recent call last):
+        ...
+        ValueError: Unknown name: 'c3'
+        """
+        agent_table, item_table = NameTable(agents), NameTable(items)
+        rows, columns, values = [], [], []
+        for agent_column, item_column, value_column in read_columns_in_chunks(valuations, chunksize):
+            rows.append(agent_table.indices(agent_column))
+            columns.append(item_table.indices(item_column))
+            values.append(np.array(value_column))
+        agent_capacity_pairs = read_index_value_pairs(agent_capacities, agent_table, chunksize)
+        item_capacity_pairs = read_index_value_pairs(item_capacities, item_table, chunksize)
+        agent_conflict_pairs = read_index_value_pairs(agent_conflicts, agent_table, chunksize, item_table)
+        item_conflict_pairs = read_index_value_pairs(item_conflicts, item_table, chunksize, item_table)
+
+        num_of_agents, num_of_items = len(agent_table.names), len(item_table.names)
+        valuation_matrix = canonical_sparse_matrix(scipy.sparse.csr_matrix(
+            (np.concatenate(values) if values else np.zeros(0, dtype=int), (np.concatenate(rows) if rows else [], np.concatenate(columns) if columns else [])),
+            shape=(num_of_agents, num_of_items)))
+        def capacity_vector(pairs, length, default):
+            if pairs is None:
+                return None
+            vector = np.full(length, default, dtype=int)
+            vector[pairs[0]] = pairs[1]
+            return vector
+        def conflict_matrix(pairs, num_of_rows):
+            if pairs is None:
+                return None
+            return scipy.sparse.csr_matrix((np.ones(len(pairs[0]), dtype=bool), pairs), shape=(num_of_rows, num_of_items))
+        return Instance(
+            valuations=valuation_matrix if sparse else valuation_matrix.toarray(),
+            agent_capacities=capacity_vector(agent_capacity_pairs, num_of_agents, num_of_items),
+            item_capacities=capacity_vector(item_capacity_pairs, num_of_items, 1),
+            agent_conflicts=conflict_matrix(agent_conflict_pairs, num_of_agents),
+            item_conflicts=conflict_matrix(item_conflict_pairs, num_of_items),
+            agents=agent_table.names, items=item_table.names)
+
+    @staticmethod
+    def from_csv(valuations:str, agent_capacities:str=None, item_capacities:str=None,
+                 agent_conflicts:str=None, item_conflicts:str=None,
+                 agents:list=None, items:list=None, chunksize:int=100_000, sparse:bool=True,
+                 header:bool=True, delimiter:str=",")->"Instance":
+        """
+        Build an instance in array mode from CSV files, which are read as streams (see `from_records`).
+        The valuations file has rows agent,item,value; the capacity files have rows name,capacity;
+        the conflict files have rows agent,item and item,item. Numbers are parsed as int if possible, otherwise as float.
+
+        :param header: whether the first row of each file is a header row, which is skipped.
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     with open(os.path.join(path, "bids.csv"), "w") as file:
+        ...         _ = file.write("student,course,points\\ns1,c1,60\\ns1,c2,40\\ns2,c2,100\\n")
+        ...     with open(os.path.join(path, "courses.csv"), "w") as file:
+        ...         _ = file.write("course,capacity\\nc1,1\\nc2,2\\n")
+        ...     instance = Instance.from_csv(os.path.join(path, "bids.csv"), item_capacities=os.path.join(path, "courses.csv"))
+        >>> instance.agent_nonzero_values("s1"), instance.item_capacity("c2")
+        ({'c1': 60, 'c2': 40}, 2)
+        """
+        def records(path:str, num_of_name_columns:int, num_of_numeric_columns:int):
+            if path is None:
+                return None
+            return csv_records(path, num_of_name_columns, num_of_numeric_columns, header=header, delimiter=delimiter)
+        return Instance.from_records(
+            valuations=records(valuations, 2, 1),
+            agent_capacities=records(agent_capacities, 1, 1), item_capacities=records(item_capacities, 1, 1),
+            agent_conflicts=records(agent_conflicts, 2, 0), item_conflicts=records(item_conflicts, 2, 0),
+            agents=agents, items=items, chunksize=chunksize, sparse=sparse)
+
     def agent_bundle_value(self, agent:any, bundle:list[any]):
         """
         Return the agent's value for a bundle (a list of items).
@@ -150,6 +546,212 @@ class Instance:
         """
         return sum([self.agent_item_value(agent,item)*fraction for item,fraction in bundle.items()])
     
+    def bundles_matrix(self, bundles:list)->np.ndarray:
+        """
+        Convert a list of bundles into a matrix B, in which B[k,j] is the amount of item j in bundle k.
+        Each bundle is either a collection of items, or a dict mapping items to fractions.
+        """
+        fractional = any(isinstance(bundle,dict) for bundle in bundles)
+        matrix = np.zeros((len(bundles), self.num_of_items), dtype=float if fractional else int)
+        rows, columns, amounts = [], [], []
+        item_index = self.item_index
+        for row,bundle in enumerate(bundles):
+            if isinstance(bundle,dict):
+                for item,fraction in bundle.items():
+                    rows.append(row); columns.append(item_index[item]); amounts.append(fraction)
+            else:
+                for item in bundle:
+                    rows.append(row); columns.append(item_index[item]); amounts.append(1)
+        np.add.at(matrix, (np.array(rows,dtype=int), np.array(columns,dtype=int)), amounts)
+        return matrix
+
+    def allocation_matrix(self, allocation:dict)->np.ndarray:
+        """
+        Convert an allocation (a dict mapping each agent to its bundle) into a matrix A, 
+        in which A[i,j] is the amount of item j given to agent i. Agents missing from the allocation get an empty row.
+        """
+        return self.bundles_matrix([allocation.get(agent, []) for agent in self.agents])
+
+    def agent_bundle_values(self, agents:any, bundles:list)->np.ndarray:
+        """
+        Return the values of many (agent, bundle) pairs, using a single matrix operation.
+
+        :param agents: either a list of agents (one per bundle), or a single agent who evaluates all bundles.
+        :param bundles: a list of bundles; each bundle is a collection of items, or a dict mapping items to fractions.
+        """
+        bundles_matrix = self.bundles_matrix(bundles)
+        if isinstance(agents, (list, tuple, np.ndarray)):
+            rows = [self.agent_index[agent] for agent in agents]
+            if self.is_sparse:
+                return np.asarray(self.sparse_valuation_matrix[rows].multiply(bundles_matrix).sum(axis=1)).ravel()
+            return (self.valuation_matrix[rows] * bundles_matrix).sum(axis=1)
+        else:
+            row = self.agent_index[agents]
+            if self.is_sparse:
+                return np.asarray(self.sparse_valuation_matrix[row] @ bundles_matrix.T).ravel()
+            return bundles_matrix @ self.valuation_matrix[row]
+
+    def bundle_values(self, allocation:any)->np.ndarray:
+        """
+        Return a vector with the value of each agent to its own bundle.
+
+        :param allocation: a dict mapping each agent to its bundle, or an allocation matrix (agents x items).
+        """
+        if isinstance(allocation,dict):
+            allocation = self.allocation_matrix(allocation)
+        if self.is_sparse:
+            return np.asarray(self.sparse_valuation_matrix.multiply(allocation).sum(axis=1)).ravel()
+        if scipy.sparse.issparse(allocation):
+            return np.asarray(allocation.multiply(self.valuation_matrix).sum(axis=1)).ravel()
+        return (self.valuation_matrix * allocation).sum(axis=1)
+
+    def bundle_value_matrix(self, allocation:any)->np.ndarray:
+        """
+        Return a matrix M, in which M[i,k] is the value of agent i to the bundle of agent k.
+
+        :param allocation: a dict mapping each agent to its bundle, or an allocation matrix (agents x items).
+        """
+        if isinstance(allocation,dict):
+            allocation = self.allocation_matrix(allocation)
+        if self.is_sparse:
+            return np.asarray((self.sparse_valuation_matrix @ allocation.T).todense() if scipy.sparse.issparse(allocation) else self.sparse_valuation_matrix @ allocation.T)
+        if scipy.sparse.issparse(allocation):
+            return np.asarray(allocation @ self.valuation_matrix.T).T
+        return self.valuation_matrix @ allocation.T
+
+    @cached_property
+    def agent_list(self)->list:
+        """
+        The agents as a list, so that an agent can be found by its index.
+        """
+        return list(self.agents)
+
+    @cached_property
+    def item_list(self)->list:
+        """
+        The items as a list, so that an item can be found by its index.
+        """
+        return list(self.items)
+
+    @cached_property
+    def fingerprint(self)->str:
+        """
+        A hex SHA-256 hash of the content of the instance: the agent and item names, values, capacities, entitlements and conflicts.
+        Equal instances have equal fingerprints, whether their values are given as dicts, dense arrays or sparse matrices
+        (the values are hashed in canonical CSR format, as float64).
+
+        >>> instance = Instance(valuations={"Alice": {"c1": 11, "c2": 0}, "Bob": {"c1": 33, "c2": 44}}, agent_capacities=2, item_conflicts={"c1": ["c2"]})
+        >>> instance.fingerprint == instance.to_sparse().fingerprint == instance.to_dense().fingerprint
+        True
+        >>> instance.fingerprint == Instance(valuations={"Alice": {"c1": 11, "c2": 0}, "Bob": {"c1": 33, "c2": 44}}, agent_capacities=2).fingerprint
+        False
+        >>> len(instance.fingerprint)
+        64
+        """
+        valuations = self.sparse_valuation_matrix if self.is_sparse else canonical_sparse_matrix(self.valuation_matrix)
+        agent_conflicts, item_conflicts = canonical_sparse_matrix(self.agent_conflict_matrix), canonical_sparse_matrix(self.item_conflict_matrix)
+        arrays = {
+            "valuations.data": valuations.data.astype(np.float64),
+            "valuations.indices": valuations.indices,
+            "valuations.indptr": valuations.indptr,
+            "agent_capacities": self.agent_capacity_vector,
+            "agent_entitlements": self.agent_entitlement_vector.astype(np.float64),
+            "item_capacities": self.item_capacity_vector,
+            "agent_conflicts.indices": agent_conflicts.indices,
+            "agent_conflicts.indptr": agent_conflicts.indptr,
+            "item_conflicts.indices": item_conflicts.indices,
+            "item_conflicts.indptr": item_conflicts.indptr,
+        }
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"agents": self.agent_list, "items": self.item_list}, default=repr).encode())
+        for name,array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=np.float64 if array.dtype.kind=="f" else np.int64)
+            digest.update(f"{name}:{array.shape}".encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    @cached_property
+    def preference_order(self)->np.ndarray:
+        """
+        A matrix P, in which row i contains the indices of all items, ordered by the value of agent i from best to worst.
+        Ties are broken in favor of the item that appears first in `items`.
+        With sparse valuations, it is computed from the stored entries, without densifying the valuation matrix.
+        """
+        if self.is_sparse:
+            return sparse_preference_order(self.sparse_valuation_matrix)
+        if isinstance(self._valuations, IndexedRowsMatrix):    # agents with the same row have the same order
+            return np.argsort(-self._valuations.rows, axis=1, kind="stable")[self._valuations.row_index]
+        return np.argsort(-self.valuation_matrix, axis=1, kind="stable")
+
+    @cached_property
+    def rank_matrix(self)->np.ndarray:
+        """
+        A matrix R, in which R[i,j] is the rank of item j for agent i: 1 for the best item, 2 for the second-best, etc.
+        """
+        ranks = np.empty((self.num_of_agents, self.num_of_items), dtype=int)
+        np.put_along_axis(ranks, self.preference_order, np.arange(1, self.num_of_items+1), axis=1)
+        return ranks
+
+    def agent_item_rank(self, agent:any, item:any)->int:
+        """
+        Return the rank of the item for the agent (1 for the best item), with the tie-breaking of `preference_order`.
+        """
+        return int(self.rank_matrix[self.agent_index[agent], self.item_index[item]])
+
+    def agent_preferred_items(self, agent:any, available:callable=None):
+        """
+        Iterate over the items from the agent's best to the agent's worst, with the tie-breaking of `preference_order`.
+
+        :param available (optional): a predicate on items; only items for which it returns True are generated.
+              Taking the first generated item gives the best available item for the agent.
+
+        With sparse valuations, only the agent's nonzero values are sorted; the zero-value items are generated lazily, in the order of `items`.
+        """
+        item_list = self.item_list
+        for item_index in self.agent_preferred_item_indices(self.agent_index[agent]):
+            item = item_list[item_index]
+            if available is None or available(item):
+                yield item
+
+    def agent_preferred_item_indices(self, agent_index:int):
+        """
+        Iterate over the item indices from the best to the worst for the agent with the given index, in the order of `agent_preferred_items`.
+
+        >>> instance = Instance(valuations=[[1,3,2],[0,5,0]]).to_sparse()
+        >>> list(instance.agent_preferred_item_indices(0)), list(instance.agent_preferred_item_indices(1))
+        ([1, 2, 0], [1, 0, 2])
+        """
+        if self.is_sparse:
+            return self._sparse_preference_order(agent_index)
+        else:
+            return iter(self.preference_order[agent_index].tolist())
+
+    def _sparse_preference_order(self, row:int):
+        """
+        Generate the item indices of the given row, in the same order as `preference_order`, using only the stored entries of the row:
+        positive values (decreasing), then zeros, then negative values (decreasing).
+        """
+        matrix = self.sparse_valuation_matrix
+        start, end = matrix.indptr[row], matrix.indptr[row+1]
+        columns, values = matrix.indices[start:end], matrix.data[start:end]
+        order = np.lexsort((columns, -values))
+        columns, values = columns[order], values[order]
+        yield from columns[values>0].tolist()
+        stored_columns = set(columns.tolist())
+        yield from (column for column in range(self.num_of_items) if column not in stored_columns)
+        yield from columns[values<0].tolist()
+
+    def agent_value_vector(self, agent_index:int)->np.ndarray:
+        """
+        Return the values of the agent with the given index to all items, as a dense vector.
+        With sparse valuations, only this row is densified.
+        """
+        if self.is_sparse:
+            return self.sparse_valuation_matrix[agent_index].toarray().ravel()
+        if isinstance(self._valuations, IndexedRowsMatrix):
+            return self._valuations.rows[self._valuations.row_index[agent_index]]
+        return self.valuation_matrix[agent_index]
+
     def agent_ranking(self, agent:any, prioritized_items:list=[])->dict:
         """
         Compute a map in which each item is mapped to its ranking: the best item is mapped to 1, the second-best to 2, etc.
@@ -157,13 +759,16 @@ class Instance:
         :prioritized_items: a list of items that are "prioritized". 
              This list is used for tie-breaking, in cases the agent assigns the same value to different items.
         """
-        other_items = [item for item in self.items if item not in prioritized_items]
-        valuation = lambda item: self.agent_item_value(agent,item)
-        sorted_items = sorted(prioritized_items + other_items, key=valuation, reverse=True)
-        result = {}
-        for i,item in enumerate(sorted_items):
-            result[item] = i+1
-        return result
+        agent_index = self.agent_index[agent]
+        if len(prioritized_items)==0:
+            sorted_indices = self.preference_order[agent_index]
+        else:
+            # Sort by decreasing value; break ties by the position in (prioritized_items + other items)
+            positions = np.arange(self.num_of_items) + len(prioritized_items)
+            positions[[self.item_index[item] for item in prioritized_items]] = np.arange(len(prioritized_items))
+            sorted_indices = np.lexsort((positions, -self.agent_value_vector(agent_index)))
+        item_list = self.item_list
+        return {item_list[item_index]: rank+1 for rank,item_index in enumerate(sorted_indices)}
     
     def map_agent_to_ranking(self, map_agent_to_prioritized_items={})->dict:
         """
@@ -185,13 +790,35 @@ class Instance:
  * item conflicts:  { {item: self.item_conflicts(item) for item in self.items} }
  """
     
-    @cache
+    @cached_property
+    def maximum_values(self)->np.ndarray:
+        """
+        A vector with the maximum possible value of each agent: the sum of the top x items, where x is the agent's capacity.
+        All agents are handled together, by a single partition of the valuation matrix
+        (with sparse valuations, by a single sort of the stored entries; see `top_values`).
+
+        >>> instance = Instance(valuations=[[1,5,3,4],[2,2,8,1],[9,9,9,9]], agent_capacities=[2,1,0])
+        >>> instance.maximum_values
+        array([9, 8, 0])
+        >>> instance.to_sparse().maximum_values
+        array([9, 8, 0])
+        """
+        if isinstance(self._valuations, IndexedRowsMatrix):    # the top values of each shared row are computed once
+            values, rows = self._valuations.rows, self._valuations.row_index
+        else:
+            values, rows = (self.sparse_valuation_matrix if self.is_sparse else self.valuation_matrix), slice(None)
+        capacities = np.clip(self.agent_capacity_vector, 0, self.num_of_items)
+        max_capacity = capacities.max(initial=0)
+        if max_capacity==0:
+            return np.zeros(self.num_of_agents, dtype=values.dtype)
+        sums_of_top_values = np.cumsum(top_values(values, max_capacity)[rows], axis=1)
+        return np.where(capacities>0, sums_of_top_values[np.arange(self.num_of_agents), np.maximum(capacities-1,0)], 0)
+
     def agent_maximum_value(self, agent:any):
         """
         Return the maximum possible value of an agent: the sum of the top x items, where x is the agent's capacity.
         """
-        maxvalue = sum(sorted([self.agent_item_value(agent,item) for item in self.items],reverse=True)[0:self.agent_capacity(agent)])
-        return maxvalue
+        return self.maximum_values[self.agent_index[agent]].item()
 
 
     def agent_normalized_item_value(self, agent:any, item:any):
@@ -215,28 +842,32 @@ class Instance:
                item_subjective_ratio_bounds:tuple[float,float],
                normalized_sum_of_values:int,
                agent_name_template="s{index}", item_name_template="c{index}",
-               random_seed:int=None,
+               random_seed:int=None, rng:np.random.Generator=None,
                ):
         """
         Generate a random instance by drawing values from uniform distributions.
+        The whole value matrix is drawn at once; the result is an instance in array mode.
+
+        :param rng (optional): the random generator to use. By default, a new generator is created from `random_seed`.
+              The global state of np.random is never reseeded, so instances can be generated concurrently.
+
+        >>> instance = Instance.random_uniform(num_of_agents=3, num_of_items=4, agent_capacity_bounds=[1,2], item_capacity_bounds=[5,5],
+        ...     item_base_value_bounds=[1,100], item_subjective_ratio_bounds=[0.5,1.5], normalized_sum_of_values=100, random_seed=1)
+        >>> list(instance.agents), list(instance.items), instance.item_capacity("c2")
+        (['s1', 's2', 's3'], ['c1', 'c2', 'c3', 'c4'], 5)
+        >>> all(abs(instance.valuation_matrix.sum(axis=1) - 100) <= 2)
+        True
         """
-        if random_seed is None:
-            random_seed = np.random.randint(1, 2**31)
-        np.random.seed(random_seed)
-        logger.info("Random seed: %d", random_seed)
+        rng = random_generator(random_seed, rng)
         agents  = [agent_name_template.format(index=i+1) for i in range(num_of_agents)]
         items   = [item_name_template.format(index=i+1) for i in range(num_of_items)]
-        agent_capacities  = {agent: np.random.randint(agent_capacity_bounds[0], agent_capacity_bounds[1]+1) for agent in agents}
-        item_capacities   = {item: np.random.randint(item_capacity_bounds[0], item_capacity_bounds[1]+1) for item in items}
-        base_values = normalized_valuation(random_valuation(num_of_items, item_base_value_bounds), normalized_sum_of_values)
-        valuations = {
-            agent: dict(zip(items, normalized_valuation(
-                base_values *  random_valuation(num_of_items, item_subjective_ratio_bounds),
-                normalized_sum_of_values
-            )))
-            for agent in agents
-        }
-        return Instance(valuations=valuations, agent_capacities=agent_capacities, item_capacities=item_capacities)
+        agent_capacities  = rng.integers(agent_capacity_bounds[0], agent_capacity_bounds[1]+1, size=num_of_agents)
+        item_capacities   = rng.integers(item_capacity_bounds[0], item_capacity_bounds[1]+1, size=num_of_items)
+        base_values = normalized_valuation(random_valuation(num_of_items, item_base_value_bounds, rng), normalized_sum_of_values)
+        valuations = normalized_valuation(
+            base_values *  random_valuation((num_of_agents, num_of_items), item_subjective_ratio_bounds, rng),
+            normalized_sum_of_values)
+        return Instance(valuations=valuations, agent_capacities=agent_capacities, item_capacities=item_capacities, agents=agents, items=items)
     
 
     @staticmethod
@@ -250,46 +881,51 @@ class Instance:
                nonfavorite_item_value_bounds:tuple[int,int], # The value of a non-favorite course will be selected uniformly at random from this range.
                normalized_sum_of_values:int,
                agent_name_template="s{index}", item_name_template="c{index}",
-               random_seed:int=None,
+               random_seed:int=None, rng:np.random.Generator=None,
                ):
         """
         Generate a random instance with additive utilities, using the process described at:
             Soumalias, Zamanlooy, Weissteiner, Seuken: "Machine Learning-powered Course Allocation", arXiv 2210.00954, subsection 5.1
         NOTE: currently, we do not generate complementarities and substitutabilities. We also do not model reporting mistakes.
+
+        The whole value matrix is drawn at once; the random generator is handled as in `random_uniform`.
+
+        >>> instance = Instance.random_szws(num_of_agents=4, num_of_items=5, agent_capacity=2, supply_ratio=1.25,
+        ...     num_of_popular_items=3, mean_num_of_favorite_items=2, favorite_item_value_bounds=[1000,1000], nonfavorite_item_value_bounds=[0,0],
+        ...     normalized_sum_of_values=1000, random_seed=1)
+        >>> instance.item_capacity("c1")
+        2
+        >>> ((instance.valuation_matrix[:, :3] > 400).sum(axis=1) == 2).all(), (instance.valuation_matrix[:, 3:] < 10).all()
+        (True, True)
         """
-        if random_seed is None:
-            random_seed = np.random.randint(1, 2**31)
-        np.random.seed(random_seed)
-        logger.info("Random seed: %d", random_seed)
+        rng = random_generator(random_seed, rng)
 
-        item_capacity = np.round((supply_ratio * agent_capacity * num_of_agents) / num_of_items)
+        item_capacity = int(np.round((supply_ratio * agent_capacity * num_of_agents) / num_of_items))
 
         agents  = [agent_name_template.format(index=i+1) for i in range(num_of_agents)]
         items   = [item_name_template.format(index=i+1) for i in range(num_of_items)]
 
-        valuations = {}
-        for agent in agents:
-            # copied from https://github.com/marketdesignresearch/Course-Match-Preference-Simulator/blob/main/preference_generator.py
-            if np.random.uniform(0,1) <= mean_num_of_favorite_items - np.floor(mean_num_of_favorite_items):
-                num_of_favorite_items = int(np.ceil(mean_num_of_favorite_items))
-            else:
-                num_of_favorite_items = int(np.floor(mean_num_of_favorite_items))
+        # based on https://github.com/marketdesignresearch/Course-Match-Preference-Simulator/blob/main/preference_generator.py
+        num_of_favorite_items = np.where(
+            rng.uniform(0, 1, size=num_of_agents) <= mean_num_of_favorite_items - np.floor(mean_num_of_favorite_items),
+            int(np.ceil(mean_num_of_favorite_items)), int(np.floor(mean_num_of_favorite_items)))
+        # Each agent's favorite items are the first num_of_favorite_items items in a random permutation of the popular items:
+        random_permutations = np.argsort(rng.uniform(size=(num_of_agents, num_of_popular_items)), axis=1)
+        is_favorite = np.zeros((num_of_agents, num_of_items), dtype=bool)
+        np.put_along_axis(is_favorite[:, :num_of_popular_items], random_permutations, np.arange(num_of_popular_items) < num_of_favorite_items[:, None], axis=1)
 
-            favorite_items = np.random.choice(num_of_popular_items, num_of_favorite_items, replace=False)
-            valuation = np.zeros(num_of_items)
-            for item_index in range(num_of_items):
-                value_bounds = favorite_item_value_bounds if item_index in favorite_items else nonfavorite_item_value_bounds
-                valuation[item_index] = np.random.uniform(low=value_bounds[0], high=value_bounds[1]+1)
-            valuations[agent] = dict(zip(items, normalized_valuation(valuation, normalized_sum_of_values)))
+        low  = np.where(is_favorite, favorite_item_value_bounds[0], nonfavorite_item_value_bounds[0])
+        high = np.where(is_favorite, favorite_item_value_bounds[1], nonfavorite_item_value_bounds[1]) + 1
+        valuations = normalized_valuation(rng.uniform(low=low, high=high), normalized_sum_of_values)
 
-        return Instance(valuations=valuations, agent_capacities=agent_capacity, item_capacities=item_capacity)
+        return Instance(valuations=valuations, agent_capacities=agent_capacity, item_capacities=item_capacity, agents=agents, items=items)
 
 
     @staticmethod
     def random_sample(max_num_of_agents:int, max_total_agent_capacity:int,
         prototype_valuations:dict, prototype_agent_capacities:dict, prototype_agent_conflicts:dict,
         item_capacities:dict, item_conflicts:dict, 
-        random_seed:int=None,
+        random_seed:int=None, rng:np.random.Generator=None,
         ):
         """
         Generate a random instance by sampling values of existing agents.
@@ -297,62 +933,302 @@ class Instance:
         :param max_num_of_agents: creates at most this number of agents.
         :param max_total_agent_capacity: the total capacity of all agents will be at most this number plus one agent.
 
-
+        The result contains one copy of each prototype agent, followed by random copies named "random<i>.<prototype>".
+        The random copies are drawn in batches, and each batch is cut where the cumulative capacity reaches the budget.
+        The values of the prototypes are looked up once, into a matrix (prototypes x items).
+        The copies share the rows of this matrix and the conflicts of their prototypes (each copy stores only the index of its prototype; see `IndexedRowsMatrix`),
+        so the memory used for the valuations grows with the number of prototypes, not with the number of sampled agents.
+        The dense valuation matrix of all agents is built only if it is used.
+        The random generator is handled as in `random_uniform`.
+
+        >>> instance = Instance.random_sample(max_num_of_agents=100, max_total_agent_capacity=20,
+        ...     prototype_valuations={"Alice": {"c1": 5, "c2": 1}, "Bob": {"c1": 1, "c2": 5}}, prototype_agent_capacities={"Alice": 2, "Bob": 3},
+        ...     prototype_agent_conflicts={"Alice": ["c2"]}, item_capacities={"c1": 10, "c2": 10}, item_conflicts={}, random_seed=1)
+        >>> list(instance.agents)[:3]
+        ['Alice', 'Bob', 'random1.Alice']
+        >>> total_capacity = sum(instance.agent_capacity(agent) for agent in instance.agents)
+        >>> 20 <= total_capacity < 23
+        True
+        >>> all(instance.agent_item_value(agent, "c2")==(1 if agent.endswith("Alice") else 5) for agent in instance.agents)
+        True
+        >>> all(instance.agent_conflicts(agent)==(["c2"] if agent.endswith("Alice") else set()) for agent in instance.agents)
+        True
         """
-        if random_seed is None:
-            random_seed = np.random.randint(1, 2**31)
-        np.random.seed(random_seed)
-        logger.info("Random seed: %d", random_seed)
+        rng = random_generator(random_seed, rng)
         prototype_agents = list(prototype_valuations.keys())
-
-        agent_capacities = dict()
-        agent_conflicts = dict()
-        valuations = dict()
-
-        def add_agent(new_agent, prototype_agent):
-            nonlocal max_total_agent_capacity, max_num_of_agents, agent_capacities, valuations, agent_conflicts
-            new_agent_capacity = prototype_agent_capacities[prototype_agent]
-            agent_capacities[new_agent] = new_agent_capacity
-            if prototype_agent in prototype_agent_conflicts:
-                agent_conflicts[new_agent]  = prototype_agent_conflicts[prototype_agent]
-            valuations[new_agent] = prototype_valuations[prototype_agent]
-            max_total_agent_capacity -= new_agent_capacity
-            max_num_of_agents -= 1
+        num_of_prototypes = len(prototype_agents)
+        prototype_capacities = np.array([prototype_agent_capacities[agent] for agent in prototype_agents])
 
         # First, add one copy of each prototype agent:
-        for agent in prototype_agents:
-            add_agent(f"{agent}", agent)
+        remaining_capacity = max_total_agent_capacity - prototype_capacities.sum()
+        remaining_num_of_agents = max_num_of_agents - num_of_prototypes
+        sampled_prototypes = [np.arange(num_of_prototypes)]
 
-        # Next, add random copies until one of the max_ values is hit:
-        i = 1
+        # Next, add random copies until one of the max_ values is hit (at least one copy is added):
+        mean_capacity = prototype_capacities.mean()
         while True:
-            prototype_agent = np.random.choice(prototype_agents)
-            new_agent = f"random{i}.{prototype_agent}"
-            add_agent(new_agent, prototype_agent)
-            if max_total_agent_capacity<=0:
-                break
-            if max_num_of_agents<=0:
+            max_batch_size = max(remaining_num_of_agents, 1)
+            batch_size = min(int(np.ceil(remaining_capacity / mean_capacity)) + 1, max_batch_size) if mean_capacity>0 else max_batch_size
+            batch = rng.integers(num_of_prototypes, size=max(batch_size, 1))
+            cumulative_capacities = np.cumsum(prototype_capacities[batch])
+            capacity_cutoffs = np.flatnonzero(cumulative_capacities >= remaining_capacity)
+            cutoff = capacity_cutoffs[0]+1 if len(capacity_cutoffs)>0 else len(batch)
+            sampled_prototypes.append(batch[:cutoff])
+            remaining_capacity -= cumulative_capacities[cutoff-1]
+            remaining_num_of_agents -= cutoff
+            if remaining_capacity<=0 or remaining_num_of_agents<=0:
                 break
-            i += 1
 
-        return Instance(valuations=valuations, agent_capacities=agent_capacities, agent_conflicts=agent_conflicts,
-                        item_capacities=item_capacities, item_conflicts=item_conflicts)
+        agent_prototypes = np.concatenate(sampled_prototypes)
+        agents = [f"{agent}" for agent in prototype_agents] + \
+            [f"random{i}.{prototype_agents[prototype]}" for i,prototype in enumerate(agent_prototypes[num_of_prototypes:].tolist(), start=1)]
+        map_agent_to_prototype = dict(zip(agents, (prototype_agents[prototype] for prototype in agent_prototypes.tolist())))
+
+        _, prototype_item_keys, prototype_item_value = get_keys_and_mapping_2d(prototype_valuations)
+        items = list(get_keys_and_mapping(item_capacities)[0] or prototype_item_keys)
+        prototype_matrix = np.array([[prototype_item_value(prototype, item) for item in items] for prototype in prototype_agents]).reshape(num_of_prototypes, len(items))
+        prototype_conflicts = get_conflicts(prototype_agent_conflicts) or constant_function(set())
+        return Instance(
+            valuations=IndexedRowsMatrix(prototype_matrix, agent_prototypes),
+            agent_capacities=prototype_capacities[agent_prototypes],
+            agent_conflicts=lambda agent: prototype_conflicts(map_agent_to_prototype[agent]),
+            item_capacities=item_capacities, item_conflicts=item_conflicts,
+            agents=agents, items=items)
+
+
+
+class SubInstance(Instance):
+    """
+    The sub-instance of a parent instance, induced by subsets of its agents and items, with new capacities.
+    Values, entitlements and conflicts are answered by the parent instance directly.
+    Its arrays are slices of the parent's arrays, taken on first use: a slice over a contiguous range of agents/items is a view
+    (no copy), and otherwise a single gather of the sub-matrix.
+    If the parent's valuations are sparse, they are sliced in CSR format, and only the sub-block is densified (if its dense matrix is needed).
+
+    >>> parent = Instance(valuations={"Alice": {"c1": 11, "c2": 22, "c3": 33}, "Bob": {"c1": 44, "c2": 55, "c3": 66}})
+    >>> sub = SubInstance(parent, agents=["Bob"], items=["c1", "c3"], agent_capacities=np.array([1]), item_capacities=np.array([2, 3]))
+    >>> sub.agent_item_value("Bob", "c3"), sub.agent_capacity("Bob"), sub.item_capacity("c3")
+    (66, 1, 3)
+    >>> sub.valuation_matrix, sub.agent_maximum_value("Bob")
+    (array([[44, 66]]), 66)
+    >>> np.shares_memory(SubInstance(parent, ["Alice", "Bob"], ["c2", "c3"], 1, 1).valuation_matrix, parent.valuation_matrix)
+    True
+    """
+    def __init__(self, parent:Instance, agents:list, items:list, agent_capacities:any, item_capacities:any):
+        super().__init__(
+            valuations=parent.agent_item_value,
+            agent_capacities=agent_capacities,
+            agent_entitlements=parent.agent_entitlement,
+            agent_conflicts=parent.agent_conflicts,
+            item_capacities=item_capacities,
+            item_conflicts=parent.item_conflicts,
+            agents=agents, items=items)
+        self.parent = parent
+        self.is_sparse = parent.is_sparse
+
+    @cached_property
+    def agent_rows(self)->np.ndarray:
+        """
+        The rows of the agents of this sub-instance in the parent's arrays.
+        """
+        parent_index = self.parent.agent_index
+        return np.array([parent_index[agent] for agent in self.agents], dtype=int)
+
+    @cached_property
+    def item_columns(self)->np.ndarray:
+        """
+        The columns of the items of this sub-instance in the parent's arrays.
+        """
+        parent_index = self.parent.item_index
+        return np.array([parent_index[item] for item in self.items], dtype=int)
+
+    @cached_property
+    def valuation_matrix(self)->np.ndarray:
+        if self.is_sparse:     # densify only the sub-block, not the parent
+            return self.sparse_valuation_matrix.toarray()
+        if isinstance(self.parent._valuations, IndexedRowsMatrix):
+            return self.parent._valuations.submatrix(self.agent_rows, self.item_columns)
+        return submatrix(self.parent.valuation_matrix, self.agent_rows, self.item_columns)
+
+    @cached_property
+    def sparse_valuation_matrix(self)->scipy.sparse.csr_matrix:
+        return self.parent.sparse_valuation_matrix[self.agent_rows][:, self.item_columns]
+
+    @cached_property
+    def agent_entitlement_vector(self)->np.ndarray:
+        return self.parent.agent_entitlement_vector[self.agent_rows]
+
+    @cached_property
+    def agent_conflict_matrix(self)->scipy.sparse.csr_matrix:
+        return self.parent.agent_conflict_matrix[self.agent_rows][:, self.item_columns]
+
+    @cached_property
+    def item_conflict_matrix(self)->scipy.sparse.csr_matrix:
+        return self.parent.item_conflict_matrix[self.item_columns][:, self.item_columns]
+
+
+class IndexedRowsMatrix:
+    """
+    A read-only matrix whose distinct rows are stored once: row i is rows[row_index[i]].
+    The memory grows with the number of distinct rows (plus one index per row), not with the number of rows.
+    Used as the valuations of instances whose agents are copies of a few prototypes (see `Instance.random_sample`).
+
+    >>> matrix = IndexedRowsMatrix(np.array([[1,2,3],[4,5,6]]), np.array([1,0,1,1]))
+    >>> matrix.shape
+    (4, 3)
+    >>> matrix.toarray()
+    array([[4, 5, 6],
+           [1, 2, 3],
+           [4, 5, 6],
+           [4, 5, 6]])
+    >>> matrix.submatrix(np.array([1,3]), np.array([0,2]))
+    array([[1, 3],
+           [4, 6]])
+    """
+    def __init__(self, rows:np.ndarray, row_index:np.ndarray):
+        self.rows = np.asarray(rows)
+        self.row_index = np.asarray(row_index, dtype=int)
+        self.shape = (len(self.row_index), self.rows.shape[1])
+        self.dtype = self.rows.dtype
+
+    def toarray(self)->np.ndarray:
+        return self.rows[self.row_index]
+
+    def submatrix(self, rows:np.ndarray, columns:np.ndarray)->np.ndarray:
+        """
+        Return the dense sub-matrix in the given rows and columns, gathered directly from the distinct rows.
+        """
+        return self.rows[np.ix_(self.row_index[rows], columns)]
+
+
+def top_values(matrix:any, k:int)->np.ndarray:
+    """
+    Return an array with k columns, in which row i contains the k largest entries of row i of the given matrix, from largest to smallest.
+    The matrix may be dense, or a canonical CSR matrix; in the latter case, only the stored entries are sorted, and the other entries count as zeros.
+
+    >>> matrix = np.array([[1,5,3,4],[0,-2,8,0],[-1,-3,0,-2]])
+    >>> top_values(matrix, 3)
+    array([[ 5,  4,  3],
+           [ 8,  0,  0],
+           [ 0, -1, -2]])
+    >>> np.array_equal(top_values(canonical_sparse_matrix(matrix), 3), top_values(matrix, 3))
+    True
+    """
+    num_of_rows, num_of_columns = matrix.shape
+    k = min(k, num_of_columns)
+    if not scipy.sparse.issparse(matrix):
+        top = -np.partition(-matrix, k-1, axis=1)[:, :k]    # the top values of each row, in arbitrary order
+        return -np.sort(-top, axis=1)
+    row_lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(num_of_rows), row_lengths)
+    values = matrix.data[np.lexsort((-matrix.data, rows))]      # the stored values of each row, from largest to smallest
+    positions = np.arange(len(values)) - np.repeat(matrix.indptr[:-1], row_lengths)
+    ranks = np.where(values>0, positions, positions + (num_of_columns - row_lengths)[rows])   # the zeros come before the negative values
+    top = np.zeros((num_of_rows, k), dtype=matrix.dtype)
+    kept = ranks < k
+    top[rows[kept], ranks[kept]] = values[kept]
+    return top
+
+
+def sparse_preference_order(matrix:scipy.sparse.csr_matrix)->np.ndarray:
+    """
+    Return the preference order (see `Instance.preference_order`) of a canonical CSR valuation matrix, computed from its stored entries:
+    in each row, the columns of the positive entries (from largest to smallest), then the other columns (in increasing order),
+    then the columns of the negative entries (from largest to smallest).
+
+    >>> matrix = np.array([[1,0,3,-4,3],[0,-2,0,0,5]])
+    >>> order = sparse_preference_order(canonical_sparse_matrix(matrix))
+    >>> order
+    array([[2, 4, 0, 1, 3],
+           [4, 0, 2, 3, 1]])
+    >>> np.array_equal(order, np.argsort(-matrix, axis=1, kind="stable"))
+    True
+    """
+    num_of_rows, num_of_columns = matrix.shape
+    row_lengths = np.diff(matrix.indptr)
+    num_of_zeros = num_of_columns - row_lengths
+    rows = np.repeat(np.arange(num_of_rows), row_lengths)
+    order = np.lexsort((matrix.indices, -matrix.data, rows))
+    columns, values = matrix.indices[order], matrix.data[order]
+    positions = np.arange(len(values)) - np.repeat(matrix.indptr[:-1], row_lengths)
+    result = np.empty((num_of_rows, num_of_columns), dtype=np.intp)
+    result[rows, np.where(values>0, positions, positions + num_of_zeros[rows])] = columns
+    is_stored = np.zeros((num_of_rows, num_of_columns), dtype=bool)
+    is_stored[rows, matrix.indices] = True
+    zero_rows, zero_columns = np.nonzero(~is_stored)
+    num_of_positives = np.bincount(rows[matrix.data>0], minlength=num_of_rows)
+    zero_positions = np.arange(len(zero_rows)) - np.repeat(np.cumsum(num_of_zeros) - num_of_zeros, num_of_zeros)
+    result[zero_rows, num_of_positives[zero_rows] + zero_positions] = zero_columns
+    return result
+
+
+def submatrix(matrix:np.ndarray, rows:np.ndarray, columns:np.ndarray)->np.ndarray:
+    """
+    Return matrix[rows][:,columns]. Contiguous runs of indices are taken as slices, so if both are contiguous, the result is a view.
+
+    >>> matrix = np.arange(12).reshape(3,4)
+    >>> submatrix(matrix, np.array([1,2]), np.array([0,1,2]))
+    array([[ 4,  5,  6],
+           [ 8,  9, 10]])
+    >>> submatrix(matrix, np.array([0,2]), np.array([3,1]))
+    array([[ 3,  1],
+           [11,  9]])
+    """
+    rows, columns = contiguous_slice(rows), contiguous_slice(columns)
+    if isinstance(rows, slice) or isinstance(columns, slice):
+        return matrix[rows, columns]
+    return matrix[np.ix_(rows, columns)]
+
+
+def contiguous_slice(indices:np.ndarray)->any:
+    """
+    Return a slice equivalent to the given increasing run of indices, if there is one; otherwise, the indices.
+
+    >>> contiguous_slice(np.array([2,3,4])), contiguous_slice(np.array([2,4]))
+    (slice(2, 5, None), array([2, 4]))
+    """
+    if len(indices)==0 or np.array_equal(indices, np.arange(indices[0], indices[0]+len(indices))):
+        start = indices[0] if len(indices)>0 else 0
+        return slice(int(start), int(start)+len(indices))
+    return indices
+
 
+def random_generator(random_seed:int=None, rng:np.random.Generator=None)->np.random.Generator:
+    """
+    Return the given random generator, or a new generator created from the given seed.
+    If both are None, the seed is drawn from the global np.random (without reseeding it), so that np.random.seed still makes the result reproducible.
+    """
+    if rng is not None:
+        return rng
+    if random_seed is None:
+        random_seed = np.random.randint(1, 2**31)
+    logger.info("Random seed: %d", random_seed)
+    return np.random.default_rng(random_seed)
 
-        
 
-def random_valuation(numitems:int, item_value_bounds: tuple[float,float])->np.ndarray:
+def random_valuation(numitems:int, item_value_bounds: tuple[float,float], rng:np.random.Generator=None)->np.ndarray:
     """
+    :param numitems: the number of items, or a shape (num_of_agents, num_of_items) for a whole valuation matrix.
+
     >>> r = random_valuation(10, [30, 40])
     >>> len(r)
     10
     >>> all(r>=30)
     True
+    >>> random_valuation((2,3), [30, 40], np.random.default_rng(1)).shape
+    (2, 3)
     """
-    return np.random.uniform(low=item_value_bounds[0], high=item_value_bounds[1]+1, size=numitems)
+    return (rng or np.random).uniform(low=item_value_bounds[0], high=item_value_bounds[1]+1, size=numitems)
 
 def normalized_valuation(raw_valuations:np.ndarray, normalized_sum_of_values:float):
-    raw_sum_of_values = sum(raw_valuations)
+    """
+    Scale the valuation so that its sum is (about) normalized_sum_of_values. For a matrix, each row is scaled separately.
+
+    >>> normalized_valuation(np.array([[1, 3], [2, 2]]), 100)
+    array([[25, 75],
+           [50, 50]])
+    """
+    raw_sum_of_values = np.sum(raw_valuations, axis=-1, keepdims=True)
     return  np.round(raw_valuations * normalized_sum_of_values / raw_sum_of_values).astype(int)
 
 
@@ -475,6 +1351,14 @@ def get_keys_and_mapping_2d(container: any) -> tuple[list,callable]:
         f = lambda agent,item: container[agent][item]
         k1 = range(container.shape[0])
         k2 = range(container.shape[1])
+    elif scipy.sparse.issparse(container):
+        f = sparse_entry_function(canonical_sparse_matrix(container))
+        k1 = range(container.shape[0])
+        k2 = range(container.shape[1])
+    elif isinstance(container, IndexedRowsMatrix):
+        f = lambda agent,item: container.rows[container.row_index[agent], item]
+        k1 = range(container.shape[0])
+        k2 = range(container.shape[1])
     elif callable(container):
         f = container
         k1 = k2 = None
@@ -483,6 +1367,169 @@ def get_keys_and_mapping_2d(container: any) -> tuple[list,callable]:
     return k1,k2,f
 
 
+def canonical_sparse_matrix(matrix:any)->scipy.sparse.csr_matrix:
+    """
+    Convert a sparse matrix to CSR format, with sorted column indices, no duplicates and no explicitly-stored zeros.
+    A matrix that is already canonical is not modified, so it may be backed by read-only (e.g. memory-mapped) arrays.
+    """
+    matrix = scipy.sparse.csr_matrix(matrix)
+    if not matrix.has_canonical_format:
+        matrix.sum_duplicates()
+    if np.any(matrix.data==0):
+        matrix.eliminate_zeros()
+    return matrix
+
+
+def csr_arrays(name:str, matrix:scipy.sparse.csr_matrix)->dict:
+    """
+    Return the three arrays that represent the given CSR matrix, keyed by `name` with the array name as a suffix.
+    """
+    return {f"{name}.data": matrix.data, f"{name}.indices": matrix.indices, f"{name}.indptr": matrix.indptr}
+
+
+def positional_row_sets(matrix:scipy.sparse.csr_matrix, keys:list, get_index:callable, get_columns:callable)->callable:
+    """
+    Given a sparse matrix whose rows are aligned with the given keys, returns a callable function
+    that maps each key to the set of column names, for the columns stored in its row.
+
+    >>> f = positional_row_sets(scipy.sparse.csr_matrix([[0, 1, 1], [0, 0, 0]]), ["a", "b"], lambda: {"a":0, "b":1}, lambda: ["x", "y", "z"])
+    >>> sorted(f("a")), f("b")
+    (['y', 'z'], set())
+    """
+    indptr, indices = matrix.indptr, matrix.indices
+    def row_set(key:any)->set:
+        row = key if isinstance(keys, range) else get_index()[key]
+        columns = get_columns()
+        return {columns[column] for column in indices[indptr[row]:indptr[row+1]].tolist()}
+    return row_set
+
+
+def sparse_entry_function(matrix:scipy.sparse.csr_matrix)->callable:
+    """
+    Given a canonical CSR matrix, returns a callable function that maps a (row,column) pair to the entry, by a binary search in the row.
+
+    >>> f = sparse_entry_function(canonical_sparse_matrix(np.array([[0, 5, 0], [7, 0, 0]])))
+    >>> f(0,1), f(1,0), f(1,2)
+    (5, 7, 0)
+    """
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    zero = data.dtype.type(0)
+    def entry(row:int, column:int):
+        start, end = indptr[row], indptr[row+1]
+        position = start + np.searchsorted(indices[start:end], column)
+        return data[position] if position<end and indices[position]==column else zero
+    return entry
+
+
+class NameTable:
+    """
+    Assigns consecutive indices to names: either the positions in a given list of names,
+    or the order of first appearance of the names (when no list is given).
+
+    >>> table = NameTable()
+    >>> table.indices(["b", "a", "b"])
+    array([0, 1, 0])
+    >>> table.names
+    ['b', 'a']
+    """
+    def __init__(self, names:list=None):
+        self.is_fixed = names is not None
+        self.names = list(names) if self.is_fixed else []
+        self.index = {name: index for index,name in enumerate(self.names)}
+
+    def indices(self, names:list)->np.ndarray:
+        index = self.index
+        if not self.is_fixed:
+            for name in names:
+                if name not in index:
+                    index[name] = len(self.names)
+                    self.names.append(name)
+        try:
+            return np.fromiter((index[name] for name in names), dtype=np.int64, count=len(names))
+        except KeyError as error:
+            raise ValueError(f"Unknown name: {error.args[0]!r}") from None
+
+
+def read_columns_in_chunks(records:iter, chunksize:int):
+    """
+    Generate the given records in chunks of at most `chunksize` records; each chunk is given as a tuple of columns.
+
+    >>> list(read_columns_in_chunks([(1,"a"), (2,"b"), (3,"c")], 2))
+    [((1, 2), ('a', 'b')), ((3,), ('c',))]
+    """
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunksize))
+        if len(chunk)==0:
+            return
+        yield tuple(zip(*chunk))
+
+
+def read_index_value_pairs(records:iter, table:NameTable, chunksize:int, value_table:NameTable=None)->tuple:
+    """
+    Read records (name, value) into two arrays: the indices of the names in `table`, and the values
+    (or the indices of the values in `value_table`, if it is given). Returns None if there are no records.
+    """
+    if records is None:
+        return None
+    indices, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for name_column, value_column in read_columns_in_chunks(records, chunksize):
+        indices.append(table.indices(name_column))
+        values.append(value_table.indices(value_column) if value_table is not None else np.array(value_column))
+    return (np.concatenate(indices), np.concatenate(values))
+
+
+def csv_records(path:str, num_of_name_columns:int, num_of_numeric_columns:int, header:bool=True, delimiter:str=","):
+    """
+    Generate the rows of a CSV file as tuples, one row at a time: `num_of_name_columns` names followed by `num_of_numeric_columns` numbers.
+    A malformed row raises a ValueError with its line number.
+    """
+    num_of_columns = num_of_name_columns + num_of_numeric_columns
+    with open(path, newline="") as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        if header:
+            next(reader, None)
+        for row in reader:
+            if len(row)==0:
+                continue
+            if len(row) != num_of_columns:
+                raise ValueError(f"{path}, line {reader.line_num}: expected {num_of_columns} columns, got {len(row)}: {row}")
+            try:
+                numbers = tuple(parse_number(text) for text in row[num_of_name_columns:])
+            except ValueError:
+                raise ValueError(f"{path}, line {reader.line_num}: expected numbers in the last {num_of_numeric_columns} columns: {row}") from None
+            yield tuple(row[:num_of_name_columns]) + numbers
+
+
+def parse_number(text:str)->Number:
+    """
+    >>> parse_number("12"), parse_number("1.5")
+    (12, 1.5)
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def positional_mapping(array:np.ndarray, keys:list, get_index:callable)->callable:
+    """
+    Given a 1-dimensional array aligned with the given keys, returns a callable function that maps each key to its value.
+    If the keys are the default positions (0,1,...), the array is accessed directly.
+
+    >>> f = positional_mapping(np.array([11, 22]), ["a", "b"], lambda: {"a":0, "b":1})
+    >>> f("b")
+    22
+    >>> f = positional_mapping(np.array([11, 22]), range(2), None)
+    >>> f(1)
+    22
+    """
+    if isinstance(keys, range):
+        return array.__getitem__
+    index = get_index()
+    return lambda key: array[index[key]]
+
+
 def get_conflicts(container:any):
     """
     Given a container of any supported type, returns a callable function 
@@ -550,11 +1597,6 @@ if __name__ == "__main__":
         item_capacities={"c1": 5, "c2": 6, "c3": 7}, item_conflicts={})
     print("agents: ", random_instance.agents)
     print("items: ", random_instance.items)
-    print("valuations: ", dict(random_instance._valuations), "\n")
-
+    print("valuations: ", random_instance.valuation_matrix, "\n")
 
-    # Test the cache    
-    # print(random_instance.agent_maximum_value("s1"))
-    # print(random_instance.agent_maximum_value("s2"))
-    # print(random_instance.agent_maximum_value("s1"))
 
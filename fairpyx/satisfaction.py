@@ -6,17 +6,28 @@ Since: 2023-07
 """
 
 from fairpyx import Instance
+from fairpyx.allocations import AllocationMatrix
+import heapq
 import numpy as np
-
-from functools import cache
+import scipy.sparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import NamedTuple
 
 
 class AgentBundleValueMatrix:
+    """
+    The values of all agents to all bundles in an allocation, as NumPy arrays:
+    `raw_values[i,k]` is the value of agent i to the bundle of agent k (computed as V @ A.T, where V is the valuation matrix and A is the allocation matrix),
+    and `normalized_values` is the same, normalized such that the maximum possible value of each agent is 100.
+    All metrics are vector reductions on these arrays. The dict-of-dicts views (`raw_matrix`, `normalized_matrix`, `matrix`, `envy_matrix`)
+    are built lazily, only when accessed.
+    """
 
     def __init__(self, instance:Instance, allocation:dict[any, list[any]], normalized=True):
         """
         :param instance: an input instance to the fair-course-allocation problem.
-        :param allocation: a dict mapping each agent to its bundle (a list)
+        :param allocation: a dict mapping each agent to its bundle (a list), or an AllocationMatrix
         :param normalized: if True, it normalizes the valuations by the max-value.
 
         >>> instance = Instance(
@@ -44,101 +55,147 @@ class AgentBundleValueMatrix:
         1
         >>> matrix.count_agents_with_top_rank(2)
         2
+        >>> AgentBundleValueMatrix(instance, AllocationMatrix.from_dict(allocation), normalized=False).matrix
+        {'Alice': {'Alice': 11, 'Bob': 22}, 'Bob': {'Alice': 33, 'Bob': 44}}
+
+        The same metrics are available as arrays:
+        >>> matrix.values
+        array([[11, 22],
+               [33, 44]])
+        >>> matrix.utilities(), matrix.max_envy_values
+        (array([11, 44]), array([11,  0]))
+        >>> matrix.use_normalized_values()
+        >>> matrix.utilities()
+        array([33.33333333, 57.14285714])
         """
         self.instance = instance
         self.agents = instance.agents
-        self.raw_matrix = {
-            agent1: {
-                agent2: instance.agent_bundle_value(agent1, allocation[agent2])
-                for agent2 in self.agents
-            }
-            for agent1 in self.agents
-        }
-        self.maximum_values = {
-            agent: instance.agent_maximum_value(agent)
-            for agent in instance.agents
-        }
-        self.rankings = {
-            agent: instance.agent_ranking(agent, allocation[agent])
-            for agent in instance.agents
-        }
-        self.allocation = {
-            agent: sorted(allocation[agent], key=self.rankings[agent].__getitem__)
-            for agent in instance.agents
-        }
-        self.normalized_matrix = {
-            agent1: {
-                agent2: self.raw_matrix[agent1][agent2] / self.maximum_values[agent1] * 100
-                for agent2 in self.agents
-            }
-            for agent1 in self.agents
-        }
-        self.matrix = self.raw_matrix
-        self.envy_matrix = None  # maps each agent-pair to the envy between them.
-        self.envy_vector = None  # maps each agent to his maximum envy.
+        if isinstance(allocation, AllocationMatrix):
+            self.allocation_matrix = allocation.aligned_matrix(instance.agents, instance.items)
+            self._bundles = allocation.to_dict()
+        else:
+            self.allocation_matrix = AllocationMatrix.from_dict(allocation, instance.agents, instance.items).matrix
+            self._bundles = allocation
+        self.raw_values = np.asarray(instance.bundle_value_matrix(self.allocation_matrix))
+        self.maximum_values_array = instance.maximum_values
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.normalized_values = self.raw_values / self.maximum_values_array[:,None] * 100
+        self.bundle_sizes = np.asarray(self.allocation_matrix.sum(axis=1)).ravel()
+        self.normalized = False
+        self.values = self.raw_values
+        self.envy_values = None      # envy_values[i,k] is the envy of agent i in agent k.
+        self.max_envy_values = None  # max_envy_values[i] is the maximum envy of agent i.
+        self._envy_matrix = None
         if normalized:
             self.use_normalized_values()
 
+    @cached_property
+    def maximum_values(self)->dict:
+        return dict(zip(self.agents, self.maximum_values_array.tolist()))
+
+    @cached_property
+    def raw_matrix(self)->dict:
+        """ A dict-of-dicts view of raw_values. """
+        return _matrix_to_dict(self.raw_values, self.agents)
+
+    @cached_property
+    def normalized_matrix(self)->dict:
+        """ A dict-of-dicts view of normalized_values. """
+        return _matrix_to_dict(self.normalized_values, self.agents)
+
+    @property
+    def matrix(self)->dict:
+        """ A dict-of-dicts view of the values currently in use (raw or normalized). """
+        return self.normalized_matrix if self.normalized else self.raw_matrix
+
+    @property
+    def envy_matrix(self)->dict:
+        """ A dict-of-dicts view of envy_values, or None if make_envy_matrix was not called. """
+        if self.envy_values is None:
+            return None
+        if self._envy_matrix is None:
+            self._envy_matrix = _matrix_to_dict(self.envy_values, self.agents)
+        return self._envy_matrix
+
+    @property
+    def envy_vector(self)->dict:
+        """ Maps each agent to his maximum envy, or None if make_envy_matrix was not called. """
+        if self.max_envy_values is None:
+            return None
+        return dict(zip(self.agents, self.max_envy_values.tolist()))
+
+    @cached_property
+    def rankings(self)->dict:
+        return {
+            agent: self.instance.agent_ranking(agent, self._bundles.get(agent, []))
+            for agent in self.agents
+        }
+
+    @cached_property
+    def allocation(self)->dict:
+        return {
+            agent: sorted(self._bundles.get(agent, []), key=self.rankings[agent].__getitem__)
+            for agent in self.agents
+        }
+
     def use_raw_values(self)->float:
         """
         In the computations of utilitarian and egalitarian values, use the raw valuations of the agents.
         """
-        if self.matrix!=self.raw_matrix:
-           self.matrix = self.raw_matrix
-           self.envy_matrix = self.envy_vector = None
+        if self.normalized:
+           self.normalized = False
+           self.values = self.raw_values
+           self.envy_values = self.max_envy_values = self._envy_matrix = None
 
     def use_normalized_values(self)->float:
         """
         In the computations of utilitarian and egalitarian values, use the valuations of the agents normalized such that their maximum possible value is 100.
         """
-        if self.matrix!=self.normalized_matrix:
-           self.matrix = self.normalized_matrix
-           self.envy_matrix = self.envy_vector = None
+        if not self.normalized:
+           self.normalized = True
+           self.values = self.normalized_values
+           self.envy_values = self.max_envy_values = self._envy_matrix = None
+
+    def utilities(self)->np.ndarray:
+        """
+        Return a vector with the value of each agent to its own bundle.
+        """
+        return np.diagonal(self.values)
 
     def utilitarian_value(self)->float:
-        return sum([self.matrix[agent][agent] for agent in self.agents])/len(self.agents)
+        return (self.utilities().sum() / len(self.agents)).item()
 
     def egalitarian_value(self)->float:
-        return min([self.matrix[agent][agent] for agent in self.agents])
+        return self.utilities().min().item()
 
     def make_envy_matrix(self):
-        if self.envy_matrix is not None:
+        if self.envy_values is not None:
             return
-        self.envy_matrix = {
-            agent1: {
-                agent2: self.matrix[agent1][agent2] - self.matrix[agent1][agent1]
-                for agent2 in self.agents
-            }
-            for agent1 in self.agents
-        }
-        self.envy_vector = {
-            agent1: max(self.envy_matrix[agent1].values())
-            for agent1 in self.agents
-        }
+        self.envy_values = self.values - self.utilities()[:,None]
+        self.max_envy_values = self.envy_values.max(axis=1)
 
     def max_envy(self):
         self.make_envy_matrix()
-        return max(self.envy_vector.values())
+        return self.max_envy_values.max().item()
 
     def mean_envy(self):
         self.make_envy_matrix()
-        return sum([max(envy,0) for envy in self.envy_vector.values()]) / len(self.agents)
+        return (np.maximum(self.max_envy_values, 0).sum() / len(self.agents)).item()
 
-    def egalitarian_value(self):
-        return min([self.matrix[agent][agent] for agent in self.agents])
-
-    @cache
     def agent_deficit(self, agent):
         """ A "deficit" is the number of courses the agent received below its capacity. """
         return self.instance.agent_capacity(agent) - len(self.allocation[agent])
 
+    def deficits(self)->np.ndarray:
+        """ Return a vector with the deficit of each agent. """
+        return self.instance.agent_capacity_vector - self.bundle_sizes
+
     def mean_deficit(self):
-        return sum([self.agent_deficit(agent) for agent in self.agents])/len(self.agents)
+        return (self.deficits().sum() / len(self.agents)).item()
 
     def max_deficit(self):
-        return max([self.agent_deficit(agent) for agent in self.agents])
+        return self.deficits().max().item()
 
-    @cache
     def top_rank(self, agent):
         if len(self.allocation[agent])>0:
             return self.rankings[agent][self.allocation[agent][0]]
@@ -160,6 +217,327 @@ class AgentBundleValueMatrix:
             explanation_logger.info(f"Your total value is {self.raw_matrix[agent][agent]}, which is {np.round(self.normalized_matrix[agent][agent])}% of the maximum.", agents=agent)
 
 
+class IncrementalSatisfaction:
+    """
+    Satisfaction metrics that are kept up to date while an allocation changes by small steps, as in local-search algorithms.
+
+    The bundle values are kept in an n x n array: values[i,k] is the value of agent i to the bundle of agent k.
+    * `move` changes the bundle of one agent, so only one column of `values` changes: O(n) per move
+      (plus O(n) for each agent whose most-valuable bundle was the changed one, and lost value).
+    * `swap` exchanges the bundles of two agents, so two columns are exchanged, and the maximum bundle value of each agent does not change.
+    The utilitarian sum is updated with each change, the egalitarian minimum is kept in a heap, and the max envy is a reduction on two vectors.
+
+    >>> instance = Instance(valuations={"Alice": [10,10,6,4], "Bob": [7,5,6,6], "Claire":[2,8,8,7]})
+    >>> metrics = IncrementalSatisfaction(instance, {"Alice": [2], "Bob": [1], "Claire":[0]})
+    >>> metrics.utilitarian_value(), metrics.egalitarian_value(), metrics.max_envy()
+    (4.333333333333333, 2, 6)
+    >>> metrics.swap("Bob", "Claire")
+    >>> metrics.allocation()
+    {'Alice': [2], 'Bob': [0], 'Claire': [1]}
+    >>> metrics.utilitarian_value(), metrics.egalitarian_value(), metrics.max_envy()
+    (7.0, 6, 4)
+    >>> metrics.move("Alice", 2, 3)
+    >>> metrics.values
+    array([[ 4, 10, 10],
+           [ 6,  7,  5],
+           [ 7,  2,  8]])
+    >>> metrics.utilitarian_value(), metrics.egalitarian_value(), metrics.max_envy(), metrics.mean_envy()
+    (6.333333333333333, 4, 6, 2.0)
+    >>> metrics.max_envy() == AgentBundleValueMatrix(instance, metrics.allocation(), normalized=False).max_envy()
+    True
+    """
+
+    def __init__(self, instance:Instance, allocation:any):
+        """
+        :param allocation: a dict mapping each agent to its bundle, or an AllocationMatrix.
+        """
+        self.instance = instance
+        self.agents = list(instance.agents)
+        allocation_matrix = _allocation_csr(instance, allocation)
+        self.bundles = [set(allocation_matrix.indices[allocation_matrix.indptr[row]:allocation_matrix.indptr[row+1]].tolist()) for row in range(len(self.agents))]
+        if instance.is_sparse:
+            self._item_columns = instance.sparse_valuation_matrix.tocsc()
+            self.values = np.asarray((instance.sparse_valuation_matrix @ allocation_matrix.T).todense())
+        else:
+            self._item_columns = None
+            self.values = np.asarray(allocation_matrix @ instance.valuation_matrix.T).T
+        self.utilities = np.diagonal(self.values).copy()        # utilities[i] is the value of agent i to its own bundle.
+        self.max_bundle_values = self.values.max(axis=1)          # max_bundle_values[i] is the maximum value of agent i to any bundle (including its own).
+        self.utilitarian_sum = self.utilities.sum()
+        self._utility_heap = []
+        self._rebuild_heap()
+
+    def _item_values(self, item_index:int)->np.ndarray:
+        # The values of all agents to the given item.
+        if self._item_columns is None:
+            return self.instance.valuation_matrix[:, item_index]
+        return self._item_columns[:, item_index].toarray().ravel()
+
+    def _rebuild_heap(self):
+        self._utility_heap = list(zip(self.utilities.tolist(), range(len(self.agents))))
+        heapq.heapify(self._utility_heap)
+
+    def _set_utility(self, row:int):
+        new_utility = self.values[row,row]
+        self.utilitarian_sum += new_utility - self.utilities[row]
+        self.utilities[row] = new_utility
+        heapq.heappush(self._utility_heap, (new_utility.item(), row))
+        if len(self._utility_heap) > 4 * len(self.agents) + 16:    # drop the stale entries
+            self._rebuild_heap()
+
+    def move(self, agent:any, item_out:any=None, item_in:any=None):
+        """
+        Remove item_out (if not None) from the bundle of the given agent, and add item_in (if not None) to it.
+        If the move is invalid, a ValueError is raised and nothing changes.
+        """
+        column = self.instance.agent_index[agent]
+        bundle = self.bundles[column]
+        item_out_index = None if item_out is None else self.instance.item_index[item_out]
+        item_in_index = None if item_in is None else self.instance.item_index[item_in]
+        if item_out_index is not None and item_out_index not in bundle:
+            raise ValueError(f"Agent {agent} does not hold item {item_out}")
+        if item_in_index is not None and item_in_index != item_out_index and item_in_index in bundle:
+            raise ValueError(f"Agent {agent} already holds item {item_in}")
+        if item_out_index == item_in_index:
+            return
+        change = 0
+        if item_out_index is not None:
+            bundle.remove(item_out_index)
+            change = change - self._item_values(item_out_index)
+        if item_in_index is not None:
+            bundle.add(item_in_index)
+            change = change + self._item_values(item_in_index)
+        old_column = self.values[:,column].copy()
+        self.values[:,column] += change
+        new_column = self.values[:,column]
+        self.max_bundle_values = np.maximum(self.max_bundle_values, new_column)
+        for row in np.flatnonzero((new_column < old_column) & (old_column == self.max_bundle_values)).tolist():
+            self.max_bundle_values[row] = self.values[row].max()   # the most valuable bundle of this agent lost value
+        self._set_utility(column)
+
+    def swap(self, agent1:any, agent2:any):
+        """
+        Exchange the bundles of the two given agents.
+        """
+        column1, column2 = self.instance.agent_index[agent1], self.instance.agent_index[agent2]
+        self.bundles[column1], self.bundles[column2] = self.bundles[column2], self.bundles[column1]
+        self.values[:,[column1,column2]] = self.values[:,[column2,column1]]
+        self._set_utility(column1)
+        self._set_utility(column2)
+
+    def allocation(self)->dict:
+        """
+        Return the current allocation, as a dict mapping each agent to the sorted list of its items.
+        """
+        item_list = self.instance.item_list
+        return {agent: sorted(item_list[item_index] for item_index in bundle) for agent,bundle in zip(self.agents, self.bundles)}
+
+    def utilitarian_value(self)->float:
+        return (self.utilitarian_sum / len(self.agents)).item()
+
+    def egalitarian_value(self)->float:
+        heap = self._utility_heap
+        while heap[0][0] != self.utilities[heap[0][1]]:    # a stale entry, of a utility that has changed
+            heapq.heappop(heap)
+        return heap[0][0]
+
+    def envy_vector(self)->np.ndarray:
+        """
+        Return a vector with the maximum envy of each agent (at least 0, since an agent does not envy itself).
+        """
+        return self.max_bundle_values - self.utilities
+
+    def max_envy(self):
+        return self.envy_vector().max().item()
+
+    def mean_envy(self):
+        return (self.envy_vector().sum() / len(self.agents)).item()
+
+
+class EnvyStatistics(NamedTuple):
+    """
+    Envy statistics of an allocation (see `envy_statistics`).
+    """
+    max_envy: np.ndarray               # max_envy[i] is the maximum envy of agent i (at least 0, since an agent does not envy itself).
+    mean_envy: float                   # the mean of max_envy over all agents.
+    envy_edges: scipy.sparse.csr_matrix  # envy_edges[i,k] is the envy of agent i in agent k, stored only when positive.
+
+
+def envy_statistics(instance:Instance, allocation:any, normalized:bool=False, block_size:int=1024, num_of_threads:int=None, edges:bool=True)->EnvyStatistics:
+    """
+    Compute the per-agent maximum envy, the mean envy, and the envy edges of an allocation, without materializing the n x n envy matrix.
+    The envy matrix is computed in blocks of `block_size` rows, so the memory is O(block_size * num_of_agents) per thread
+    (plus the envy edges, if requested).
+
+    :param allocation: a dict mapping each agent to its bundle, or an AllocationMatrix.
+    :param normalized: if True, the values of each agent are normalized such that its maximum possible value is 100.
+    :param block_size: the number of rows of the envy matrix that are computed at once.
+    :param num_of_threads: if given (and larger than 1), the blocks are computed in a thread pool (NumPy releases the GIL in matrix products).
+    :param edges: if False, the envy edges are not collected, and `envy_edges` is None.
+
+    >>> instance = Instance(valuations={"Alice": [10,10,6,4], "Bob": [7,5,6,6], "Claire":[2,8,8,7]})
+    >>> statistics = envy_statistics(instance, {"Alice": [2], "Bob": [1], "Claire":[0]}, block_size=2)
+    >>> statistics.max_envy, statistics.mean_envy
+    (array([4, 2, 6]), 4.0)
+    >>> statistics.envy_edges.toarray()
+    array([[0, 4, 4],
+           [1, 0, 2],
+           [6, 6, 0]])
+    >>> envy_statistics(instance, {"Alice": [2], "Bob": [1], "Claire":[0]}, normalized=True, num_of_threads=2, block_size=1, edges=False).mean_envy
+    15.22222222222222
+    """
+    allocation_matrix = _allocation_csr(instance, allocation)
+    num_of_agents = instance.num_of_agents
+    valuation_matrix = instance.sparse_valuation_matrix if instance.is_sparse else instance.valuation_matrix
+    maximum_values = instance.maximum_values if normalized else None
+
+    def block_statistics(start:int):
+        rows = np.arange(start, min(start+block_size, num_of_agents))
+        if instance.is_sparse:
+            values = np.asarray((valuation_matrix[rows] @ allocation_matrix.T).todense())
+        else:
+            values = np.asarray(allocation_matrix @ valuation_matrix[rows].T).T    # values[r,k] is the value of agent rows[r] to the bundle of agent k
+        if normalized:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = values / maximum_values[rows,None] * 100
+        envy = values - values[np.arange(len(rows)), rows][:,None]
+        block_edges = scipy.sparse.csr_matrix(np.where(envy > 0, envy, 0)) if edges else None
+        return envy.max(axis=1), block_edges
+
+    results = _map_blocks(block_statistics, num_of_agents, block_size, num_of_threads)
+    max_envy = np.concatenate([block_max for block_max,_ in results]) if results else np.zeros(0)
+    envy_edges = scipy.sparse.vstack([block_edges for _,block_edges in results], format="csr") if edges and results else None
+    mean_envy = (np.maximum(max_envy, 0).sum() / num_of_agents).item() if num_of_agents > 0 else 0
+    return EnvyStatistics(max_envy, mean_envy, envy_edges)
+
+
+class EnvyFreenessReport(NamedTuple):
+    """
+    The violations of a relaxation of envy-freeness (see `ef1_violations` and `efx_violations`).
+    """
+    num_of_violations: int              # the number of ordered pairs (i,k) such that agent i envies agent k beyond the criterion.
+    violations_per_agent: np.ndarray    # violations_per_agent[i] is the number of agents that agent i envies beyond the criterion.
+    worst_pairs: list                   # tuples (envious agent, envied agent, remaining envy), ordered from the largest remaining envy.
+
+
+def ef1_violations(instance:Instance, allocation:any, block_size:int=None, num_of_threads:int=None, num_of_worst_pairs:int=10)->EnvyFreenessReport:
+    """
+    Check envy-freeness up to one item (EF1): for every pair of agents i,k, the envy of i in k should disappear
+    after removing from the bundle of k the item that i values most.
+
+    :param allocation: a dict mapping each agent to its bundle, or an AllocationMatrix.
+    :param block_size: the number of envious agents checked at once. The memory is O(block_size * num_of_agents * max_bundle_size) per thread.
+                       Default: a block size that keeps this product at about 16 million.
+    :param num_of_threads: if given (and larger than 1), the blocks are checked in a thread pool.
+    :param num_of_worst_pairs: the maximum number of pairs in `worst_pairs`.
+
+    >>> instance = Instance(valuations={"Alice": [10,10,6,4], "Bob": [7,5,6,6], "Claire":[2,8,8,7]})
+    >>> ef1_violations(instance, {"Alice": [2], "Bob": [1], "Claire":[0]})
+    EnvyFreenessReport(num_of_violations=0, violations_per_agent=array([0, 0, 0]), worst_pairs=[])
+    >>> report = ef1_violations(instance, {"Alice": [], "Bob": [0, 1], "Claire":[2, 3]}, block_size=1)
+    >>> report.num_of_violations, report.violations_per_agent
+    (2, array([2, 0, 0]))
+    >>> report.worst_pairs
+    [('Alice', 'Bob', 10), ('Alice', 'Claire', 4)]
+    """
+    return _envy_up_to_one_item(instance, allocation, "EF1", block_size, num_of_threads, num_of_worst_pairs)
+
+
+def efx_violations(instance:Instance, allocation:any, block_size:int=None, num_of_threads:int=None, num_of_worst_pairs:int=10)->EnvyFreenessReport:
+    """
+    Check envy-freeness up to any item (EFX): for every pair of agents i,k, the envy of i in k should disappear
+    after removing from the bundle of k any item that i values positively (in particular, the one that i values least).
+
+    The parameters are as in `ef1_violations`.
+
+    >>> instance = Instance(valuations={"Alice": [10,10,6,4], "Bob": [7,5,6,6], "Claire":[2,8,8,7]})
+    >>> allocation = {"Alice": [2], "Bob": [0,1], "Claire":[3]}
+    >>> report = efx_violations(instance, allocation)
+    >>> report.num_of_violations, report.worst_pairs
+    (2, [('Alice', 'Bob', 4), ('Claire', 'Bob', 1)])
+    >>> ef1_violations(instance, allocation).worst_pairs
+    [('Alice', 'Bob', 4)]
+    >>> efx_violations(instance, {"Alice": [0,1], "Bob": [2,3], "Claire":[]}, block_size=2, num_of_threads=2, num_of_worst_pairs=1).worst_pairs
+    [('Claire', 'Alice', 8)]
+    """
+    return _envy_up_to_one_item(instance, allocation, "EFX", block_size, num_of_threads, num_of_worst_pairs)
+
+
+def _envy_up_to_one_item(instance:Instance, allocation:any, criterion:str, block_size:int, num_of_threads:int, num_of_worst_pairs:int)->EnvyFreenessReport:
+    allocation_matrix = _allocation_csr(instance, allocation)
+    num_of_agents, num_of_items = instance.num_of_agents, instance.num_of_items
+
+    # bundle_items[k] contains the item indices in the bundle of agent k, padded with num_of_items (an index of a dummy item):
+    bundle_sizes = np.diff(allocation_matrix.indptr)
+    max_bundle_size = max(int(bundle_sizes.max()) if num_of_agents > 0 else 0, 1)
+    bundle_items = np.full((num_of_agents, max_bundle_size), num_of_items)
+    positions = np.arange(allocation_matrix.nnz) - np.repeat(allocation_matrix.indptr[:-1], bundle_sizes)
+    bundle_items[np.repeat(np.arange(num_of_agents), bundle_sizes), positions] = allocation_matrix.indices
+    padding = bundle_items == num_of_items
+    empty_bundles = bundle_sizes == 0
+    if block_size is None:
+        block_size = max(1, 2**24 // max(num_of_agents * max_bundle_size, 1))
+
+    def block_violations(start:int):
+        rows = np.arange(start, min(start+block_size, num_of_agents))
+        if instance.is_sparse:
+            values = instance.sparse_valuation_matrix[rows].toarray()
+        else:
+            values = instance.valuation_matrix[rows]
+        values = np.hstack([values, np.zeros((len(rows), 1))])
+        item_values = values[:, bundle_items]                      # item_values[r,k,t] is the value of agent rows[r] to item t in the bundle of agent k
+        bundle_values = item_values.sum(axis=2)                    # the dummy item has value 0
+        if criterion=="EF1":
+            removed_values = np.where(padding, -np.inf, item_values).max(axis=2)
+            removed_values[:, empty_bundles] = 0
+        else:
+            removed_values = np.where(~padding & (item_values > 0), item_values, np.inf).min(axis=2)
+        remaining_envy = bundle_values - removed_values - bundle_values[np.arange(len(rows)), rows][:,None]
+        remaining_envy[np.arange(len(rows)), rows] = 0             # an agent does not envy itself
+        violating_rows, violating_columns = np.nonzero(remaining_envy > 0)
+        amounts = remaining_envy[violating_rows, violating_columns]
+        if len(amounts) > num_of_worst_pairs:
+            worst = np.argpartition(-amounts, num_of_worst_pairs)[:num_of_worst_pairs]
+            worst_pairs = (rows[violating_rows[worst]], violating_columns[worst], amounts[worst])
+        else:
+            worst_pairs = (rows[violating_rows], violating_columns, amounts)
+        return np.bincount(violating_rows, minlength=len(rows)), worst_pairs
+
+    results = _map_blocks(block_violations, num_of_agents, block_size, num_of_threads)
+    violations_per_agent = np.concatenate([counts for counts,_ in results]) if results else np.zeros(0, dtype=int)
+    agents = list(instance.agents)
+    worst_pairs = sorted(
+        ((agents[row], agents[column], amount) for _,pairs in results for row,column,amount in zip(*(array.tolist() for array in pairs))),
+        key=lambda pair: -pair[2])[:num_of_worst_pairs]
+    worst_pairs = [(agent, other, int(amount) if float(amount).is_integer() else amount) for agent,other,amount in worst_pairs]
+    return EnvyFreenessReport(int(violations_per_agent.sum()), violations_per_agent, worst_pairs)
+
+
+def _allocation_csr(instance:Instance, allocation:any)->scipy.sparse.csr_matrix:
+    # The allocation as a CSR matrix, with rows and columns ordered like the agents and items of the instance.
+    if isinstance(allocation, AllocationMatrix):
+        allocation_matrix = allocation.aligned_matrix(instance.agents, instance.items)
+    else:
+        allocation_matrix = AllocationMatrix.from_dict(allocation, instance.agents, instance.items).matrix
+    allocation_matrix = allocation_matrix.tocsr()
+    allocation_matrix.sum_duplicates()
+    return allocation_matrix
+
+
+def _map_blocks(function:callable, num_of_agents:int, block_size:int, num_of_threads:int)->list:
+    # Apply the function to the start index of each block of agents, optionally in a thread pool, and return the results in order.
+    starts = range(0, num_of_agents, block_size)
+    if num_of_threads is not None and num_of_threads > 1:
+        with ThreadPoolExecutor(num_of_threads) as executor:
+            return list(executor.map(function, starts))
+    return [function(start) for start in starts]
+
+
+def _matrix_to_dict(matrix:np.ndarray, agents:list)->dict:
+    rows = matrix.tolist()
+    return {agent1: dict(zip(agents, row)) for agent1,row in zip(agents, rows)}
+
+
 
 
 if __name__ == "__main__":
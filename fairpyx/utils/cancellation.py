@@ -0,0 +1,73 @@
+"""
+Cooperative cancellation of iterative algorithms: a shared budget of wall time and iterations.
+
+`divide(..., deadline=..., max_iterations=...)` creates a CancellationToken and attaches it to the AllocationBuilder,
+as `alloc.cancellation`. Iterative algorithms call `step()` once per iteration, stop when it returns True,
+and give their best-so-far allocation; they record in `converged` whether they reached their termination condition.
+
+>>> token = CancellationToken(max_iterations=2)
+>>> token.step(), token.step(), token.step()
+(False, True, True)
+>>> token.iterations
+3
+>>> token = CancellationToken(deadline=0)
+>>> token.step()
+True
+>>> token = CancellationToken()
+>>> token.step(), token.expired()
+(False, False)
+>>> token.cancel()
+>>> token.expired()
+True
+"""
+
+import time
+from fairpyx.utils.profiling import count
+
+
+class CancellationToken:
+    """
+    A budget for an iterative algorithm, which may be shared with other threads (e.g. to cancel a long run from outside).
+
+    :param deadline: the wall time, in seconds from the creation of the token, after which the algorithm should stop. None means no time limit.
+    :param max_iterations: the number of iterations after which the algorithm should stop. None means no iteration limit.
+
+    After the run, `converged` is True if the algorithm converged, False if it stopped early and returned its best-so-far allocation,
+    and None if the algorithm does not report convergence.
+    """
+    def __init__(self, deadline:float=None, max_iterations:int=None):
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.max_iterations = max_iterations
+        self.iterations = 0
+        self.cancelled = False
+        self.converged = None
+
+    def cancel(self):
+        """
+        Ask the algorithm to stop at its next iteration.
+        """
+        self.cancelled = True
+
+    def expired(self)->bool:
+        """
+        Return True if the budget is exhausted, or the token was cancelled.
+        """
+        return (self.cancelled
+            or (self.max_iterations is not None and self.iterations >= self.max_iterations)
+            or (self.deadline is not None and time.monotonic() >= self.deadline))
+
+    def step(self)->bool:
+        """
+        Count one iteration of the algorithm, and return True if it should stop now.
+        """
+        self.iterations += 1
+        count("iterations")
+        return self.expired()
+
+    def __repr__(self):
+        return f"CancellationToken(iterations={self.iterations}, converged={self.converged})"
+
+
+if __name__ == "__main__":
+    import doctest
+    print(doctest.testmod())
@@ -10,6 +10,7 @@ Since : 2023-10
 import networkz as nx
 from collections import defaultdict
 from itertools import product
+from fairpyx.utils.profiling import timed
 
 def many_to_many_matching(item_capacities: dict[any,int], agent_capacities:dict[any,int], valuations:dict[any,dict[any,int]], agent_entitlement:callable=lambda x:1)->nx.Graph:
     """
@@ -55,6 +56,14 @@ def many_to_many_matching_using_network_flow(items:list, item_capacity: callable
     Computes a many-to-many matching of items to agents. 
     
     Algorithm: reduction to min-cost-max-flow.  Based on answer by D.W. https://cs.stackexchange.com/a/161151/1342
+
+    Every (agent,item) pair with a non-negative value is an edge, including the zero-value pairs:
+    the flow is maximized before its cost is minimized, so zero-value pairs are matched to fill the remaining capacities.
+
+    >>> from fairpyx.utils.test_utils import stringify
+    >>> values = {"a": {"x": 3, "y": 0}, "b": {"x": 0, "y": 2}}
+    >>> stringify(many_to_many_matching_using_network_flow(items=["x","y"], item_capacity=lambda _:2, agents=["a","b"], agent_capacity=lambda _:2, agent_item_value=lambda agent,item: values[agent][item]))
+    "{a:['x', 'y'], b:['x', 'y']}"
     """
     ### a. Construct the flow network:
     graph = nx.DiGraph()
@@ -71,18 +80,20 @@ def many_to_many_matching_using_network_flow(items:list, item_capacity: callable
         graph.add_edge(item_str(item), "t", capacity=item_capacity(item), weight=0)
 
     ### b. Compute the max-flow min-cost flow:
-    flow = nx.max_flow_min_cost(graph, "s", "t", capacity="capacity", weight="weight")
+    with timed("matching"):
+        flow = nx.max_flow_min_cost(graph, "s", "t", capacity="capacity", weight="weight")
 
-    ### c. Convert the flow to a many-to-many matching:
+    ### c. Convert the flow to a many-to-many matching (only the edges that exist in the network are visited):
+    map_item_str_to_item = {item_str(item): item for item in items}
     map_agent_name_to_bundle = {}
     for agent in agents:
         map_agent_name_to_bundle[agent] = []
-        for item in items:
-            agent_item_flow =  flow[agent_str(agent)].get(item_str(item),0)
+        for node,agent_item_flow in flow[agent_str(agent)].items():
+            item = map_item_str_to_item[node]
             if agent_item_flow==1:
                 map_agent_name_to_bundle[agent].append(item)
             elif agent_item_flow!=0:
-                raise ValueError(f"non-binary flow in network: agent={agent}, item={item}, flow={itemflow}.\n Entire flow: {flow}")
+                raise ValueError(f"non-binary flow in network: agent={agent}, item={item}, flow={agent_item_flow}.\n Entire flow: {flow}")
         map_agent_name_to_bundle[agent].sort()
     return map_agent_name_to_bundle
 
@@ -116,7 +127,8 @@ def many_to_many_matching_using_node_cloning(items:list, item_capacity: callable
                         graph.add_edge((agent, clone), (item,unit), weight=weight)
 
     ### b. Compute the max-weight matching:
-    matching = nx.max_weight_matching(graph, maxcardinality=False)
+    with timed("matching"):
+        matching = nx.max_weight_matching(graph, maxcardinality=False)
 
     ### c. Convert the matching to an assignment:
     # utility function to remove the unit-index from a tuple representing a single unit of an item or agent
@@ -6,27 +6,78 @@ Since: 2023-07
 """
 
 from fairpyx import Instance
+from fairpyx.instances import canonical_sparse_matrix
 import cvxpy
+import numpy as np
+import scipy.sparse
 
 def allocation_variables(instance: Instance)->tuple:
     """
     Construct cvxpy variables representing a fractional allocation, and construct expressions representing the utilities.
+    The coefficients are read from the rows of the instance's (raw and normalized) valuation matrices,
+    but the variables and expressions are created in the same order as with per-pair lookups, so the LP (and its solution) is the same.
 
     :return allocation_vars, raw_utilities, normalized_utilities
     """
     allocation_vars = {agent: {item: cvxpy.Variable() for item in instance.items} for agent in instance.agents}
+    values = instance.sparse_valuation_matrix if instance.is_sparse else instance.valuation_matrix
+    normalized_values = normalized_valuation_matrix(instance)
     raw_utilities = {
         agent:
-        sum([allocation_vars[agent][item] * instance.agent_item_value(agent,item) for item in instance.items])
-        for agent in instance.agents
+        sum([allocation_vars[agent][item] * value for item,value in zip(instance.items, matrix_row(values, row))])
+        for row,agent in enumerate(instance.agents)
     }
     normalized_utilities = {
         agent:
-        sum([allocation_vars[agent][item] * instance.agent_normalized_item_value(agent,item) for item in instance.items])
-        for agent in instance.agents
+        sum([allocation_vars[agent][item] * value for item,value in zip(instance.items, matrix_row(normalized_values, row))])
+        for row,agent in enumerate(instance.agents)
     }
     return allocation_vars, raw_utilities, normalized_utilities
 
+def normalized_valuation_matrix(instance: Instance)->any:
+    """
+    Return the matrix of normalized values (see Instance.agent_normalized_item_value), computed for all agents and items at once.
+    The values are computed by the same formula (value / maximum value * 100), so they are equal to the per-pair values in every bit.
+    If the instance is sparse, the result is a CSR matrix with the same sparsity pattern, and the dense valuation matrix is not built.
+
+    >>> normalized_valuation_matrix(Instance(valuations=[[1,3],[0,0]], agent_capacities=1))
+    array([[ 33.33333333, 100.        ],
+           [  0.        ,   0.        ]])
+    >>> normalized_valuation_matrix(Instance(valuations=[[1,3],[0,0]], agent_capacities=1).to_sparse()).toarray()
+    array([[ 33.33333333, 100.        ],
+           [  0.        ,   0.        ]])
+    """
+    maximum_values = instance.maximum_values
+    if instance.is_sparse:
+        values = instance.sparse_valuation_matrix
+        rows = np.repeat(np.arange(values.shape[0]), np.diff(values.indptr))
+        invalid = np.flatnonzero((maximum_values[rows]==0) & (values.data>0))
+        if len(invalid)>0:
+            raise zero_maximum_value_error(instance, rows[invalid[0]], values.indices[invalid[0]], values.data[invalid[0]])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            data = np.where(maximum_values[rows]!=0, values.data / maximum_values[rows] * 100, 0.0)
+        return canonical_sparse_matrix(scipy.sparse.csr_matrix((data, values.indices, values.indptr), shape=values.shape))
+    values = instance.valuation_matrix
+    maximum_values = maximum_values[:, None]
+    invalid = np.argwhere((maximum_values==0) & (values>0))
+    if len(invalid)>0:
+        agent_row, item_column = invalid[0]
+        raise zero_maximum_value_error(instance, agent_row, item_column, values[agent_row,item_column])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(maximum_values!=0, values / maximum_values * 100, 0.0)
+
+def zero_maximum_value_error(instance: Instance, agent_row:int, item_column:int, value:float)->ValueError:
+    agent, item = list(instance.agents)[agent_row], list(instance.items)[item_column]
+    return ValueError(f"agent {agent} for item {item} has value {value}, but max value is 0")
+
+def matrix_row(matrix:any, row:int)->list:
+    """
+    Return a row of a dense or sparse matrix as a list; only this row of a sparse matrix is densified.
+    """
+    if scipy.sparse.issparse(matrix):
+        return matrix[row].toarray().ravel().tolist()
+    return matrix[row].tolist()
+
 def allocation_constraints(instance: Instance, allocation_vars:list):
     """
     Construct cvxpy constraints for a feasible fractional allocation:
@@ -0,0 +1,116 @@
+"""
+Opt-in profiling of allocation runs: wall time per stage, and counters of hot-path operations.
+
+The profile of the current run is kept in a context variable, so that low-level utilities
+(LP/MIP solves, matching and flow computations) can report to it without threading it through every call.
+When no profile is active, `count` and `timed` do (almost) nothing.
+
+>>> profile = Profile()
+>>> with profiling(profile):
+...     count("give", 3)
+...     with timed("lp_solve"):
+...         pass
+>>> count("give")     # no active profile - ignored
+>>> profile.counters
+Counter({'give': 3, 'lp_solve': 1})
+>>> list(profile.times)
+['lp_solve']
+"""
+
+import contextlib, time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+
+class Profile:
+    """
+    Statistics collected during a single run of `divide`:
+
+    * stage_times: maps each stage of the run (e.g. "instance", "algorithm") to its wall time in seconds.
+    * counters: maps each operation (e.g. "give", "effective_value", "lp_solve", "matching") to the number of times it was done.
+    * times: maps each timed operation (e.g. "lp_solve", "matching") to the list of wall times of its calls, in seconds.
+    """
+    def __init__(self):
+        self.stage_times = {}
+        self.counters = Counter()
+        self.times = defaultdict(list)
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        """
+        Measure the wall time of a stage of the run; a repeated stage accumulates.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[name] = self.stage_times.get(name, 0) + time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def timed(self, name:str):
+        """
+        Count a call of the given operation, and record its wall time.
+        """
+        self.counters[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name].append(time.perf_counter() - start)
+
+    def total_time(self, name:str)->float:
+        """
+        The total wall time of all calls of the given timed operation.
+        """
+        return sum(self.times.get(name, ()))
+
+    def __repr__(self):
+        stages = ", ".join(f"{name}={seconds:.4f}s" for name, seconds in self.stage_times.items())
+        counters = ", ".join(
+            f"{name}={number}" + (f" ({self.total_time(name):.4f}s)" if name in self.times else "")
+            for name, number in self.counters.items())
+        return f"Profile(stages: {stages}; counters: {counters})"
+
+
+_current_profile = ContextVar("current_profile", default=None)
+
+
+def current_profile()->Profile:
+    """
+    Return the active profile, or None if profiling is off.
+    """
+    return _current_profile.get()
+
+
+@contextlib.contextmanager
+def profiling(profile:Profile):
+    """
+    Make the given profile the active one within the context.
+    """
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def count(name:str, amount:int=1):
+    """
+    Add the given amount to the counter of the given operation in the active profile (if any).
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.counters[name] += amount
+
+
+def timed(name:str):
+    """
+    A context that counts and times a call of the given operation in the active profile (if any).
+    """
+    profile = _current_profile.get()
+    return contextlib.nullcontext() if profile is None else profile.timed(name)
+
+
+if __name__ == "__main__":
+    import doctest
+    print(doctest.testmod())
@@ -0,0 +1,159 @@
+"""
+An on-disk cache of allocation results, keyed by the content of the instance, the algorithm and its arguments.
+
+Used by `divide(..., cache=...)`, so that deterministic reruns on identical instances return immediately.
+
+>>> import tempfile
+>>> from fairpyx import Instance
+>>> from fairpyx.algorithms.picking_sequence import round_robin
+>>> instance = Instance(valuations={"Alice": {"c1": 2, "c2": 3}, "Bob": {"c1": 4, "c2": 5}})
+>>> with tempfile.TemporaryDirectory() as directory:
+...     cache = ResultCache(directory)
+...     key = cache.key(instance, round_robin, {"seed": 1})
+...     cache.get(key) is None
+...     cache.put(key, {"Alice": ["c2"], "Bob": ["c1"]})
+...     cache.get(key), len(cache)
+...     key == cache.key(instance, round_robin, {"seed": 1}), key == cache.key(instance, round_robin, {"seed": 2})
+True
+({'Alice': ['c2'], 'Bob': ['c1']}, 1)
+(True, False)
+"""
+
+import hashlib, json, os, pickle, tempfile
+from numbers import Number
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "VERSION")) as version_file:
+    VERSION = version_file.read().strip()
+
+
+class ResultCache:
+    """
+    A directory with one pickle file per result. The total size of the files is bounded by `max_bytes`:
+    after each insertion, the least-recently-used results (by file modification time, which is updated on every hit) are evicted.
+    Files are written atomically, so several processes (e.g. the workers of `divide_many`) can share the same directory.
+
+    NOTE: the cache assumes that the algorithm is deterministic given its arguments - pass the random seed explicitly, if it uses one.
+    """
+    SUFFIX = ".pickle"
+
+    def __init__(self, directory:str, max_bytes:int=100_000_000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, instance, algorithm:callable, kwargs:dict)->str:
+        """
+        Return the key of running the given algorithm, with the given keyword arguments, on the given instance:
+        a hash of the instance fingerprint, the qualified name and version of the algorithm, and the canonicalized arguments.
+        The version is the algorithm's `__version__` attribute, if it has one, or else the version of fairpyx.
+
+        Raises a TypeError if an argument has no canonical form (e.g. an arbitrary object); such runs cannot be cached.
+        """
+        description = {
+            "instance": instance.fingerprint,
+            "algorithm": f"{algorithm.__module__}.{algorithm.__qualname__}",
+            "version": str(getattr(algorithm, "__version__", VERSION)),
+            "kwargs": canonical_form(kwargs),
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key:str)->str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key:str)->any:
+        """
+        Return the result stored with the given key, or None if there is none.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                result = pickle.load(file)
+            os.utime(path)     # mark as recently used
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):   # missing, or evicted/truncated by another process
+            return None
+        logger.debug("Cache hit: %s", key)
+        return result
+
+    def put(self, key:str, result:any):
+        """
+        Store the given result with the given key, and evict the least-recently-used results if the cache is too large.
+        """
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least-recently-used results until the total size is at most max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _,size,_ in entries)
+        for _,size,path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                os.remove(entry.path)
+
+    def __len__(self):
+        return sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(self.SUFFIX))
+
+
+def canonical_form(value:any)->any:
+    """
+    Convert the given value to a JSON-serializable form that does not depend on dict order or on numpy types.
+    Each dict entry becomes a triple [key type, key, value], so that e.g. the keys 1 and "1" remain distinct.
+
+    >>> canonical_form({"b": (1, 2.5), "a": np.int64(3), "c": {2: None, 1: True}})
+    [['str', 'a', 3], ['str', 'b', [1, 2.5]], ['str', 'c', [['int', 1, True], ['int', 2, None]]]]
+    >>> canonical_form({1: 2}) == canonical_form({"1": 2}), canonical_form({np.int64(1): 2}) == canonical_form({1: 2})
+    (False, True)
+    >>> form = canonical_form(np.array([[1, 2]], dtype=np.int64))
+    >>> form["array"], form["shape"], form == canonical_form(np.array([[1, 2]], dtype=np.int64))
+    ('int64', [1, 2], True)
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        return {"array": str(array.dtype), "shape": list(array.shape), "sha256": hashlib.sha256(array.tobytes()).hexdigest()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Number):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [canonical_form(element) for element in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonical_form(element) for element in value), key=json.dumps)
+    if isinstance(value, dict):
+        entries = []
+        for key,element in value.items():
+            key = canonical_form(key)
+            entries.append([type(key).__name__, key, canonical_form(element)])
+        return sorted(entries, key=lambda entry: json.dumps(entry[:2]))
+    raise TypeError(f"Cannot canonicalize {type(value).__name__} for a cache key")
+
+
+if __name__ == "__main__":
+    import doctest
+    print(doctest.testmod())
@@ -9,6 +9,7 @@ Since:  2021-05
 
 import cvxpy
 from typing import List, Dict, Tuple
+from fairpyx.utils.profiling import timed
 
 DEFAULT_SOLVERS = [ 
 	(cvxpy.SCIPY, {'method':'highs'}),   # for linear programs
@@ -30,10 +31,11 @@ def solve(problem:cvxpy.Problem, solvers:List[Tuple[str, Dict]] = DEFAULT_SOLVER
 	is_solved=False
 	for (solver, solver_kwargs) in solvers:  # Try the first n-1 solvers.
 		try:
-			if solver==cvxpy.SCIPY:
-				problem.solve(solver=solver, scipy_options=dict(solver_kwargs))  # WARNING: solve changes both its arguments!
-			else:
-				problem.solve(solver=solver, **solver_kwargs)
+			with timed("lp_solve"):
+				if solver==cvxpy.SCIPY:
+					problem.solve(solver=solver, scipy_options=dict(solver_kwargs))  # WARNING: solve changes both its arguments!
+				else:
+					problem.solve(solver=solver, **solver_kwargs)
 			logger.info("Solver %s [%s] succeeds", solver, solver_kwargs)
 			is_solved = True
 			break
@@ -16,6 +16,7 @@ from fairpyx import Instance, divide
 # from fairpyx.algorithms.linear_program import optimize_model
 from fairpyx.algorithms.ACEEI import EFTBStatus, logger, find_ACEEI_with_EFTB
 import numpy as np
+from fairpyx.utils.cancellation import CancellationToken
 
 
 
@@ -125,6 +126,28 @@ def test_case_5():
 #     fairpyx.validate_allocation(instance, allocation, title="validate Algorithm 1")
 
 
+# With an iteration budget, the best allocation so far is returned, and it is feasible even if the prices have not converged
+def test_case_6_max_iterations():
+    # The prices need 7 iterations to clear this market.
+    instance = Instance(valuations={"avi": {"x": 1, "y": 2, "z": 4}, "beni": {"x": 2, "y": 3, "z": 1}},
+                        agent_capacities=2, item_capacities={"x": 1, "y": 1, "z": 2})
+    kwargs = dict(initial_budgets={"avi": 2, "beni": 3}, delta=0.5, epsilon=0.5, t=EFTBStatus.NO_EF_TB)
+    for max_iterations in [1, 2, 3]:
+        cancellation = CancellationToken(max_iterations=max_iterations)
+        allocation = divide(find_ACEEI_with_EFTB, instance=instance, cancellation=cancellation, **kwargs)
+        assert cancellation.converged is False
+        assert cancellation.iterations == max_iterations
+        assert allocation == {"avi": ["y", "z"], "beni": ["x"]}    # the bundles with the lowest clearing error so far
+        for agent, bundle in allocation.items():   # the allocation may be wasteful, but it must be feasible
+            assert len(bundle) <= instance.agent_capacity(agent)
+        for item in instance.items:
+            assert sum(item in bundle for bundle in allocation.values()) <= instance.item_capacity(item)
+    cancellation = CancellationToken(max_iterations=100)
+    allocation = divide(find_ACEEI_with_EFTB, instance=instance, cancellation=cancellation, **kwargs)
+    assert cancellation.converged is True and cancellation.iterations == 7
+    assert allocation == {"avi": ["x", "z"], "beni": ["y", "z"]}
+
+
 if __name__ == "__main__":
     pytest.main(["-v", __file__])
     # logger.addHandler(logging.StreamHandler())
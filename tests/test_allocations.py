@@ -0,0 +1,80 @@
+"""
+Test the AllocationBuilder.
+"""
+
+import pytest
+
+import fairpyx
+import numpy as np
+
+
+def test_bundles_are_immutable():
+    instance = fairpyx.Instance(valuations={"Alice": {"c1": 1, "c2": 2}, "Bob": {"c1": 3, "c2": 4}})
+    alloc = fairpyx.AllocationBuilder(instance)
+    alloc.give("Alice", "c1")
+    assert alloc.bundles["Alice"] == {"c1"}
+    with pytest.raises(AttributeError):
+        alloc.bundles["Alice"].add("c2")
+    with pytest.raises(AttributeError):
+        alloc.bundles["Alice"].discard("c1")
+    alloc.give("Alice", "c2")
+    assert alloc.bundles["Alice"] == {"c1", "c2"}
+
+
+
+def test_validate_allocation_reports_waste_in_order_of_first_appearance():
+    values = {"c1": 1, "c2": 1, "c3": 1}
+    instance = fairpyx.Instance(valuations={"Alice": values, "Bob": values}, agent_capacities=3, item_capacities=2)
+    allocation = {"Alice": ["c3", "c1"], "Bob": []}
+    with pytest.raises(ValueError, match="Item c3 has remaining capacity"):
+        fairpyx.validate_allocation(instance, allocation)
+    for sparse_instance in [instance, instance.to_sparse()]:
+        with pytest.raises(ValueError) as error:
+            fairpyx.validate_allocation(sparse_instance, allocation, report_all=True)
+        messages = str(error.value).split("\n")
+        assert [message.split(" has")[0] for message in messages if message.startswith("Item")] == ["Item c3", "Item c1"]
+
+
+def test_give_matrix_over_capacity():
+    instance = fairpyx.Instance(valuations=np.ones((3, 4), dtype=int), agent_capacities=[3, 3, 2], item_capacities=[1, 2, 1, 3])
+    alloc = fairpyx.AllocationBuilder(instance)
+    with pytest.raises(ValueError, match="Item 0 has no remaining capacity for 2 new agents"):
+        alloc.give_matrix([[1,0,0,0],[1,0,0,0],[0,0,0,0]])
+    with pytest.raises(ValueError, match="Agent 2 has no remaining capacity for 3 new items"):
+        alloc.give_matrix([[0,0,0,0],[0,0,0,0],[0,1,1,1]])
+    assert alloc.sorted() == {0: [], 1: [], 2: []}     # a rejected matrix changes nothing
+    alloc.give_matrix([[1,1,0,0],[0,1,0,1],[0,0,1,0]])
+    with pytest.raises(ValueError, match="Item 3 has no remaining capacity for 3 new agents"):
+        alloc.give_matrix([[0,0,0,1],[0,0,0,1],[0,0,0,1]])
+    assert alloc.sorted() == {0: [0, 1], 1: [1, 3], 2: [2]}
+    assert alloc.remaining_item_capacities == {3: 2}
+
+
+def test_rollback_after_failed_give():
+    instance = fairpyx.Instance(
+        valuations={"Alice": {"c1": 1, "c2": 2, "c3": 3}, "Bob": {"c1": 3, "c2": 2, "c3": 1}},
+        agent_capacities=2, item_capacities={"c1": 1, "c2": 2, "c3": 1}, item_conflicts={"c1": ["c3"], "c3": ["c1"]})
+    alloc = fairpyx.AllocationBuilder(instance)
+    alloc.give("Alice", "c1")
+    def state():
+        return (alloc.sorted(), alloc.remaining_agent_capacities, alloc.remaining_item_capacities,
+                sorted(alloc.remaining_conflicts), {agent: alloc.best_item_for_agent(agent) for agent in instance.agents})
+    before = state()
+    with pytest.raises(ValueError, match="Item c3 has no remaining capacity for agent Alice"):
+        with alloc.transaction():
+            alloc.give("Bob", "c2")
+            alloc.give("Bob", "c3")
+            alloc.give("Alice", "c3")
+    assert state() == before
+    token = alloc.checkpoint()
+    with pytest.raises(ValueError, match="Item c1 has no remaining capacity for agent Bob"):
+        alloc.give_bundle("Bob", ["c3", "c1"])
+    assert alloc.sorted()["Bob"] == ["c3"]
+    alloc.rollback(token)
+    assert state() == before
+    alloc.give_bundle("Bob", ["c2", "c3"])
+    assert alloc.sorted() == {"Alice": ["c1"], "Bob": ["c2", "c3"]}
+
+
+if __name__ == "__main__":
+     pytest.main(["-v",__file__])
@@ -28,6 +28,27 @@ def test_feasibility():
         fairpyx.validate_allocation(instance, allocation, title=f"Seed {i}, with donation")
 
 
+def test_normalized_values_equal_per_pair_values():
+    from fairpyx.utils.linear_programming_utils import normalized_valuation_matrix
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        instance = fairpyx.Instance(valuations=np.random.randint(-5, 100, size=(7, 5)) * (np.random.uniform(size=(7, 5)) < 0.7), agent_capacities=np.random.randint(1, 4, size=7))
+        expected = [[instance.agent_normalized_item_value(agent, item) for item in instance.items] for agent in instance.agents]
+        assert normalized_valuation_matrix(instance).tolist() == expected     # equal in every bit, so the LP is the same
+
+
+def test_same_allocation_as_per_pair_lp():
+    # The allocation returned when the LP coefficients were looked up per pair.
+    rng = np.random.default_rng(4)
+    num_of_agents, num_of_items = int(rng.integers(3,7)), int(rng.integers(3,7))
+    valuations = {f"s{i}": {f"c{j}": int(rng.integers(0,10)) for j in range(num_of_items)} for i in range(num_of_agents)}
+    agent_capacities = {f"s{i}": int(rng.integers(1,3)) for i in range(num_of_agents)}
+    item_capacities = {f"c{j}": int(rng.integers(1,3)) for j in range(num_of_items)}
+    instance = fairpyx.Instance(valuations=valuations, agent_capacities=agent_capacities, item_capacities=item_capacities)
+    allocation = fairpyx.divide(fairpyx.algorithms.almost_egalitarian_allocation, instance=instance)
+    assert allocation == {'s0': ['c0'], 's1': ['c5'], 's2': ['c2', 'c3'], 's3': ['c1', 'c4'], 's4': ['c2', 'c4']}
+
+
 if __name__ == "__main__":
      pytest.main(["-v",__file__])
 
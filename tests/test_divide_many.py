@@ -0,0 +1,58 @@
+"""
+Test running algorithms on many instances with divide_many.
+"""
+
+import pytest
+
+import fairpyx
+from fairpyx.algorithms.picking_sequence import round_robin, serial_dictatorship
+import numpy as np
+
+NUM_OF_RANDOM_INSTANCES=6
+
+
+class AlgorithmFailure(Exception):
+    pass
+
+
+def failing_algorithm(alloc:fairpyx.AllocationBuilder):
+    """
+    Give one item, then fail on instances with an odd number of agents.
+    """
+    agent, item = alloc.instance.agents[0], alloc.instance.items[0]
+    alloc.give(agent, item)
+    if alloc.instance.num_of_agents % 2 == 1:
+        raise AlgorithmFailure(f"Failed on {alloc.instance.num_of_agents} agents")
+
+
+def random_instances():
+    instances = []
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        instances.append(fairpyx.Instance(valuations=np.random.randint(0, 100, size=(10+2*i, 5)), agent_capacities=2, item_capacities=3))
+    return instances
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_same_results_as_divide(max_workers:int):
+    instances = random_instances()
+    results = list(fairpyx.divide_many([round_robin, serial_dictatorship], instances, max_workers=max_workers, ordered=True))
+    assert [(algorithm, index) for algorithm, index, _ in results] == [(algorithm, index) for index in range(len(instances)) for algorithm in [round_robin, serial_dictatorship]]
+    for algorithm, index, allocation in results:
+        assert allocation == fairpyx.divide(algorithm, instance=instances[index])
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+@pytest.mark.parametrize("ordered", [True, False])
+def test_exception_in_worker(max_workers:int, ordered:bool):
+    instances = random_instances()
+    instances.insert(2, fairpyx.Instance(valuations=np.ones((3, 5), dtype=int)))
+    results = fairpyx.divide_many([failing_algorithm], instances, max_workers=max_workers, ordered=ordered)
+    with pytest.raises(AlgorithmFailure, match="Failed on 3 agents"):
+        for _ in results:
+            pass
+    assert list(fairpyx.divide_many([failing_algorithm], instances[:2], max_workers=max_workers)) != []
+
+
+if __name__ == "__main__":
+     pytest.main(["-v",__file__])
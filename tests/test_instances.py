@@ -0,0 +1,145 @@
+"""
+Test the array-based methods of Instance.
+"""
+
+import os, tempfile
+
+import pytest
+
+import fairpyx
+import numpy as np
+import scipy.sparse
+
+NUM_OF_RANDOM_INSTANCES=10
+
+
+def test_bundle_values_with_sparse_allocation():
+    instance = fairpyx.Instance(valuations=[[1,2],[3,4]])
+    allocation = scipy.sparse.csr_matrix([[1,0],[0,1]])
+    assert list(instance.bundle_values(allocation)) == [1, 4]
+    assert list(instance.bundle_values(allocation.toarray())) == [1, 4]
+    assert list(instance.to_sparse().bundle_values(allocation)) == [1, 4]
+
+
+def test_bundle_values_of_divide_matrix_output():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        instance = fairpyx.Instance(valuations=np.random.randint(0, 100, size=(20, 8)), agent_capacities=3, item_capacities=4)
+        allocation = fairpyx.divide(fairpyx.algorithms.round_robin, instance=instance, output="matrix")
+        expected = [instance.agent_bundle_value(agent, bundle) for agent, bundle in allocation.to_dict().items()]
+        assert list(instance.bundle_values(allocation.matrix)) == expected
+        assert list(instance.to_sparse().bundle_values(allocation.matrix)) == expected
+
+
+
+def test_random_sample_valuations():
+    prototype_valuations = {"Alice": {"c1": 5, "c2": 1, "c3": 0}, "Bob": {"c1": 1, "c2": 5, "c3": 2}}
+    instance = fairpyx.Instance.random_sample(max_num_of_agents=1000, max_total_agent_capacity=2000,
+        prototype_valuations=prototype_valuations, prototype_agent_capacities={"Alice": 2, "Bob": 3},
+        prototype_agent_conflicts={"Alice": ["c2"]}, item_capacities={"c1": 10, "c2": 10, "c3": 10}, item_conflicts={}, random_seed=1)
+    assert instance.valuation_matrix.shape == (instance.num_of_agents, 3)
+    for agent, row in zip(instance.agents, instance.valuation_matrix.tolist()):
+        prototype = agent.split(".")[-1]
+        assert row == [prototype_valuations[prototype][item] for item in instance.items]
+        assert instance.agent_item_value(agent, "c2") == prototype_valuations[prototype]["c2"]
+
+
+def test_random_sample_memory_does_not_grow_with_agents():
+    prototype_valuations = {"Alice": {"c1": 5, "c2": 1, "c3": 0}, "Bob": {"c1": 1, "c2": 5, "c3": 2}, "Chana": {"c1": 3, "c2": 3, "c3": 3}}
+    for max_num_of_agents in [100, 10000]:
+        instance = fairpyx.Instance.random_sample(max_num_of_agents=max_num_of_agents, max_total_agent_capacity=3*max_num_of_agents,
+            prototype_valuations=prototype_valuations, prototype_agent_capacities={"Alice": 2, "Bob": 3, "Chana": 1},
+            prototype_agent_conflicts={}, item_capacities={"c1": 10, "c2": 10, "c3": 10}, item_conflicts={}, random_seed=1)
+        assert instance.num_of_agents == max_num_of_agents
+        assert instance._valuations.rows.shape == (3, 3)
+        assert instance._valuations.row_index.shape == (max_num_of_agents,)
+        expected = np.array([[prototype_valuations[agent.split(".")[-1]][item] for item in instance.items] for agent in instance.agents])
+        for agent_index, agent in enumerate(instance.agents):
+            assert instance.agent_item_value(agent, "c3") == expected[agent_index, 2]
+        np.testing.assert_array_equal(instance.maximum_values, np.sort(expected, axis=1)[:, ::-1].cumsum(axis=1)[np.arange(max_num_of_agents), instance.agent_capacity_vector-1])
+        np.testing.assert_array_equal(instance.preference_order, np.argsort(-expected, axis=1, kind="stable"))
+        sub_instance = fairpyx.instances.SubInstance(instance, agents=instance.agents[5:9], items=["c3", "c1"], agent_capacities=1, item_capacities=1)
+        np.testing.assert_array_equal(sub_instance.valuation_matrix, expected[5:9][:, [2, 0]])
+        assert "valuation_matrix" not in instance.__dict__   # the dense matrix (agents x items) was never built
+        np.testing.assert_array_equal(instance.valuation_matrix, expected)
+
+
+def random_instance_with_conflicts(seed:int)->fairpyx.Instance:
+    np.random.seed(seed)
+    valuations = np.random.randint(1, 100, size=(30, 12)) * (np.random.uniform(size=(30, 12)) < 0.3)
+    return fairpyx.Instance(valuations=valuations, agent_capacities=np.random.randint(1, 5, size=30), item_capacities=np.random.randint(1, 10, size=12),
+                            agent_conflicts={0: [3, 4], 7: [0]}, item_conflicts={1: [2], 2: [1]})
+
+
+def test_save_load_round_trip():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        dense_instance = random_instance_with_conflicts(i)
+        for instance in [dense_instance, dense_instance.to_sparse()]:
+            for mmap in [True, False]:
+                with tempfile.TemporaryDirectory() as path:
+                    instance.save(os.path.join(path, "instance"))
+                    loaded = fairpyx.Instance.load(os.path.join(path, "instance"), mmap=mmap)
+                    assert loaded.is_sparse == instance.is_sparse
+                    assert list(loaded.agents) == list(instance.agents) and list(loaded.items) == list(instance.items)
+                    assert np.array_equal(loaded.valuation_matrix, dense_instance.valuation_matrix)
+                    assert np.array_equal(loaded.agent_capacity_vector, instance.agent_capacity_vector)
+                    assert np.array_equal(loaded.item_capacity_vector, instance.item_capacity_vector)
+                    assert loaded.agent_conflicts(0) == {3, 4} and loaded.item_conflicts(2) == {1}
+                    assert loaded.fingerprint == instance.fingerprint
+                    assert fairpyx.divide(fairpyx.algorithms.round_robin, instance=loaded) == fairpyx.divide(fairpyx.algorithms.round_robin, instance=instance)
+
+
+def test_from_csv_malformed_rows():
+    with tempfile.TemporaryDirectory() as path:
+        def write(name:str, text:str)->str:
+            with open(os.path.join(path, name), "w") as file:
+                file.write(text)
+            return os.path.join(path, name)
+        bids = write("bids.csv", "student,course,points\ns1,c1,60\ns2,c2,100\n")
+        assert fairpyx.Instance.from_csv(bids).agent_nonzero_values("s2") == {"c2": 100}
+        with pytest.raises(ValueError, match="line 3: expected 3 columns, got 2"):
+            fairpyx.Instance.from_csv(write("short.csv", "student,course,points\ns1,c1,60\ns2,100\n"))
+        with pytest.raises(ValueError, match="line 3: expected 3 columns, got 4"):
+            fairpyx.Instance.from_csv(write("long.csv", "student,course,points\ns1,c1,60\ns2,c2,100,7\n"))
+        with pytest.raises(ValueError, match="line 3: expected numbers"):
+            fairpyx.Instance.from_csv(write("text.csv", "student,course,points\ns1,c1,60\ns2,c2,abc\n"))
+        with pytest.raises(ValueError, match="line 2: expected 2 columns, got 3"):
+            fairpyx.Instance.from_csv(bids, item_capacities=write("courses.csv", "course,capacity\nc1,1,2\n"))
+
+
+def test_sub_instance_of_sparse_instance():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        dense_parent = random_instance_with_conflicts(i)
+        parent = dense_parent.to_sparse()
+        agents, items = [1, 4, 5, 9], [0, 2, 3, 11]
+        sub = fairpyx.instances.SubInstance(parent, agents, items, agent_capacities=np.ones(4, dtype=int), item_capacities=np.ones(4, dtype=int))
+        expected = dense_parent.valuation_matrix[np.ix_(agents, items)]
+        assert sub.is_sparse
+        assert np.array_equal(sub.sparse_valuation_matrix.toarray(), expected)
+        assert np.array_equal(sub.valuation_matrix, expected)
+        assert "valuation_matrix" not in parent.__dict__      # the parent's dense matrix is never built
+
+
+def test_sparse_instance_is_not_densified():
+    from fairpyx.utils.linear_programming_utils import normalized_valuation_matrix
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        valuations = np.random.randint(-20, 100, size=(30, 12)) * (np.random.uniform(size=(30, 12)) < 0.3)
+        dense = fairpyx.Instance(valuations=valuations, agent_capacities=np.random.randint(0, 6, size=30))
+        sparse = dense.to_sparse()
+        assert np.array_equal(sparse.maximum_values, dense.maximum_values)
+        assert np.array_equal(sparse.preference_order, dense.preference_order)
+        assert np.array_equal(sparse.rank_matrix, dense.rank_matrix)
+        for agent in [0, 7, 29]:
+            assert sparse.agent_maximum_value(agent) == dense.agent_maximum_value(agent)
+            assert sparse.agent_ranking(agent) == dense.agent_ranking(agent)
+            assert sparse.agent_ranking(agent, [3, 5]) == dense.agent_ranking(agent, [3, 5])
+        allocation = fairpyx.divide(fairpyx.algorithms.round_robin, instance=dense)
+        np.testing.assert_array_equal(fairpyx.AgentBundleValueMatrix(sparse, allocation).normalized_values, fairpyx.AgentBundleValueMatrix(dense, allocation).normalized_values)
+        positive = fairpyx.Instance(valuations=np.maximum(valuations, 0), agent_capacities=3)
+        assert normalized_valuation_matrix(positive.to_sparse()).toarray().tolist() == normalized_valuation_matrix(positive).tolist()
+        assert "valuation_matrix" not in sparse.__dict__
+
+
+if __name__ == "__main__":
+     pytest.main(["-v",__file__])
@@ -0,0 +1,75 @@
+"""
+Test caching the results of divide on disk.
+"""
+
+import pytest
+
+import fairpyx
+import fairpyx.utils.result_cache
+from fairpyx.algorithms.picking_sequence import round_robin
+from fairpyx.utils.result_cache import ResultCache
+import numpy as np
+
+NUM_OF_RANDOM_INSTANCES=5
+
+runs = []
+
+
+def counting_round_robin(alloc:fairpyx.AllocationBuilder, agent_order:list=None):
+    """
+    Round-robin, which records each of its runs in `runs`.
+    """
+    runs.append(alloc.instance.num_of_agents)
+    round_robin(alloc, agent_order=agent_order)
+
+
+def test_hit_and_miss(tmp_path):
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        instance = fairpyx.Instance(valuations=np.random.randint(0, 100, size=(6, 4)), agent_capacities=2, item_capacities=3)
+        cache = ResultCache(tmp_path / str(i))
+        runs.clear()
+        allocation = fairpyx.divide(counting_round_robin, instance=instance, cache=cache)
+        assert fairpyx.divide(counting_round_robin, instance=instance, cache=cache) == allocation
+        assert fairpyx.divide(counting_round_robin, instance=instance.to_sparse(), cache=cache) == allocation   # same content, same fingerprint
+        assert len(runs) == 1 and len(cache) == 1
+
+        changed_valuations = instance.valuation_matrix.copy()
+        changed_valuations[0,0] += 1
+        fairpyx.divide(counting_round_robin, valuations=changed_valuations, agent_capacities=2, item_capacities=3, cache=cache)
+        assert len(runs) == 2
+
+        reversed_allocation = fairpyx.divide(counting_round_robin, instance=instance, cache=cache, agent_order=[5,4,3,2,1,0])
+        assert len(runs) == 3 and len(cache) == 3
+        assert reversed_allocation == fairpyx.divide(round_robin, instance=instance, agent_order=[5,4,3,2,1,0])
+        fairpyx.divide(counting_round_robin, instance=instance, cache=cache, output="matrix")
+        assert len(runs) == 4
+
+
+def test_version_change(tmp_path, monkeypatch):
+    instance = fairpyx.Instance(valuations=[[1,2,3],[3,2,1]])
+    runs.clear()
+    fairpyx.divide(counting_round_robin, instance=instance, cache=tmp_path)
+    fairpyx.divide(counting_round_robin, instance=instance, cache=tmp_path)
+    assert len(runs) == 1
+    monkeypatch.setattr(fairpyx.utils.result_cache, "VERSION", fairpyx.utils.result_cache.VERSION + ".post1")
+    fairpyx.divide(counting_round_robin, instance=instance, cache=tmp_path)
+    assert len(runs) == 2
+    monkeypatch.setattr(counting_round_robin, "__version__", "2", raising=False)
+    fairpyx.divide(counting_round_robin, instance=instance, cache=tmp_path)
+    fairpyx.divide(counting_round_robin, instance=instance, cache=tmp_path)
+    assert len(runs) == 3
+
+
+def test_keys_of_different_types(tmp_path):
+    instance = fairpyx.Instance(valuations=[[1,2,3],[3,2,1]])
+    cache = ResultCache(tmp_path)
+    keys = {cache.key(instance, round_robin, kwargs) for kwargs in [{"x": {1: 2}}, {"x": {"1": 2}}, {"x": {(1,): 2}}, {"x": {1: "2"}}]}
+    assert len(keys) == 4
+    assert cache.key(instance, round_robin, {"x": {np.int64(1): 2}}) == cache.key(instance, round_robin, {"x": {1: 2}})
+    with pytest.raises(TypeError):
+        cache.key(instance, round_robin, {"x": object()})
+
+
+if __name__ == "__main__":
+     pytest.main(["-v",__file__])
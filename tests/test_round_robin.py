@@ -28,6 +28,17 @@ def test_feasibility():
         fairpyx.validate_allocation(instance, allocation, title=f"Seed {i}, bidirectional round-robin")
 
 
+def test_sparse_valuations():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        valuations = np.random.randint(1, 100, size=(70, 30)) * (np.random.uniform(size=(70, 30)) < 0.2)   # each agent values about 6 items
+        instance = fairpyx.Instance(valuations=valuations, agent_capacities=np.random.randint(2, 6, size=70), item_capacities=np.full(30, 8))
+        sparse_instance = instance.to_sparse()
+        allocation = fairpyx.divide(fairpyx.algorithms.round_robin, instance=sparse_instance)
+        fairpyx.validate_allocation(sparse_instance, allocation, title=f"Seed {i}, sparse round-robin")
+        assert allocation == fairpyx.divide(fairpyx.algorithms.round_robin, instance=instance)
+
+
 if __name__ == "__main__":
      pytest.main(["-v",__file__])
 
@@ -0,0 +1,62 @@
+"""
+Test the incremental satisfaction metrics against a recomputation from scratch.
+"""
+
+import pytest
+
+import fairpyx
+from fairpyx.satisfaction import AgentBundleValueMatrix, IncrementalSatisfaction
+import numpy as np
+
+NUM_OF_RANDOM_INSTANCES=10
+
+
+def assert_consistent(metrics:IncrementalSatisfaction, instance:fairpyx.Instance):
+    allocation = metrics.allocation()
+    expected = IncrementalSatisfaction(instance, allocation)
+    assert np.array_equal(metrics.values, expected.values)
+    assert metrics.utilitarian_value() == pytest.approx(expected.utilitarian_value())
+    assert metrics.egalitarian_value() == expected.egalitarian_value()
+    assert metrics.max_envy() == expected.max_envy() == AgentBundleValueMatrix(instance, allocation, normalized=False).max_envy()
+    assert metrics.mean_envy() == pytest.approx(expected.mean_envy())
+
+
+def test_random_moves_and_swaps():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        valuations = np.random.randint(0, 20, size=(8, 12)) * (np.random.uniform(size=(8, 12)) < 0.5)
+        dense_instance = fairpyx.Instance(valuations=valuations)
+        for instance in [dense_instance, dense_instance.to_sparse()]:
+            allocation = fairpyx.divide(fairpyx.algorithms.round_robin, instance=instance)
+            metrics = IncrementalSatisfaction(instance, allocation)
+            for _ in range(50):
+                agent1, agent2 = np.random.choice(instance.num_of_agents, size=2, replace=False).tolist()
+                bundle = metrics.allocation()[agent1]
+                if np.random.uniform() < 0.3 or len(bundle) == 0:
+                    metrics.swap(agent1, agent2)
+                else:
+                    item = bundle[np.random.randint(len(bundle))]
+                    metrics.move(agent1, item, None)
+                    metrics.move(agent2, None, item)
+                assert_consistent(metrics, instance)
+
+
+def test_invalid_move():
+    instance = fairpyx.Instance(valuations={"Alice": [10,10,6,4], "Bob": [7,5,6,6], "Claire":[2,8,8,7]})
+    metrics = IncrementalSatisfaction(instance, {"Alice": [2, 3], "Bob": [1], "Claire":[0]})
+    values = metrics.values.copy()
+    with pytest.raises(ValueError, match="Agent Bob does not hold item 2"):
+        metrics.move("Bob", 2, 0)
+    with pytest.raises(ValueError, match="Agent Alice already holds item 3"):
+        metrics.move("Alice", 2, 3)
+    assert metrics.allocation() == {"Alice": [2, 3], "Bob": [1], "Claire": [0]}
+    assert np.array_equal(metrics.values, values)
+    metrics.move("Alice", 2, 2)
+    assert_consistent(metrics, instance)
+    metrics.move("Alice", 2, 0)
+    assert metrics.allocation() == {"Alice": [0, 3], "Bob": [1], "Claire": [0]}
+    assert_consistent(metrics, instance)
+
+
+if __name__ == "__main__":
+     pytest.main(["-v",__file__])
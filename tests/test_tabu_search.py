@@ -14,6 +14,7 @@ import pytest
 import fairpyx
 from fairpyx import Instance, divide
 from fairpyx.algorithms.tabu_search import tabu_search
+from fairpyx.utils.cancellation import CancellationToken
 
 random_delta = {random.uniform(0.1, 1)}
 random_beta = random.uniform(1, 100)
@@ -69,6 +70,29 @@ def test_case3():
         assert (f"c{i}" in allocation[f"s{i}"])
 
 
+# With a deadline, the best allocation so far is returned, and it is feasible even if the search has not converged
+def test_case_deadline():
+    # With this seed, the initial prices are not an equilibrium; tabu search needs 2 iterations to find one.
+    instance = Instance(valuations={"ami": {"x": 3, "y": 3, "z": 3}, "tami": {"x": 3, "y": 3, "z": 3}, "tzumi": {"x": 4, "y": 4, "z": 4}},
+                        agent_capacities=2, item_capacities={"x": 1, "y": 2, "z": 2})
+    kwargs = dict(initial_budgets={"ami": 4, "tami": 5, "tzumi": 2}, beta=5, delta={0.34})
+    for cancellation in [CancellationToken(deadline=0), CancellationToken(max_iterations=1)]:
+        random.seed(4341)
+        allocation = divide(tabu_search, instance=instance, cancellation=cancellation, **kwargs)
+        assert cancellation.converged is False
+        assert cancellation.iterations == 1
+        assert allocation == {"ami": ["x", "y"], "tami": ["y", "z"], "tzumi": []}   # the best allocation so far
+        for agent, bundle in allocation.items():   # the allocation may be wasteful, but it must be feasible
+            assert len(bundle) <= instance.agent_capacity(agent)
+        for item in instance.items:
+            assert sum(item in bundle for bundle in allocation.values()) <= instance.item_capacity(item)
+    random.seed(4341)
+    cancellation = CancellationToken(max_iterations=100)
+    allocation = divide(tabu_search, instance=instance, cancellation=cancellation, **kwargs)
+    assert cancellation.converged is True and cancellation.iterations == 2
+    assert allocation == {"ami": ["x", "y"], "tami": ["y", "z"], "tzumi": ["z"]}
+
+
 # def test_case__3_mini():
 #     utilities = {f"s{i}": {f"c{44 - j}": j for j in range(43, 0, -1)} for i in range(1, 44)}
 #     instance = Instance(valuations=utilities, agent_capacities=1, item_capacities=1)
@@ -26,6 +26,18 @@ def test_feasibility():
         fairpyx.validate_allocation(instance, allocation, title=f"Seed {i}")
 
 
+
+def test_sparse_valuations():
+    for i in range(NUM_OF_RANDOM_INSTANCES):
+        np.random.seed(i)
+        valuations = np.random.randint(1, 100, size=(30, 12)) * (np.random.uniform(size=(30, 12)) < 0.3)   # many zero values
+        instance = fairpyx.Instance(valuations=valuations, agent_capacities=np.random.randint(2, 5, size=30), item_capacities=np.full(12, 6))
+        allocation = fairpyx.divide(fairpyx.algorithms.utilitarian_matching, instance=instance)
+        sparse_allocation = fairpyx.divide(fairpyx.algorithms.utilitarian_matching, instance=instance.to_sparse())
+        assert allocation == sparse_allocation
+        fairpyx.validate_allocation(instance, sparse_allocation, title=f"Seed {i}, sparse")
+
+
 if __name__ == "__main__":
      pytest.main(["-v",__file__])
 